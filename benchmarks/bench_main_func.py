@@ -0,0 +1,270 @@
+""" Microbenchmarks of MainFunc stages on synthetic data (no network, no AWS).
+
+Imports functions/main-func.py with stubbed environment variables, replaces slack/elasticsearch
+writers with no-op functions and times parser, compare (columnar too if numpy is installed),
+notification and sqlite state store stages:
+    python benchmarks/bench_main_func.py                               # 1k and 10k clients
+    python benchmarks/bench_main_func.py --sizes 1000,1000000 --rounds 5
+    python benchmarks/bench_main_func.py --save-baseline               # store results as local baseline
+Every stage is timed as the fastest of --rounds rounds and divided by the fastest round of a fixed
+reference workload of the same size, run alternately with it, so results do not depend on machine speed.
+If a local baseline exists (benchmarks/baseline.json, not in git: save it before a change on the same
+machine), stage ratios are compared with it; stage slower than baseline by more than --max-regression is reported and makes exit
+code 1. High "reference drift" (machine load changed during the run) means results of the run are not reliable.
+"""
+import argparse
+import datetime
+import gc
+import importlib.util
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+import importtime_report
+
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+BENCH_TIME = '2019-05-06T19:41:32.000Z' # shared_main_time of every benchmark run
+HITS_PER_CLIENT = 18 # keepalive messages per client in 180 seconds
+MIN_ROUND_SECONDS = 0.05 # short stages are repeated in one round up to this time
+
+
+def load_main_func():
+    for key, value in importtime_report.STUB_ENV.items():
+        os.environ.setdefault(key, value)
+    os.environ.setdefault('func_state_store_path', ':memory:') # sqlite state store stages
+    spec = importlib.util.spec_from_file_location('main_func', importtime_report.FUNCTIONS['main-func'])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # no network: writers are replaced, stages above them run as in lambda
+    module.slack_notification_01 = lambda message_title, message_text, var_object=None: True
+    module.post_to_elastic_01 = lambda query, var_object, doc_id=None: True
+    module.emit_resilience_metrics_00 = lambda: {}
+    return module
+
+
+### Synthetic data:
+def make_var_object():
+    return {
+        'table_name'            : 'MonitoringService_clients_bench',
+        'elastic_url'           : 'https://localhost:9200',
+        'shared_main_time'      : BENCH_TIME,
+        'es_today_suffix_part'  : BENCH_TIME[:10],
+        'full_es_index_name'    : f'clientchecks-{BENCH_TIME[:10]}'
+    }
+
+
+def make_ddb_raw(clients, rnd):
+    """ DynamoDB scan response: ~70% active, ~30% absent with old status change and alerts """
+    items = []
+    for num in range(clients):
+        item = {
+            'client_id'             : { 'S': f'client-{num:07d}' },
+            'client_name'           : { 'S': f'name-{num}' },
+            'client_callcentername' : { 'S': f'callcenter-{num % 97}' },
+            'status'                : { 'S': 'active' if rnd.random() < 0.7 else 'absent' },
+            'last_status_change'    : { 'S': '2019-05-06T%02d:00:00.000Z' % rnd.randint(0, 19) },
+            'last_ka_alert_notify'  : { 'S': '2019-05-06T10:00:00.000Z' },
+            'last_restore_alert_notify' : { 'S': '2019-05-06T10:00:00.000Z' },
+            'last_still_dead_notify': { 'S': '2019-05-06T10:00:00.000Z' },
+            'last_update'           : { 'S': '2019-05-06T19:40:32.000Z' },
+            'pending_status'        : { 'S': 'active' },
+            'pending_count'         : { 'N': str(rnd.randint(0, 1)) },
+            'flap_count'            : { 'N': str(rnd.randint(0, 5)) }
+        }
+        items.append(item)
+    return { 'Items': items }
+
+
+def make_es_raw(clients, rnd):
+    """ Keepalive aggregation buckets (get_es_raw_data_01): ~80% of clients report, some of them less than count_compare_number """
+    buckets = []
+    for num in range(clients):
+        if rnd.random() > 0.8:
+            continue
+        hits_count = HITS_PER_CLIENT if rnd.random() < 0.9 else rnd.randint(1, 14)
+        buckets.append({
+            'key'           : { 'client_id': f'client-{num:07d}' },
+            'doc_count'     : hits_count,
+            'last_seen'     : { 'value_as_string': '2019-05-06T19:41:%02d.%03dZ' % (rnd.randint(0, 31), num % 1000) },
+            'client_info'   : { 'hits': { 'hits': [{ '_source': { 'machineData': {
+                'name'           : f'name-{num}',
+                'callCenterName' : f'callcenter-{num % 97}'
+            } } }] } }
+        })
+    return buckets
+
+
+### Measurement:
+def reference_workload(clients):
+    """ Fixed pure python work of the size of a stage (dict of formatted keys, sort): stage times are divided
+    by its time, machine speed and load cancel out of ratios to baseline """
+    counts = { f'client-{num:07d}': num % 97 for num in range(clients) }
+    return sorted(counts.items(), key=lambda each: (each[1], each[0]))
+
+
+def loops_per_round(func):
+    """ Calls of func in one timed round, so that short stages run at least MIN_ROUND_SECONDS (timer and scheduler noise) """
+    start = time.perf_counter()
+    func()
+    return max(1, int(MIN_ROUND_SECONDS / max(time.perf_counter() - start, 1e-9)))
+
+
+def timed_round(func, loops):
+    gc.collect()
+    start = time.perf_counter()
+    for _ in range(loops):
+        func()
+    return (time.perf_counter() - start) / loops
+
+
+def measure(func, reference, rounds):
+    """ Return sorted round times (seconds) of func, sorted round times of reference run right before
+    every round of func (same machine state) and tracemalloc peak (bytes) of one extra run of func """
+    loops, reference_loops = loops_per_round(func), loops_per_round(reference)
+    timings, reference_timings = [], []
+    for _ in range(rounds):
+        reference_timings.append(timed_round(reference, reference_loops))
+        timings.append(timed_round(func, loops))
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return sorted(timings), sorted(reference_timings), peak
+
+
+def bench_stages(module, clients, rounds):
+    """ Return list of benchmark results for all stages with given number of clients; reference workload
+    is timed with every stage, spread of its fastest runs over the stages is "reference_drift" of every stage """
+    rnd = random.Random(clients)
+    var_obj = make_var_object()
+    ddb_raw = make_ddb_raw(clients, rnd)
+    es_raw = make_es_raw(clients, rnd)
+    parsed_ddb = module.ddb_raw_data_parser_02(ddb_raw, var_obj)
+    parsed_es = module.es_raw_data_parser_keepalive_02(es_raw)
+    compared = module.compare_parsed_data_es_ddb_02(parsed_es, parsed_ddb, var_obj)
+    state_table = f'bench_{clients}'
+    state_elements = [{ name: element[name] for name in module.state_columns if name in element } for element in compared.values()]
+    module.write_elements_to_sqlite_01(state_elements, state_table, var_obj)
+
+    stages = (
+        ('ddb_raw_data_parser_02', len(ddb_raw['Items']),
+            lambda: module.ddb_raw_data_parser_02(ddb_raw, var_obj)),
+        ('es_raw_data_parser_keepalive_02', len(es_raw),
+            lambda: module.es_raw_data_parser_keepalive_02(es_raw)),
+        ('compare_parsed_data_es_ddb_02', len(parsed_ddb),
+            lambda: module.compare_parsed_data_es_ddb_02(parsed_es, parsed_ddb, var_obj)),
+        ('all_notification_02', len(compared),
+            lambda: module.all_notification_02(compared, var_obj)),
+        ('write_all_to_elastic_02', len(compared),
+            lambda: module.write_all_to_elastic_02(compared, var_obj)),
+        ('write_elements_to_sqlite_01', len(state_elements),
+            lambda: module.write_elements_to_sqlite_01(state_elements, state_table, var_obj)),
+        ('read_all_from_sqlite_01', len(state_elements),
+            lambda: module.read_all_from_sqlite_01(state_table))
+    )
+    if module.get_numpy_00() is not None: # optional columnar compare engine
+        stages += (('compare_columnar_02', len(parsed_ddb),
+            lambda: module.compare_columnar_02(parsed_es, parsed_ddb, var_obj)),)
+    reference = lambda: reference_workload(clients)
+    measured = [(stage_name, items) + measure(func, reference, rounds) for stage_name, items, func in stages]
+    reference_fastest = [reference_timings[0] for _, _, _, reference_timings, _ in measured]
+    reference_drift = max(reference_fastest) / min(reference_fastest)
+
+    results = []
+    for stage_name, items, timings, reference_timings, peak in measured:
+        reference_time = reference_timings[0]
+        results.append({
+            'name'      : f'{stage_name}[{clients}]',
+            'group'     : stage_name,
+            'params'    : { 'clients': clients, 'items': items },
+            'stats'     : {
+                'min'       : timings[0],
+                'max'       : timings[-1],
+                'mean'      : statistics.mean(timings),
+                'median'    : statistics.median(timings),
+                'rounds'    : rounds,
+                'ops'       : 1 / statistics.median(timings)
+            },
+            'extra_info': {
+                'items_per_second'  : items / timings[0],
+                'peak_alloc_bytes'  : peak,
+                'reference_ratio'   : timings[0] / reference_time,
+                'reference_drift'   : reference_drift
+            }
+        })
+        print(f'{stage_name:34} {clients:>8} clients {items:>9} items  '
+            f'min {timings[0] * 1000:10.2f} ms  {timings[0] / reference_time:8.2f}x reference  '
+            f'{items / timings[0]:14,.0f} items/s  peak {peak / 1048576:8.1f} MiB')
+    print(f'{"reference_workload":34} {clients:>8} clients  min {min(reference_fastest) * 1000:10.2f} ms  '
+        f'drift {reference_drift:5.2f}x')
+    return results
+
+
+def compare_with_baseline(results, baseline, max_regression):
+    """ Print reference ratio current/baseline per benchmark, return names slower than max_regression.
+    Reference drift (machine load changed during the run) is printed with the ratio """
+    baseline_results = { each['name']: each['extra_info'] for each in baseline.get('benchmarks', [])
+        if 'reference_ratio' in each.get('extra_info', {}) }
+    regressions = []
+    for each in results:
+        if each['name'] not in baseline_results:
+            continue
+        ratio = each['extra_info']['reference_ratio'] / baseline_results[each['name']]['reference_ratio']
+        each['extra_info']['baseline_ratio'] = ratio
+        marker = '  REGRESSION' if ratio > max_regression else ''
+        print(f'{each["name"]:50} {ratio:6.2f}x baseline  reference drift {each["extra_info"]["reference_drift"]:4.2f}x{marker}')
+        if ratio > max_regression:
+            regressions.append(each['name'])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000', help='comma separated numbers of clients, up to 1000000')
+    parser.add_argument('--rounds', type=int, default=10, help='runs per stage, fastest one counts')
+    parser.add_argument('--output', help='write results as json to this file')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='write results to --baseline')
+    parser.add_argument('--max-regression', type=float, default=1.3, help='allowed ratio to baseline, before reference drift')
+    parser.add_argument('--no-importtime', action='store_true', help='skip import-time profile')
+    args = parser.parse_args()
+
+    module = load_main_func()
+    results = []
+    for clients in [int(each) for each in args.sizes.split(',')]:
+        results.extend(bench_stages(module, clients, args.rounds))
+
+    report = {
+        'machine_info'  : { 'python': platform.python_version(), 'platform': platform.platform() },
+        'datetime'      : datetime.datetime.utcnow().isoformat(),
+        'benchmarks'    : results
+    }
+    if not args.no_importtime:
+        report['importtime'] = importtime_report.build_report(top_n=15)
+        importtime_report.print_report(report['importtime'])
+
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f'baseline saved to {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            regressions = compare_with_baseline(results, json.load(baseline_file), args.max_regression)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+""" Import-time profile of lambda functions (python -X importtime).
+
+Loads every functions/*.py file in a fresh interpreter with stubbed environment
+variables and reports the slowest imports, as:
+    python benchmarks/importtime_report.py [--top 15] [--output report.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS = {
+    'main-func'     : os.path.join(ROOT_DIR, 'functions', 'main-func.py'),
+    'support-func'  : os.path.join(ROOT_DIR, 'functions', 'support-func.py')
+}
+
+### Same variables as serverless.yml sets for deployed functions:
+STUB_ENV = {
+    'AWS_REGION'                : 'eu-west-1',
+    'DDB_table_name'            : 'MonitoringService_clients_bench',
+    'ES_domain_url'             : 'https://localhost:9200',
+    'support_func_name'         : 'KibanaService-Checks-support-bench',
+    'current_environment'       : 'bench',
+    'slack_notification_url'    : 'https://localhost/slack',
+    'func_log_level'            : 'WARNING',
+    'es_check_index_prefix'     : 'clientchecks'
+}
+
+LOAD_SNIPPET = ''.join((
+    'import importlib.util, sys;',
+    'spec = importlib.util.spec_from_file_location("lambda_func", sys.argv[1]);',
+    'module = importlib.util.module_from_spec(spec);',
+    'spec.loader.exec_module(module)'
+))
+
+
+def stub_env():
+    env = dict(os.environ)
+    for key, value in STUB_ENV.items():
+        env.setdefault(key, value)
+    return env
+
+
+def parse_importtime(stderr_text):
+    """ Parse lines like 'import time:   self [us] | cumulative | imported package' """
+    entries = []
+    for line in stderr_text.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        entries.append({
+            'module'        : name.strip(),
+            'self_us'       : int(self_us),
+            'cumulative_us' : int(cumulative_us)
+        })
+    return entries
+
+
+def profile_function(path):
+    """ Return import-time entries and wall time of loading one function file """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', LOAD_SNIPPET, path],
+        env=stub_env(), stderr=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True
+    )
+    if completed.returncode != 0:
+        raise Exception(f'profile_function: failed to load [{path}]: [{completed.stderr[-2000:]}]')
+    return parse_importtime(completed.stderr)
+
+
+def build_report(top_n):
+    report = {}
+    for func_name, path in FUNCTIONS.items():
+        entries = profile_function(path)
+        report[func_name] = {
+            'total_us'  : sum(each['self_us'] for each in entries),
+            'modules'   : len(entries),
+            'top'       : sorted(entries, key=lambda each: each['cumulative_us'], reverse=True)[:top_n]
+        }
+    return report
+
+
+def print_report(report):
+    for func_name, func_report in report.items():
+        print(f'## {func_name}: {func_report["modules"]} modules, {func_report["total_us"] / 1000:.1f} ms')
+        for each in func_report['top']:
+            print(f'  {each["cumulative_us"] / 1000:9.2f} ms  {each["module"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--top', type=int, default=15, help='number of slowest imports to report')
+    parser.add_argument('--output', help='write report as json to this file')
+    args = parser.parse_args()
+
+    report = build_report(args.top)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
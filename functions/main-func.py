@@ -1,11 +1,9 @@
-import boto3
 import json
 import datetime
 import time
-import requests
 import os
 import logging
-from requests_aws4auth import AWS4Auth
+import threading
 
 ### CONST:
 service = 'es' # for AWS4Auth
@@ -19,23 +17,474 @@ environment = os.environ['current_environment']
 slack_channel_notify = os.environ['slack_notification_url']
 log_level = os.environ['func_log_level']
 es_index_prefix = os.environ['es_check_index_prefix']
+keepalive_source = os.environ.get('es_keepalive_source', 'raw') # raw | rollup (maintained by support function) | stream (kept in state store by stream_handler)
+rollup_index_prefix = os.environ.get('es_rollup_index_prefix', 'rollup-keepalive')
+
+### OPTIONAL VARS (check targets):
+# json list of elasticsearch domain + DynamoDB table pairs checked concurrently by one invocation, e.g.
+# [{"name": "dev", "elastic_url": "https://search-...", "table_name": "MonitoringService_clients_dev",
+#   "support_func_name": "KibanaService-Checks-support-dev"}, {"name": "qa", ...}];
+# keys missing in a target (and empty list) fall back to MAIN VARS of this deployment
+check_targets_json = os.environ.get('func_check_targets', '')
+target_timeout_seconds = int(os.environ.get('func_target_timeout_seconds', '15')) # stop waiting for slow target (keep below lambda timeout)
+target_timeout_margin_seconds = float(os.environ.get('func_target_timeout_margin_seconds', '3')) # invocation time kept after target wait (results, metrics)
+target_max_workers = int(os.environ.get('func_target_max_workers', '8')) # targets checked at the same time
+
+### OPTIONAL VARS (profiling):
+profile_rate = float(os.environ.get('func_profile_rate', '0')) # share of invocations to profile, 0..1
+profile_top_n = int(os.environ.get('func_profile_top_n', '25')) # hot functions/allocation sites to log
+profile_dump = os.environ.get('func_profile_dump', 'false').lower() == 'true' # save raw profile to /tmp
+
+### OPTIONAL VARS (logging):
+log_payload_max_items = int(os.environ.get('func_log_payload_max_items', '10')) # bigger dicts/lists are logged as summary
+log_client_sample_rate = float(os.environ.get('func_log_client_sample_rate', '0.01')) # share of clients with per-client debug lines
+log_max_bytes = int(os.environ.get('func_log_max_bytes', '262144')) # log volume cap per invocation (ERROR is never dropped)
+
+### OPTIONAL VARS (outbound calls):
+# per endpoint: timeout (connect, read) seconds, retries after first attempt, hedge_after - seconds 
+# before duplicate request is sent for slow idempotent read (0 = no hedging);
+# override with json in func_resilience_policy, e.g. {"es_search": {"timeout": [2, 8]}}
+resilience_policy = {
+    "es_search" : { "timeout" : (2, 4),  "retries" : 2, "hedge_after" : 1.5 },
+    "es_write"  : { "timeout" : (2, 5),  "retries" : 2, "hedge_after" : 0 },
+    "slack"     : { "timeout" : (2, 3),  "retries" : 1, "hedge_after" : 0, "idempotent" : False },
+    "dynamodb"  : { "timeout" : (2, 4),  "retries" : 2, "hedge_after" : 0 },
+    "lambda"    : { "timeout" : (2, 10), "retries" : 1, "hedge_after" : 0, "idempotent" : False }
+} # "idempotent" False: request that may have been received (read timeout) is not sent again
+for policy_name, policy_override in json.loads(os.environ.get('func_resilience_policy', '{}')).items():
+    resilience_policy.setdefault(policy_name, {}).update(policy_override)
+backoff_base_seconds = 0.2 # full jitter: sleep random(0, min(backoff_max, base * 2**attempt))
+backoff_max_seconds = 2.0
+breaker_failure_threshold = 5 # consecutive failed calls before circuit opens
+breaker_open_seconds = 30 # skip dependency for this time, then let one trial call through
+deadline_margin_seconds = 1.0 # retry/hedge only if attempt (connect + read timeout) ends this long before invocation end
+http_pool_hosts = 20 # hosts (elasticsearch domains, slack) with kept-alive connections in shared http session
+http_pool_maxsize = 10 # kept-alive connections per host
 
 ### CONST:
 big_time_delta = datetime.timedelta(hours=12)
 small_time_delta = datetime.timedelta(seconds=300)
 still_dead_alert_interval = datetime.timedelta(seconds=1800)
+index_precheck_time = '23:45' # UTC HH:MM - check that next day index exists (created by support function in advance)
 count_compare_number = 15 # num of keepalive messages in time interval
+keepalive_window_seconds = 180 # raw source: keepalive messages of last N seconds are counted
+es_page_size = 1000 # clients per page of composite aggregation (elasticsearch reads of keepalive counts)
+es_time_format = "yyyy-MM-dd'T'HH:mm:ss.SSS'Z'" # last_seen of aggregations, same format as machineTimeUTC
+keepalive_window_minutes = 3 # stream source: keepalive counts of last N complete minutes and current one
+
+### OPTIONAL VARS (alerting):
+alert_hysteresis_runs = int(os.environ.get('func_alert_hysteresis_runs', '2')) # consecutive runs with new status before status flips
+min_realert_interval = { # no new alert of same kind for client earlier than this after previous one
+    "keepalive" : datetime.timedelta(seconds=int(os.environ.get('func_ka_realert_seconds', '900'))),
+    "restore"   : datetime.timedelta(seconds=int(os.environ.get('func_restore_realert_seconds', '900'))),
+    "stilldead" : still_dead_alert_interval
+}
+alert_group_max_names = int(os.environ.get('func_alert_group_max_names', '10')) # client names listed per call center in one alert
+alert_notify_fields = { # last notify time of alert kind, set only when slack message was sent
+    "keepalive" : 'last_ka_alert_notify',
+    "restore"   : 'last_restore_alert_notify',
+    "stilldead" : 'last_still_dead_notify'
+}
+
+### OPTIONAL VARS (tiering):
+# clients not seen in elasticsearch are checked by tier: hot - every run, warm/cold - every N minutes;
+# client seen in elasticsearch is always checked (promoted at once)
+tier_interval_minutes = {
+    "hot"   : 1,
+    "warm"  : int(os.environ.get('func_tier_warm_minutes', '5')),
+    "cold"  : int(os.environ.get('func_tier_cold_minutes', '60'))
+}
+hot_tier_age = datetime.timedelta(seconds=int(os.environ.get('func_tier_hot_seconds', '1800'))) # absent shorter than this is hot
+
+### OPTIONAL VARS (compare engine):
+# python - per-client loop (compare_parsed_data_es_ddb_02); columnar - numpy columns for whole fleet
+# (compare_columnar_02, same results), falls back to python if numpy is not in lambda layer
+compare_engine = os.environ.get('func_compare_engine', 'python') # python | columnar
+
+### OPTIONAL VARS (enrollment):
+enroll_batch_size = int(os.environ.get('func_enroll_batch_size', '500')) # new clients per async support function call
+enroll_resend_interval = datetime.timedelta(seconds=300) # do not send same new client to support function more often
+
+### OPTIONAL VARS (state store):
+# dynamodb - lambda deployment; sqlite - embedded database file for local/daemon runs and benchmarks,
+# new clients are enrolled by this function directly (support function writes DynamoDB only)
+state_store_backend = os.environ.get('func_state_store', 'dynamodb') # dynamodb | sqlite
+state_store_path = os.environ.get('func_state_store_path', '/tmp/client-state.sqlite3') # sqlite file (":memory:" for benchmarks)
+ddb_read_mode = os.environ.get('func_ddb_read_mode', 'scan') # scan - full table every run | indexed - see read_client_state_02
+ddb_full_read_minutes = int(os.environ.get('func_ddb_full_read_minutes', '60')) # indexed mode: full table read every N minutes
+ddb_status_index = 'status-last_status_change-index' # sparse GSI: HASH status, RANGE last_status_change (created by support function)
+state_columns = { # client state record: column -> sqlite type; DynamoDB items have same attributes
+    "client_id"                 : "TEXT PRIMARY KEY",
+    "client_name"               : "TEXT",
+    "client_callcentername"     : "TEXT",
+    "status"                    : "TEXT",
+    "last_status_change"        : "TEXT",
+    "last_ka_alert_notify"      : "TEXT",
+    "last_restore_alert_notify" : "TEXT",
+    "last_still_dead_notify"    : "TEXT",
+    "last_update"               : "TEXT",
+    "pending_status"            : "TEXT",
+    "pending_count"             : "INTEGER",
+    "flap_count"                : "INTEGER",
+    "version"                   : "INTEGER",
+    "last_time_active"          : "TEXT",   # stream source: written by stream_handler only
+    "ka_buckets"                : "TEXT",   # stream source: json "YYYY-MM-DDTHH:MM" -> keepalive count
+    "ka_version"                : "INTEGER" # stream source: incremented by every keepalive write (optimistic concurrency)
+}
+stream_columns = ('last_time_active', 'ka_buckets', 'ka_version') # keepalive state, not part of compare elements
+state_conflict_retries = 3 # DynamoDB: re-read and merge client changed by other writer this many times, then give up
 
 ### GLOBAL context:
-credentials = boto3.Session().get_credentials() # Get AWS credentials for services authorization 
-awsauth = AWS4Auth(
-    credentials.access_key, 
-    credentials.secret_key, 
-    region, 
-    service, 
-    session_token=credentials.token)
+# boto3, requests and requests_aws4auth are imported on first use; modules, clients and
+# credentials are cached here and reused by warm invocations
+lazy_context = {}
 logger = logging.getLogger() # Set up logger for all execution:
 logger.setLevel(log_level) 
+log_budget = { "bytes" : 0, "dropped" : 0 } # reset on every invocation by reset_log_budget_00
+circuit_breakers = {} # "endpoint:target" -> { "failures" : N, "open_until" : epoch }, kept between warm invocations
+resilience_metrics = {} # "endpoint:target" -> counters, reset on every invocation by emit_resilience_metrics_00
+shared_state_lock = threading.Lock() # log_budget, circuit_breakers and resilience_metrics are changed by target and hedge threads
+invocation_deadline = { "epoch" : None } # end of current invocation (lambda context), None for local runs
+profile_session = { "thread_profilers" : None } # list while run is profiled: check_target_03 threads add own profilers
+absent_clients_cache = {} # table_name -> client_id -> "absent" entry of clientchecks document, since last full read (warm container)
+enroll_requested = {} # table_name -> client_id -> time when it was sent to support function for enrollment (warm container)
+
+
+### LAZY context level 00:
+def get_boto3_00():
+    if 'boto3' not in lazy_context:
+        import boto3
+        lazy_context['boto3'] = boto3
+    return lazy_context['boto3']
+
+def get_boto_config_00(policy_name):
+    """ botocore config with timeouts from resilience_policy; botocore retries are off, 
+    retries/backoff are done by resilient_call_00 """
+    from botocore.config import Config
+    connect_timeout, read_timeout = resilience_policy[policy_name]['timeout']
+    return Config(connect_timeout=connect_timeout, read_timeout=read_timeout, retries={ 'max_attempts' : 0 })
+
+def get_aws_client_00(service_name):
+    """ Return cached boto3 low-level client for given service (dynamodb, lambda, ...) """
+    key = f'client:{service_name}'
+    if key not in lazy_context:
+        lazy_context[key] = get_boto3_00().client(service_name, region_name=region,
+            config=get_boto_config_00(service_name))
+    return lazy_context[key]
+
+def get_ddb_table_00(table_name):
+    """ Return cached boto3 DynamoDB Table resource """
+    key = f'table:{table_name}'
+    if key not in lazy_context:
+        if 'resource:dynamodb' not in lazy_context:
+            lazy_context['resource:dynamodb'] = get_boto3_00().resource('dynamodb', region_name=region,
+                config=get_boto_config_00('dynamodb'))
+        lazy_context[key] = lazy_context['resource:dynamodb'].Table(table_name)
+    return lazy_context[key]
+
+def get_http_session_00():
+    """ Return cached requests session, keeps connections to elasticsearch/slack open between calls """
+    if 'http_session' not in lazy_context:
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=http_pool_hosts, pool_maxsize=http_pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        lazy_context['http_session'] = session
+    return lazy_context['http_session']
+
+def get_numpy_00():
+    """ Return numpy module or None if not installed (optional dependency of columnar compare engine) """
+    if 'numpy' not in lazy_context:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+            logger.warning('get_numpy_00: numpy is not installed, columnar compare engine falls back to python')
+        lazy_context['numpy'] = numpy
+    return lazy_context['numpy']
+
+def get_sqlite_00(table_name):
+    """ Return cached sqlite connection (WAL journal, shared by threads under lazy_context['sqlite_lock'])
+    with state table table_name created/migrated: missing columns of state_columns are added """
+    import sqlite3
+    if 'sqlite' not in lazy_context:
+        connection = sqlite3.connect(state_store_path, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        lazy_context['sqlite'] = connection
+        lazy_context['sqlite_lock'] = threading.Lock()
+    connection = lazy_context['sqlite']
+    key = f'sqlite_table:{table_name}'
+    if key not in lazy_context:
+        with lazy_context['sqlite_lock'], connection:
+            columns = ', '.join(f'"{name}" {column_type}' for name, column_type in state_columns.items())
+            connection.execute(f'CREATE TABLE IF NOT EXISTS "{table_name}" ({columns})')
+            existing = set(row[1] for row in connection.execute(f'PRAGMA table_info("{table_name}")'))
+            for name, column_type in state_columns.items():
+                if name not in existing:
+                    connection.execute(f'ALTER TABLE "{table_name}" ADD COLUMN "{name}" {column_type}')
+            connection.execute(f'CREATE INDEX IF NOT EXISTS "{table_name}_status" ON "{table_name}" (status, last_status_change)')
+            connection.execute(f'CREATE INDEX IF NOT EXISTS "{table_name}_last_update" ON "{table_name}" (last_update)')
+        lazy_context[key] = True
+    return connection
+
+def get_awsauth_00():
+    """ Return cached AWS4Auth signer, get AWS credentials for services authorization on first call """
+    if 'awsauth' not in lazy_context:
+        from requests_aws4auth import AWS4Auth
+        credentials = get_boto3_00().Session().get_credentials()
+        lazy_context['awsauth'] = AWS4Auth(
+            credentials.access_key, 
+            credentials.secret_key, 
+            region, 
+            service, 
+            session_token=credentials.token)
+    return lazy_context['awsauth']
+
+
+### RESILIENCE level 00:
+def metric_inc_00(key, name, value=1):
+    with shared_state_lock:
+        counters = resilience_metrics.setdefault(key, {
+            "calls" : 0, "failures" : 0, "retries" : 0, "hedges" : 0, "hedge_wins" : 0, 
+            "breaker_opened" : 0, "short_circuited" : 0, "conflicts" : 0
+        })
+        counters[name] += value
+
+def breaker_allows_00(key):
+    """ Closed or half-open (open time passed) breaker lets call through """
+    with shared_state_lock:
+        breaker = circuit_breakers.get(key)
+        return breaker is None or breaker['open_until'] <= time.time()
+
+def breaker_record_00(key, success):
+    with shared_state_lock:
+        breaker = circuit_breakers.setdefault(key, { "failures" : 0, "open_until" : 0 })
+        if success:
+            breaker['failures'] = 0
+            breaker['open_until'] = 0
+            return
+        breaker['failures'] += 1
+        opened = breaker['failures'] >= breaker_failure_threshold
+        if opened:
+            breaker['open_until'] = time.time() + breaker_open_seconds
+    if opened:
+        metric_inc_00(key, 'breaker_opened')
+        logger.error(f'breaker_record_00: circuit for [{key}] is OPEN for [{breaker_open_seconds}] seconds')
+
+def set_invocation_deadline_00(context):
+    """ Save end time of this invocation from lambda context (no context: no deadline) """
+    remaining = getattr(context, 'get_remaining_time_in_millis', None)
+    invocation_deadline['epoch'] = time.time() + remaining() / 1000 if remaining is not None else None
+
+def deadline_allows_00(policy):
+    """ True if one more attempt of policy can end deadline_margin_seconds before invocation end """
+    deadline = invocation_deadline['epoch']
+    return deadline is None or deadline - time.time() >= sum(policy.get('timeout', (0, 0))) + deadline_margin_seconds
+
+def get_hedge_executor_00():
+    """ Created by warm_shared_context_02 before target threads start (single target: on first hedged call) """
+    if 'hedge_executor' not in lazy_context:
+        from concurrent.futures import ThreadPoolExecutor
+        lazy_context['hedge_executor'] = ThreadPoolExecutor(max_workers=8)
+    return lazy_context['hedge_executor']
+
+def hedged_call_00(key, hedge_after, func, *args, **kwargs):
+    """ Run func; if no result after hedge_after seconds, send duplicate call and
+    return whichever finishes first (only for idempotent reads) """
+    from concurrent.futures import wait, FIRST_COMPLETED
+    executor = get_hedge_executor_00()
+    primary = executor.submit(func, *args, **kwargs)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        return primary.result()
+    metric_inc_00(key, 'hedges')
+    hedge = executor.submit(func, *args, **kwargs)
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in sorted(done, key=lambda each: each.exception() is not None):
+            if future.exception() is None or not pending:
+                if future is hedge and future.exception() is None:
+                    metric_inc_00(key, 'hedge_wins')
+                return future.result()
+
+def resilient_call_00(policy_name, target, func, *args, should_retry=None, final_error=None, **kwargs):
+    """ Call func with retries (exponential backoff, full jitter), hedging from resilience_policy
+    and circuit breaker per "policy_name:target". should_retry(result) marks bad results (e.g. HTTP 5xx)
+    to be retried like exceptions; last result/exception is returned/raised when retries are over.
+    final_error(exception) marks answers of healthy dependency (e.g. failed condition): raised at once, no retry.
+    Policy with "idempotent" False (slack message, lambda invoke) retries only exceptions of requests that were
+    not received or were refused (retry_safe_00), never read timeouts.
+    No retry or hedge is started when attempt would not end before invocation deadline (deadline_allows_00) """
+    import random
+    key = f'{policy_name}:{target}'
+    policy = resilience_policy[policy_name]
+    if not breaker_allows_00(key):
+        metric_inc_00(key, 'short_circuited')
+        raise Exception(f'resilient_call_00: circuit for [{key}] is open, call skipped')
+    for attempt in range(policy['retries'] + 1):
+        metric_inc_00(key, 'calls')
+        if attempt > 0:
+            metric_inc_00(key, 'retries')
+            time.sleep(random.uniform(0, min(backoff_max_seconds, backoff_base_seconds * (2 ** attempt))))
+        try:
+            if policy['hedge_after'] and deadline_allows_00(policy):
+                result = hedged_call_00(key, policy['hedge_after'], func, *args, **kwargs)
+            else:
+                result = func(*args, **kwargs)
+        except Exception as e:
+            if final_error is not None and final_error(e):
+                breaker_record_00(key, True)
+                raise
+            metric_inc_00(key, 'failures')
+            if attempt == policy['retries'] or not deadline_allows_00(policy) or \
+                    not (policy.get('idempotent', True) or retry_safe_00(e)):
+                breaker_record_00(key, False)
+                raise
+            log_event_00(logging.WARNING, 'resilient_call_00', 'Call failed, retry', key=key, attempt=attempt, exception=e)
+            continue
+        if should_retry is not None and should_retry(result):
+            metric_inc_00(key, 'failures')
+            if attempt == policy['retries'] or not deadline_allows_00(policy):
+                breaker_record_00(key, False)
+                return result
+            log_event_00(logging.WARNING, 'resilient_call_00', 'Bad result, retry', key=key, attempt=attempt)
+            continue
+        breaker_record_00(key, True)
+        return result
+
+def retry_safe_00(exception):
+    """ True if request of exception was not received (connection not established) or was refused by
+    throttling / server error, so a non-idempotent call can be sent again. Read timeouts and connections
+    lost after sending are not safe: the request may have been executed.
+    requests: ConnectTimeout, ConnectionError caused by NewConnectionError; botocore: ConnectTimeoutError,
+    EndpointConnectionError, ClientError with HTTP status 429 or 5xx """
+    reason = getattr(exception.args[0], 'reason', None) if exception.args else None
+    names = set(each.__name__ for each in type(exception).__mro__ + type(reason).__mro__)
+    if names & { 'ConnectTimeout', 'ConnectTimeoutError', 'EndpointConnectionError', 'NewConnectionError' }:
+        return 'ReadTimeoutError' not in names
+    response = getattr(exception, 'response', None)
+    status_code = response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) if isinstance(response, dict) else 0
+    return status_code >= 500 or status_code == 429
+
+def ddb_condition_failed_00(exception):
+    """ True for DynamoDB ConditionalCheckFailedException (botocore ClientError) """
+    return getattr(exception, 'response', {}).get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+def http_retryable_00(response):
+    return response.status_code >= 500 or response.status_code == 429
+
+def http_request_00(policy_name, method, url, **kwargs):
+    """ HTTP call through shared session with timeout/retries/breaker of policy_name,
+    breaker and metrics are kept per host (elasticsearch domain, slack) """
+    from urllib.parse import urlsplit
+    kwargs.setdefault('timeout', tuple(resilience_policy[policy_name]['timeout']))
+    return resilient_call_00(policy_name, urlsplit(url).netloc, get_http_session_00().request,
+        method, url, should_retry=http_retryable_00, **kwargs)
+
+def emit_resilience_metrics_00():
+    """ Print counters of this invocation in CloudWatch embedded metric format and reset them """
+    metrics = {}
+    with shared_state_lock:
+        current_metrics = dict(resilience_metrics)
+        resilience_metrics.clear()
+    for key, counters in current_metrics.items():
+        metrics[key] = dict(counters)
+        print(json.dumps({
+            "_aws" : {
+                "Timestamp" : int(time.time() * 1000),
+                "CloudWatchMetrics" : [{
+                    "Namespace"  : "ClientChecks",
+                    "Dimensions" : [["Environment", "Dependency"]],
+                    "Metrics"    : [{ "Name" : name, "Unit" : "Count" } for name in counters]
+                }]
+            },
+            "Environment" : environment,
+            "Dependency"  : key,
+            **counters
+        }))
+    return metrics
+
+
+### LOGGING level 00:
+def summarize_payload_00(payload):
+    """ Return payload as is if small, otherwise short summary: type, length and first keys/items """
+    if isinstance(payload, (set, frozenset)):
+        payload = sorted(payload, key=str)
+    if isinstance(payload, dict) and len(payload) > log_payload_max_items:
+        return {
+            "type"          : "dict",
+            "len"           : len(payload),
+            "sample_keys"   : [str(key) for key in list(payload)[:log_payload_max_items]]
+        }
+    if isinstance(payload, (list, set, tuple)) and len(payload) > log_payload_max_items:
+        return {
+            "type"          : type(payload).__name__,
+            "len"           : len(payload),
+            "sample"        : [str(item) for item in list(payload)[:log_payload_max_items]]
+        }
+    if isinstance(payload, str) and len(payload) > 512:
+        return payload[:512] + f'...<{len(payload)} chars>'
+    return payload
+
+def log_event_00(level, func_name, message, **fields):
+    """ Write one structured (json) log line. Nothing is formatted if level is disabled;
+    fields are summarized by summarize_payload_00 and volume is capped by log_max_bytes """
+    if not logger.isEnabledFor(level):
+        return
+    record = { "func" : func_name, "msg" : message }
+    for key, value in fields.items():
+        record[key] = summarize_payload_00(value)
+    line = json.dumps(record, default=str)
+    with shared_state_lock:
+        if level < logging.ERROR and (log_budget['bytes'] + len(line)) > log_max_bytes:
+            log_budget['dropped'] += 1
+            return
+        log_budget['bytes'] += len(line)
+    logger.log(level, line)
+
+def client_sampled_00(client_id):
+    """ Stable per-client sampling: the same clients get debug lines on every run """
+    if log_client_sample_rate >= 1:
+        return True
+    import zlib
+    return (zlib.crc32(str(client_id).encode()) % 10000) < (log_client_sample_rate * 10000)
+
+def log_client_00(level, func_name, message, client_id, **fields):
+    """ Per-client log line, written only for sampled clients """
+    if logger.isEnabledFor(level) and client_sampled_00(client_id):
+        log_event_00(level, func_name, message, client_id=client_id, **fields)
+
+def reset_log_budget_00():
+    with shared_state_lock:
+        dropped = log_budget['dropped']
+        log_budget['bytes'] = 0
+        log_budget['dropped'] = 0
+    return dropped
+
+def profiled_call_00(func, *args):
+    """ Run func under own cProfile when run is profiled (cProfile sees only the thread which enabled it);
+    profiler of finished call is added to profile_session and merged by run_with_profiling_03 """
+    thread_profilers = profile_session['thread_profilers']
+    if thread_profilers is None:
+        return func(*args)
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func(*args)
+    finally:
+        profiler.disable()
+        thread_profilers.append(profiler)
+
+def timing_mark_00(timings, stage_name, started):
+    """ Save seconds since started as timings[stage_name], return start time of next stage """
+    now = time.perf_counter()
+    timings[stage_name] = round(now - started, 4)
+    return now
 
 
 ### FUNCTIONS level 01:
@@ -49,9 +498,9 @@ def time_to_str_01(datetime_object):
     return datetime_object.strftime('%Y-%m-%dT%H:%M:%S.000Z')
 
 def check_ddb_table_exist_01(table_name):
-    client_ddb = boto3.client('dynamodb')
+    client_ddb = get_aws_client_00('dynamodb')
     try:
-        response = client_ddb.describe_table(TableName=table_name)
+        response = resilient_call_00('dynamodb', table_name, client_ddb.describe_table, TableName=table_name)
         logger.info(f'check_ddb_table_exist_01: Table [{table_name}] exists')
         return True
     except:
@@ -63,7 +512,7 @@ def check_es_index_exists_01(es_url, index_name):
     # ES 6.x requires an explicit Content-Type header
     headers = { "Content-Type": "application/json" }
     # Make the signed HTTP request
-    response = requests.get(full_url, auth=awsauth, headers=headers)
+    response = http_request_00('es_search', 'GET', full_url, auth=get_awsauth_00(), headers=headers)
     if response.status_code == 404:
         logger.info(' '.join((f'check_es_index_exists_01: Return elastic index [{index_name}]',
             f'DOES NOT exist in elasticsearch cluster'
@@ -75,41 +524,47 @@ def check_es_index_exists_01(es_url, index_name):
             )))
         return True
 
-def invoke_support_func_01(json_load,asynccall=False):
+def invoke_support_func_01(json_load,asynccall=False,func_name=None):
     # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/lambda.html#Lambda.Client.invoke
-    logger.debug(' '.join((f'invoke_support_func_01: called with payload [{json_load}]',
-        f'and asynccall as [{asynccall}]'
-        )))
+    func_name = func_name or support_func_name
+    # id_list of enrollment can hold thousands of clients: summarized by log_event_00
+    log_event_00(logging.DEBUG, 'invoke_support_func_01', 'Called', function=func_name, asynccall=asynccall,
+        invoke_type=json_load.get('invoke_type'), id_list=json_load.get('id_list'))
     invoketype = 'Event' if asynccall else 'RequestResponse'
     # if asynccall: 
     #     invoketype = 'Event' # asyncronous call
     # else:
     #     invoketype = 'RequestResponse' # sync call 
-    client = boto3.client('lambda')
-    response = client.invoke(
-        FunctionName    = support_func_name,
+    client = get_aws_client_00('lambda')
+    response = resilient_call_00('lambda', func_name, client.invoke,
+        FunctionName    = func_name,
         InvocationType  = invoketype,
         Payload         = json.dumps(json_load)
     )
     logger.info(' '.join((f'invoke_support_func_01: Return payload from invoked',
-        f'support lambda function [{support_func_name}]'
+        f'support lambda function [{func_name}]'
         )))
     return response['StatusCode']
     # return json.loads(response['Payload'].read().decode())
 
-def generate_invoke_payload_01(invoke_target):
-    """ Function returns json format payload to call support lambda function """
-    allowed_values = (
-        'init',
-        'update',
-        'index_create',
-        'id_list_update'
-    )
+def generate_invoke_payload_01(invoke_target, id_list=None):
+    """ Function returns json format payload to call support lambda function.
+    "invoke_type" is the field support function dispatches on; id_list (for 'id_list_update') is
+    { client_id : { "client_id" : ..., "client_name" : ..., "client_callcentername" : ... } } """
+    allowed_values = {
+        'init'              : 'init',
+        'update'            : 'update',
+        'index_create'      : 'index_create',
+        'id_list_update'    : 'update_ids_list'
+    }
     if invoke_target in allowed_values:
         logger.info(' '.join((f'generate_invoke_payload_01: Return [{invoke_target}] \
             as agrument to call support function'
             )))
-        return { "why_call_me" : invoke_target }
+        payload = { "why_call_me" : invoke_target, "invoke_type" : allowed_values[invoke_target] }
+        if id_list is not None:
+            payload['id_list'] = id_list
+        return payload
     else:
         logger.error(' '.join((f'generate_invoke_payload_01: argument for support',
             f'function [{invoke_target}] is not supported. Allowed values [{allowed_values}]'
@@ -133,8 +588,8 @@ def get_raw_data_from_ddb_01(table_name):
             etc....
     }
     """    
-    client = boto3.client('dynamodb')
-    response = client.scan(
+    client = get_aws_client_00('dynamodb')
+    response = ddb_read_pages_01(table_name, client.scan,
         TableName=table_name
         #ReturnConsumedCapacity='TOTAL'
     )
@@ -144,6 +599,63 @@ def get_raw_data_from_ddb_01(table_name):
     
     return response
 
+def ddb_read_pages_01(table_name, operation, **kwargs):
+    """ Call DynamoDB scan/query page by page (1 MB each) until LastEvaluatedKey is empty,
+    return items of all pages as { "Items" : [...] } """
+    items = []
+    while True:
+        response = resilient_call_00('dynamodb', table_name, operation, **kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return { 'Items': items }
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def get_relevant_data_from_ddb_01(table_name, es_ids, var_object):
+    """ Read only clients which can change status or alert in this run, in scan format:
+    active and absent since big_time_delta (queries of ddb_status_index), other ids seen in
+    elasticsearch (BatchGetItem, 100 keys per request). Ids not found anywhere are new clients """
+    client = get_aws_client_00('dynamodb')
+    since = time_to_str_01(str_to_time_01(var_object['shared_main_time']) - big_time_delta)
+    items = ddb_read_pages_01(table_name, client.query,
+        TableName                   = table_name,
+        IndexName                   = ddb_status_index,
+        KeyConditionExpression      = '#sts = :sts',
+        ExpressionAttributeNames    = { '#sts': 'status' },
+        ExpressionAttributeValues   = { ':sts': { 'S': 'active' } }
+    )['Items']
+    items.extend(ddb_read_pages_01(table_name, client.query,
+        TableName                   = table_name,
+        IndexName                   = ddb_status_index,
+        KeyConditionExpression      = '#sts = :sts AND #tlsc >= :since',
+        ExpressionAttributeNames    = { '#sts': 'status', '#tlsc': 'last_status_change' },
+        ExpressionAttributeValues   = { ':sts': { 'S': 'absent' }, ':since': { 'S': since } }
+    )['Items'])
+    queried = len(items)
+    found_ids = set(item['client_id']['S'] for item in items)
+    missing_ids = [client_id for client_id in es_ids if client_id not in found_ids]
+    items.extend(get_ids_from_ddb_01(table_name, missing_ids)['Items'])
+    log_event_00(logging.INFO, 'get_relevant_data_from_ddb_01', 'Return clients by status index and ids from elasticsearch',
+        table=table_name, queried=queried, batch_get=len(items) - queried, es_ids_not_queried=len(missing_ids))
+    return { 'Items': items }
+
+def get_ids_from_ddb_01(table_name, client_ids, consistent=False):
+    """ Clients with given ids in scan format (BatchGetItem, 100 keys per request, unprocessed keys
+    are requested again), ids not in table are left out """
+    client = get_aws_client_00('dynamodb')
+    items = []
+    for start in range(0, len(client_ids), 100):
+        request = { table_name: {
+            'Keys'          : [{ 'client_id': { 'S': client_id } } for client_id in client_ids[start:start + 100]],
+            'ConsistentRead': consistent
+        } }
+        while request:
+            response = resilient_call_00('dynamodb', table_name, client.batch_get_item, RequestItems=request)
+            items.extend(response['Responses'].get(table_name, []))
+            request = response.get('UnprocessedKeys')
+            if request:
+                time.sleep(backoff_base_seconds)
+    return { 'Items': items }
+
 def raw_ddb_data_empty_01(ddb_raw_data):
     if len(ddb_raw_data['Items']) == 0:
         logger.warning(' '.join((f'raw_ddb_data_empty_01: Get empty response from DynamoDB',
@@ -174,10 +686,15 @@ def ddb_raw_data_parser_02(ddb_raw_list,var_object):
             "last_ka_alert_notify"      : "2019-03-03T12:25:43.434Z",
             "last_restore_alert_notify" : "2019-03-03T12:25:43.434Z",
             "last_still_dead_notify"    : "2019-03-03T12:25:43.434Z",
-            "last_update"               : "2019-03-03T12:25:43.434Z" 
+            "last_update"               : "2019-03-03T12:25:43.434Z",
+            "pending_status"            : "active" | "absent",          # status seen in last runs, not applied yet (hysteresis)
+            "pending_count"             : 1,                            # consecutive runs with pending_status
+            "flap_count"                : 7,                            # how many times status flipped
+            "version"                   : 12                            # incremented by every write (optimistic concurrency)
         },
         ...
     }
+    "update_ddb" is True if record misses fields (defaults applied) and has to be written back.
     """
     current_time = str_to_time_01(var_object['shared_main_time'])
     temp_dict = {}
@@ -205,12 +722,12 @@ def ddb_raw_data_parser_02(ddb_raw_list,var_object):
             temp_dict[current_id]['last_status_change'] = time_to_str_01(current_time) 
         try:
             temp_dict[current_id]['last_ka_alert_notify'] = each['last_ka_alert_notify']['S']
-        except: # if not set - apply the oldest point of time (big check)
-            temp_dict[current_id]['last_ka_alert_notify'] = time_to_str_01(current_time)
+        except: # if not set - apply the oldest point of time (big check), first alert is never held by min_realert_interval
+            temp_dict[current_id]['last_ka_alert_notify'] = time_to_str_01(current_time - big_time_delta)
         try:
             temp_dict[current_id]['last_restore_alert_notify'] = each['last_restore_alert_notify']['S']
         except: # if not set - apply the oldest point of time (big check)
-            temp_dict[current_id]['last_restore_alert_notify'] = time_to_str_01(current_time)
+            temp_dict[current_id]['last_restore_alert_notify'] = time_to_str_01(current_time - big_time_delta)
         try:
             temp_dict[current_id]['last_still_dead_notify'] = each['last_still_dead_notify']['S']
         except: # if not set - apply the oldest point of time (big check)
@@ -219,73 +736,190 @@ def ddb_raw_data_parser_02(ddb_raw_list,var_object):
             temp_dict[current_id]['last_update'] = each['last_update']['S']
         except: # if not set - apply current time
             temp_dict[current_id]['last_update'] = time_to_str_01(current_time) 
+            temp_dict[current_id]['update_ddb'] = True
+        try:
+            temp_dict[current_id]['pending_status'] = each['pending_status']['S']
+            temp_dict[current_id]['pending_count'] = int(each['pending_count']['N'])
+        except: # no status seen yet
+            temp_dict[current_id]['pending_status'] = temp_dict[current_id]['status']
+            temp_dict[current_id]['pending_count'] = 0
+        try:
+            temp_dict[current_id]['flap_count'] = int(each['flap_count']['N'])
+        except:
+            temp_dict[current_id]['flap_count'] = 0
+        try:
+            temp_dict[current_id]['version'] = int(each['version']['N'])
+        except: # written before versioning or enrolled only
+            temp_dict[current_id]['version'] = 0
 
-    logger.info(' '.join((f'ddb_raw_data_parser_02: Return parsed list of DynamoDB',
-        f'Returned : [{temp_dict}]'
-        )))
+    log_event_00(logging.INFO, 'ddb_raw_data_parser_02', 'Return parsed list of DynamoDB clients',
+        clients_count=len(temp_dict), clients=temp_dict)
     return temp_dict
 
+def es_search_checked_01(url, query):
+    """ Elasticsearch search that fails loudly on error answer, timeout or failed shards: partial
+    result would make clients left out look silent (observed absent, KEEPALIVE alerts) """
+    headers = { "Content-Type": "application/json" } # ES 6.x requires an explicit Content-Type header
+    response = http_request_00('es_search', 'GET', url, auth=get_awsauth_00(), headers=headers, data=json.dumps(query))
+    body = response.json()
+    if response.status_code != 200 or body.get('timed_out') or body.get('_shards', {}).get('failed', 0) != 0:
+        raise Exception(' '.join((f'es_search_checked_01: incomplete answer from [{url}], status [{response.status_code}],',
+            f'timed_out [{body.get("timed_out")}], shards [{body.get("_shards")}], error [{body.get("error")}]'
+            )))
+    return body
+
+def es_hits_total_00(body):
+    """ hits.total of ES 6.x (number) and 7.x ({ "value", "relation" }; lower bound is returned as None) """
+    total = body['hits']['total']
+    if isinstance(total, dict):
+        return total['value'] if total.get('relation', 'eq') == 'eq' else None
+    return total
+
+def es_client_buckets_01(url, query):
+    """ All buckets of composite aggregation "clients" of query, es_page_size per request (after_key paging).
+    Documents of buckets must add up to hits.total of first page (range of query has fixed lower bound,
+    so documents indexed later can only add to it): otherwise exception, clients would be missing """
+    composite = query['aggs']['clients']['composite']
+    buckets = []
+    first_total = None
+    while True:
+        body = es_search_checked_01(url, query)
+        if first_total is None:
+            first_total = es_hits_total_00(body)
+        page = body['aggregations']['clients']['buckets']
+        buckets.extend(page)
+        if len(page) < composite['size']:
+            break
+        composite['after'] = body['aggregations']['clients'].get('after_key', page[-1]['key'])
+    collected = sum(bucket['doc_count'] for bucket in buckets)
+    if first_total is not None and collected < first_total:
+        raise Exception(' '.join((f'es_client_buckets_01: [{collected}] documents in client buckets of [{url}],',
+            f'search matched [{first_total}]; result is truncated'
+            )))
+    return buckets
+
 def get_es_raw_data_01(host_url):
-    """ Function get raw json from elasticsearch with all messages for last N seconds as:
-    {
-    "took": 144,
-    "timed_out": false,
-    "_shards": {
-        "total": 96,
-        "successful": 96,
-        "failed": 0
-    },
-    "hits": {
-        "total": 10229,
-        "max_score": 1,
-        "hits": [
+    """ Function get per-client keepalive counts for last keepalive_window_seconds from keepalive indices
+    (composite aggregation, all pages, see es_client_buckets_01) as list of buckets:
+    [
         {
-            "_index": "keepalive-2019-05-06",
-            "_type": "logs",
-            "_id": "49593744063285510971078362215836050046374402535521779714.0",
-            "_score": 1,
-            "_source": {
-            "logType": "Keepalive",
-            "machineData": {
-                "name": "mx-edomex-t-c-lite-06",
-                "callCenterName": "MX-edomex-T-c-Lite",
-                "machineTimeUTC": "2019-05-06T19:41:32.653Z",
-                "id": "295a5ff3-a1d8-4705-9cfe-ffebd0a2e344",
-                "stack": "prod",
-                "machineTime": "2019-05-06T14:41:32.653-05:00"
-            }
-            }
-        }, {} , ... 
-        ] } } 
+            "key"           : { "client_id" : "295a5ff3-a1d8-4705-9cfe-ffebd0a2e344" },
+            "doc_count"     : 18,
+            "last_seen"     : { "value" : 1557171692653, "value_as_string" : "2019-05-06T19:41:32.653Z" },
+            "client_info"   : { "hits" : { "hits" : [ { "_source" : { "machineData" : {
+                "name"              : "mx-edomex-t-c-lite-06",
+                "callCenterName"    : "MX-edomex-T-c-Lite"
+            } } } ] } }
+        }, {}, ...
+    ]
     """
     # set vars:
     host_url_int = f'{host_url}/keepalive*/_search'
+    since = time_to_str_01(get_current_time_01() - datetime.timedelta(seconds=keepalive_window_seconds))
     # get_query:
     query = {
-      "size" : 9999, # default result window > 10000
+      "size" : 0,
       "query" : {
         "range" : {
           "machineData.machineTimeUTC" : {
-            "gte" : "now-180s"
+            "gte" : since
+          }
+        }
+      },
+      "aggs" : {
+        "clients" : {
+          "composite" : {
+            "size"    : es_page_size,
+            "sources" : [ { "client_id" : { "terms" : { "field" : "machineData.id.keyword" } } } ]
+          },
+          "aggs" : {
+            "last_seen"   : { "max" : { "field" : "machineData.machineTimeUTC", "format" : es_time_format } },
+            "client_info" : { "top_hits" : { "size" : 1, "_source" : [ "machineData.name", "machineData.callCenterName" ] } }
           }
         }
       }
     }
-    # ES 6.x requires an explicit Content-Type header
-    headers = { "Content-Type": "application/json" }
-    # Make the signed HTTP request
-    response = requests.get(host_url_int, auth=awsauth, headers=headers, data=json.dumps(query))
-    logger.info(f'get_es_raw_data_01: Return  all records from elasticsearch for last 300 seconds')
-    return response.json()
+    buckets = es_client_buckets_01(host_url_int, query)
+    logger.info(f'get_es_raw_data_01: Return keepalive counts of [{len(buckets)}] clients for last [{keepalive_window_seconds}] seconds')
+    return buckets
+
+def get_es_rollup_data_01(host_url, index_prefix=None):
+    """ Function get per-client keepalive counts for 3 complete minutes before the last one from rollup index
+    (maintained by support function, invoke_type "rollup_keepalive"; composite aggregation, all pages,
+    see es_client_buckets_01) as list of buckets:
+    [
+        {
+            "key"           : { "client_id" : "295a5ff3-a1d8-4705-9cfe-ffebd0a2e344" },
+            "doc_count"     : 3,                                    # rollup documents (minutes)
+            "count"         : { "value" : 18.0 },                   # keepalive messages
+            "last_seen"     : { "value" : 1557171712653, "value_as_string" : "2019-05-06T19:41:52.653Z" },
+            "client_info"   : { "hits" : { "hits" : [ { "_source" : {
+                "client_name"           : "mx-edomex-t-c-lite-06",
+                "client_callcentername" : "MX-edomex-T-c-Lite"
+            } } ] } }
+        }, {}, ...
+    ]
+    Last complete minute is left out: it is rolled up by support function run of the same minute,
+    which can finish after this read (window lags raw keepalive source by one minute)
+    """
+    host_url_int = f'{host_url}/{index_prefix or rollup_index_prefix}-*/_search'
+    current_minute = get_current_time_01().replace(second=0, microsecond=0)
+    query = {
+      "size" : 0,
+      "query" : {
+        "range" : {
+          "minute" : {
+            "gte" : time_to_str_01(current_minute - datetime.timedelta(minutes=4)),
+            "lt"  : time_to_str_01(current_minute - datetime.timedelta(minutes=1))
+          }
+        }
+      },
+      "aggs" : {
+        "clients" : {
+          "composite" : {
+            "size"    : es_page_size,
+            "sources" : [ { "client_id" : { "terms" : { "field" : "client_id" } } } ]
+          },
+          "aggs" : {
+            "count"       : { "sum" : { "field" : "count" } },
+            "last_seen"   : { "max" : { "field" : "last_seen", "format" : es_time_format } },
+            "client_info" : { "top_hits" : { "size" : 1, "_source" : [ "client_name", "client_callcentername" ] } }
+          }
+        }
+      }
+    }
+    buckets = es_client_buckets_01(host_url_int, query)
+    logger.info(f'get_es_rollup_data_01: Return rollup counts of [{len(buckets)}] clients for 3 complete minutes before the last one')
+    return buckets
 
-def es_raw_data_parser_keepalive_02(es_raw_list):
+def es_raw_data_parser_rollup_02(es_rollup_buckets):
+    """ Same output as es_raw_data_parser_keepalive_02, built from get_es_rollup_data_01 buckets:
+    sum of per-minute counts, last_time_active is the latest last_seen """
+    temp_dict = {}
+    for bucket in es_rollup_buckets:
+        current_id = bucket['key']['client_id']
+        info = bucket['client_info']['hits']['hits'][0]['_source']
+        temp_dict[current_id] = {
+            "client_id" : current_id,
+            "client_name" : info.get('client_name', ''),
+            "client_callcentername" : info.get('client_callcentername', ''),
+            "last_time_active" : bucket['last_seen']['value_as_string'],
+            "id_count" : int(bucket['count']['value'])
+        }
+    log_event_00(logging.INFO, 'es_raw_data_parser_rollup_02', 
+        'Return structured list, sum of per-minute keepalive counts for every client',
+        clients_count=len(temp_dict), clients=temp_dict)
+    return temp_dict
+
+def es_raw_data_parser_keepalive_02(es_raw_buckets):
     """
-    Function get raw json input from function get_es_raw_data_01 and 
+    Function get per-client buckets from function get_es_raw_data_01 and 
     Return structured object of records in last (n) seconds from keepalive ES index, as :
     {
         client_id : {
             "client_id"         : "id123456",                   #
             "client_name"       : "Sigma client",               #
+            "client_callcentername" : "USA_callcenter",         #
             "last_time_active"  : "2019-03-03T12:25:43.434Z",   # time of last keepalive message from client
             "id_count"          : 4                             # count how many times id appears in keepalive messages for last (n) seconds
         },
@@ -293,27 +927,163 @@ def es_raw_data_parser_keepalive_02(es_raw_list):
     }
     """
     temp_dict = {}
-    # logger.debug(f'es_raw_data_parser_keepalive_02: input es_raw_list : [{es_raw_list}]')
-    for each in es_raw_list['hits']['hits']:
-        current_id = each['_source']['machineData']['id']
-        current_id_time = each['_source']['machineData']['machineTimeUTC']
-        if current_id not in temp_dict:
-            temp_dict[current_id] = {
-                "client_id" : current_id,
-                "client_name" : each['_source']['machineData']['name'],
-                "last_time_active" : current_id_time,
-                "id_count" : 1
-            }
-        else:
-            if str_to_time_01(current_id_time) > str_to_time_01(temp_dict[current_id]['last_time_active']):
-                temp_dict[current_id]['last_time_active'] = current_id_time
-            temp_dict[current_id]['id_count'] = int(temp_dict[current_id]['id_count']) + 1
-    logger.info(' '.join((f'es_raw_data_parser_keepalive_02: return structured list,',
-        f'count num of keepalive message for every client.',
-        f'Returned temp_dict : [{temp_dict}]'
-        )))
+    for bucket in es_raw_buckets:
+        current_id = bucket['key']['client_id']
+        machine_data = bucket['client_info']['hits']['hits'][0]['_source']['machineData']
+        temp_dict[current_id] = {
+            "client_id" : current_id,
+            "client_name" : machine_data.get('name', ''),
+            "client_callcentername" : machine_data.get('callCenterName', ''),
+            "last_time_active" : bucket['last_seen']['value_as_string'],
+            "id_count" : bucket['doc_count']
+        }
+    log_event_00(logging.INFO, 'es_raw_data_parser_keepalive_02', 
+        'Return structured list, count num of keepalive message for every client',
+        clients_count=len(temp_dict), clients=temp_dict)
+    return temp_dict
+
+def stream_records_parser_01(event):
+    """ Return keepalive messages (machineData) of stream batch event - Kinesis records with base64
+    encoded keepalive documents (same documents as in keepalive indices):
+    { "Records": [ { "kinesis": { "data": "eyJsb2dUeXBlIjogIktlZXBhbGl2ZSIsIC...", ... }, ... }, ... ] }
+    Records which can not be decoded and other log types are skipped """
+    import base64
+    messages = []
+    skipped = 0
+    for record in event.get('Records', []):
+        try:
+            doc = json.loads(base64.b64decode(record['kinesis']['data']))
+            machine_data = doc['machineData']
+            if doc.get('logType', 'Keepalive') != 'Keepalive' or 'id' not in machine_data or 'machineTimeUTC' not in machine_data:
+                skipped += 1
+                continue
+        except Exception:
+            skipped += 1
+            continue
+        messages.append(machine_data)
+    if skipped != 0:
+        log_event_00(logging.WARNING, 'stream_records_parser_01', 'Skipped stream records, not keepalive messages',
+            records=len(event.get('Records', [])), skipped=skipped)
+    return messages
+
+def keepalive_window_start_01(current_time):
+    """ Stream source: first minute ("YYYY-MM-DDTHH:MM") counted in keepalive window """
+    return time_to_str_01(current_time - datetime.timedelta(minutes=keepalive_window_minutes))[:16]
+
+def keepalive_window_threshold_01(current_time):
+    """ Stream source: count_compare_number scaled from keepalive_window_minutes to the window at current_time
+    (complete minutes and part of current one), same messages per minute as in scheduled runs """
+    window_seconds = keepalive_window_minutes * 60
+    return count_compare_number * (window_seconds + current_time.second) / window_seconds
+
+def count_threshold_01(var_object):
+    """ Client with more keepalive messages than this is observed "active": count_compare_number, or threshold
+    of stream source window (keepalive_window_threshold_01) set as "count_threshold" of var_object """
+    return var_object.get('count_threshold', count_compare_number)
+
+def keepalive_state_01(item):
+    """ Stream source: (ka_buckets, last_time_active, ka_version) of state store item in scan format,
+    ka_version is None before first keepalive write """
+    buckets = json.loads(item['ka_buckets']['S']) if 'ka_buckets' in item else {}
+    ka_version = int(item['ka_version']['N']) if 'ka_version' in item else None
+    return buckets, item.get('last_time_active', { 'S': '' })['S'], ka_version
+
+def keepalive_entry_01(client_id, client_name, client_callcentername, buckets, last_time_active, window_start):
+    """ Stream source: es_raw_data_parser_keepalive_02 element of one client from its minute buckets """
+    return {
+        "client_id"             : client_id,
+        "client_name"           : client_name,
+        "client_callcentername" : client_callcentername,
+        "last_time_active"      : last_time_active,
+        "id_count"              : sum(count for minute, count in buckets.items() if minute >= window_start)
+    }
+
+def es_data_from_state_02(ddb_raw_list, var_object):
+    """ Stream source: same output as es_raw_data_parser_keepalive_02, built from keepalive state kept in
+    state store by stream_handler. Active clients gone silent get "id_count" 0 (observed absent, KEEPALIVE alert);
+    absent clients without keepalive messages in window are left out (still dead checks by tier) """
+    window_start = keepalive_window_start_01(str_to_time_01(var_object['shared_main_time']))
+    temp_dict = {}
+    for each in ddb_raw_list['Items']:
+        if 'ka_buckets' not in each:
+            continue
+        buckets, last_time_active, ka_version = keepalive_state_01(each)
+        entry = keepalive_entry_01(each['client_id']['S'], each['client_name']['S'], each['client_callcentername']['S'],
+            buckets, last_time_active, window_start)
+        if entry['id_count'] != 0 or each.get('status', { 'S': 'absent' })['S'] == 'active':
+            temp_dict[entry['client_id']] = entry
+    log_event_00(logging.INFO, 'es_data_from_state_02', 'Return structured list, keepalive counts of state store',
+        clients_count=len(temp_dict), clients=temp_dict)
     return temp_dict
 
+def client_status_transition_01(observed_status, ddb_element):
+    """ Hysteresis: stored status flips only after observed_status is seen in alert_hysteresis_runs
+    consecutive runs. Return (status, status_changed, pending_status, pending_count, flap_count) """
+    if observed_status == ddb_element['status']:
+        return ddb_element['status'], False, observed_status, 0, ddb_element['flap_count']
+    if ddb_element['pending_status'] == observed_status:
+        pending_count = ddb_element['pending_count'] + 1
+    else:
+        pending_count = 1
+    if pending_count >= alert_hysteresis_runs:
+        return observed_status, True, observed_status, 0, ddb_element['flap_count'] + 1
+    return ddb_element['status'], False, observed_status, pending_count, ddb_element['flap_count']
+
+def client_silent_01(ddb_element):
+    """ Client without keepalive messages in this run is observed "absent" (hysteresis run) if it is
+    active or has pending status change; absent clients go to tier / still dead checks """
+    return ddb_element['status'] == "active" or ddb_element['pending_count'] != 0
+
+def realert_allowed_01(alert_kind, last_notify, current_time):
+    """ True if previous alert of alert_kind (keepalive|restore|stilldead) is older than min_realert_interval """
+    return str_to_time_01(last_notify) < (current_time - min_realert_interval[alert_kind])
+
+def client_tier_01(ddb_element, current_time):
+    """ hot - active, pending status change or absent for less than hot_tier_age;
+    warm - absent less than big_time_delta (still dead alerts); cold - absent longer, can not alert """
+    if ddb_element['status'] == "active" or ddb_element['pending_count'] != 0:
+        return "hot"
+    absent_since = str_to_time_01(ddb_element['last_status_change'])
+    if absent_since > (current_time - hot_tier_age):
+        return "hot"
+    if absent_since > (current_time - big_time_delta):
+        return "warm"
+    return "cold"
+
+def client_due_01(client_id, tier, current_time):
+    """ True if client of given tier is checked in this run. Clients are spread over the
+    tier interval by stable hash of client_id, so every run checks same share of the tier """
+    interval = tier_interval_minutes[tier]
+    if interval <= 1:
+        return True
+    import zlib
+    epoch_minute = int((current_time - datetime.datetime(1970, 1, 1)).total_seconds() // 60)
+    return (epoch_minute + zlib.crc32(client_id.encode())) % interval == 0
+
+def unchanged_client_result_01(ddb_element, send_still_dead_alert_now, update_ddb, tier):
+    """ compare_parsed_data_es_ddb_02 output element for client without keepalive info in this run """
+    return {
+        "client_id"                     : ddb_element['client_id'],
+        "client_name"                   : ddb_element['client_name'],
+        "client_callcentername"         : ddb_element['client_callcentername'],
+        "status"                        : ddb_element['status'],
+        "status_changes"                : False,
+        "last_status_change"            : ddb_element['last_status_change'],
+        "last_ka_alert_notify"          : ddb_element['last_ka_alert_notify'],
+        "send_ka_alert_now"             : False,
+        "last_restore_alert_notify"     : ddb_element['last_restore_alert_notify'],
+        "send_restore_alert_now"        : False,
+        "last_still_dead_notify"        : ddb_element['last_still_dead_notify'],
+        "send_still_dead_alert_now"     : send_still_dead_alert_now,
+        "last_update"                   : ddb_element['last_update'],
+        "pending_status"                : ddb_element['pending_status'],
+        "pending_count"                 : ddb_element['pending_count'],
+        "flap_count"                    : ddb_element['flap_count'],
+        "version"                       : ddb_element['version'],
+        "tier"                          : tier,
+        "update_ddb"                    : update_ddb
+    }
+
 def compare_parsed_data_es_ddb_02(es_dict, ddb_dict, var_object):
     """
     Get input from [db_raw_data_parser_02] and [es_raw_data_parser_keepalive_02].
@@ -332,39 +1102,49 @@ def compare_parsed_data_es_ddb_02(es_dict, ddb_dict, var_object):
         "last_still_dead_notify"            : "2019-03-03T12:25:43.434Z",   #
         "send_still_dead_alert_now"         : True | false                  #
         "last_update"                       : "2019-03-03T12:25:43.434Z",   #
-        "update_ddb"                        : True | False                  #
+        "pending_status"                    : "active" | "absent",          #
+        "pending_count"                     : 0,                            #
+        "flap_count"                        : 7,                            #
+        "version"                           : 12,                           # version read from DynamoDB
+        "tier"                              : "es" | "hot" | "warm" | "cold", # "es" - seen in elasticsearch this run, silent clients are "hot"
+        "update_ddb"                        : True | False                  # only if something to write back
         } , { } , ...
     }
     """
     result_dict_compare = {}
     current_time = str_to_time_01(var_object['shared_main_time'])
+    count_threshold = count_threshold_01(var_object)
     int_es_dict = es_dict
     int_ddb_dict = ddb_dict
 
     es_set = set(int_es_dict.keys()) # set of ids from elasticsearch
-    ddb_set = set(int_es_dict.keys()) # set of ids from DynamoDB
+    ddb_set = set(int_ddb_dict.keys()) # set of ids from DynamoDB
     only_es_ids = es_set - ddb_set
     ####################################################################
     only_ddb_ids = ddb_set - es_set
 
+    tier_counts = { "es" : 0, "hot" : 0, "warm" : 0, "cold" : 0, "skipped" : 0 }
+
+    # new ids are sent to support func by enroll_new_clients_03 (async), proceed them next time
+    var_object['new_client_ids'] = only_es_ids
+    # status changes of this run, written to elasticsearch for availability summaries (support function)
+    status_transitions = []
+    var_object['status_transitions'] = status_transitions
     if len(only_es_ids) != 0:
-    ################################################################### ADD function
-    # invoke support to add new items to table (async)
-        # send list of ids to support func to add them into ddb (async)
-        logger.warning(' '.join((f'compare_parsed_data_es_ddb_02: Found new ids',
-            f'from elasticsearch: [{only_es_ids}]'
-            )))
+        log_event_00(logging.WARNING, 'compare_parsed_data_es_ddb_02', 'Found new ids from elasticsearch',
+            new_ids_count=len(only_es_ids), new_ids=only_es_ids)
     
     # logger.info(' '.join((f'compare_parsed_data_es_ddb_02: iterate over',
     #     f'int_es_dict : [{int_es_dict}]'
     #     )))
     
     for es_id in int_ddb_dict:
-        if es_id in int_es_dict: # Elements from elastic last info
+        # silent: no keepalive messages at all, observed absent like client with low count
+        silent = es_id not in int_es_dict and client_silent_01(int_ddb_dict[es_id])
+        if es_id in int_es_dict or silent: # Elements from elastic last info
             if es_id in only_es_ids:
-                logger.warning(' '.join((f'compare_parsed_data_es_ddb_02: Found new',
-                f'element [{es_id}] from elasticsearch, not in DynamoDB. Need to update DynamoDB'
-                )))
+                log_client_00(logging.WARNING, 'compare_parsed_data_es_ddb_02',
+                    'Found new element from elasticsearch, not in DynamoDB. Need to update DynamoDB', es_id)
                 continue # skip new element from elasticsearch, first update ddb; proceed them next time
         
             # logger.info(f'Error with id_count - value [{int_es_dict[es_id]}]')
@@ -373,21 +1153,27 @@ def compare_parsed_data_es_ddb_02(es_dict, ddb_dict, var_object):
             # else:
             #     current_status = "active"
     
-            current_status = "active" if (int_es_dict[es_id]['id_count'] > count_compare_number) else "absent"
+            current_tier = "hot" if silent else "es"
+            tier_counts[current_tier] += 1
+            observed_status = "active" if (not silent and int_es_dict[es_id]['id_count'] > count_threshold) else "absent"
+            current_status, current_status_changed, current_pending_status, current_pending_count, current_flap_count = \
+                client_status_transition_01(observed_status, int_ddb_dict[es_id])
     
-            if current_status != int_ddb_dict[es_id]['status']:
+            if current_status_changed:
                 current_time_last_status_change = time_to_str_01(current_time)
-                current_status_changed = True
+                status_transitions.append({ "id": es_id, "status": current_status,
+                    "since": int_ddb_dict[es_id]['last_status_change'] })
             else:
                 current_time_last_status_change = int_ddb_dict[es_id]['last_status_change']
-                current_status_changed = False
     
-            if current_status == "absent" and int_ddb_dict[es_id]['status'] == "active":
+            if current_status_changed and current_status == "absent" and \
+                realert_allowed_01('keepalive', int_ddb_dict[es_id]['last_ka_alert_notify'], current_time):
                 current_send_ka_alert_now = True
             else:
                 current_send_ka_alert_now = False
     
-            if current_status == "active" and int_ddb_dict[es_id]['status'] == "absent":
+            if current_status_changed and current_status == "active" and \
+                realert_allowed_01('restore', int_ddb_dict[es_id]['last_restore_alert_notify'], current_time):
                 current_send_restore_alert_now = True
             else:
                 current_send_restore_alert_now = False
@@ -407,45 +1193,43 @@ def compare_parsed_data_es_ddb_02(es_dict, ddb_dict, var_object):
                     "last_still_dead_notify"    : int_ddb_dict[es_id]['last_still_dead_notify'],
                     "send_still_dead_alert_now" : False,
                     "last_update"               :  int_ddb_dict[es_id]['last_update'],
-                    "update_ddb"                : True
+                    "pending_status"            : current_pending_status,
+                    "pending_count"             : current_pending_count,
+                    "flap_count"                : current_flap_count,
+                    "version"                   : int_ddb_dict[es_id]['version'],
+                    "tier"                      : current_tier,
+                    "update_ddb"                : int_ddb_dict[es_id]['update_ddb'] or current_status_changed or \
+                                                  current_pending_status != int_ddb_dict[es_id]['pending_status'] or \
+                                                  current_pending_count != int_ddb_dict[es_id]['pending_count']
                 }
             except Exception as e:
-                logger.warning(' '.join((f'compare_parsed_data_es_ddb_02: failed add [{es_id}] to'
-                f'returned list. Skipped. Exception: [{e}]'
-                )))
+                log_event_00(logging.WARNING, 'compare_parsed_data_es_ddb_02',
+                    'Failed add client to returned list. Skipped', client_id=es_id, exception=e)
                 continue
         else: # elements no info from Elastic but present in DynamoDB
+            current_tier = client_tier_01(int_ddb_dict[es_id], current_time)
+            tier_counts[current_tier] += 1
+            if not client_due_01(es_id, current_tier, current_time):
+                tier_counts['skipped'] += 1
+                result_dict_compare[es_id] = unchanged_client_result_01(int_ddb_dict[es_id], False, False, current_tier)
+                continue
+
             if (int_ddb_dict[es_id]['status'] == "absent") and \
-                str_to_time_01(int_ddb_dict[es_id]['last_still_dead_notify']) < (current_time - still_dead_alert_interval) and \
+                realert_allowed_01('stilldead', int_ddb_dict[es_id]['last_still_dead_notify'], current_time) and \
                 str_to_time_01(int_ddb_dict[es_id]['last_status_change']) > (current_time - big_time_delta):
                 current_send_still_dead_alert_now = True
-                print(
-                f"Current id:[{es_id}], last_still_dead_notify:[{int_ddb_dict[es_id]['last_still_dead_notify']}],",
-                f"current_time:[{current_time}], alertINterval:[{still_dead_alert_interval}], sendStillDead:[{current_send_still_dead_alert_now}]"
-                )
             else:
                 current_send_still_dead_alert_now = False
-                print(
-                f"Current id:[{es_id}], last_still_dead_notify:[{int_ddb_dict[es_id]['last_still_dead_notify']}],",
-                f"current_time:[{current_time}], alertINterval:[{still_dead_alert_interval}], sendStillDead:[{current_send_still_dead_alert_now}]"
+            log_client_00(logging.DEBUG, 'compare_parsed_data_es_ddb_02', 'Still dead check', es_id,
+                last_still_dead_notify=int_ddb_dict[es_id]['last_still_dead_notify'],
+                current_time=current_time, send_still_dead=current_send_still_dead_alert_now)
+
+            result_dict_compare[es_id] = unchanged_client_result_01(
+                int_ddb_dict[es_id], 
+                current_send_still_dead_alert_now,
+                int_ddb_dict[es_id]['update_ddb'] or current_send_still_dead_alert_now,
+                current_tier
                 )
-
-            result_dict_compare[es_id] = {
-                "client_id"                     : es_id,
-                "client_name"                   : int_ddb_dict[es_id]['client_name'],
-                "client_callcentername"         : int_ddb_dict[es_id]['client_callcentername'],
-                "status"                        : int_ddb_dict[es_id]['status'],
-                "status_changes"                : False,
-                "last_status_change"            : int_ddb_dict[es_id]['last_status_change'],
-                "last_ka_alert_notify"          : int_ddb_dict[es_id]['last_ka_alert_notify'],
-                "send_ka_alert_now"             : False,
-                "last_restore_alert_notify"     : int_ddb_dict[es_id]['last_restore_alert_notify'],
-                "send_restore_alert_now"        : False,
-                "last_still_dead_notify"        : int_ddb_dict[es_id]['last_still_dead_notify'],
-                "send_still_dead_alert_now"     : current_send_still_dead_alert_now,
-                "last_update"                   : int_ddb_dict[es_id]['last_update'],
-                "update_ddb"                    : True
-            }
             
     # for es_id in int_es_dict:
     #     if es_id in only_es_ids:
@@ -509,20 +1293,153 @@ def compare_parsed_data_es_ddb_02(es_dict, ddb_dict, var_object):
     #         )))
     #         continue
 
-    logger.info(' '.join((f'compare_parsed_data_es_ddb_02: Information from ELASTICSEARCH',
-        f'and DynamoDb compared and prepared for next actions.',
-        f'Returned result: [{result_dict_compare}]'
-        )))
+    var_object['tier_counts'] = tier_counts
+    log_event_00(logging.INFO, 'compare_parsed_data_es_ddb_02', 
+        'Information from ELASTICSEARCH and DynamoDb compared and prepared for next actions',
+        clients_count=len(result_dict_compare), tier_counts=tier_counts, clients=result_dict_compare)
     return result_dict_compare
 
-def slack_notification_01(message_title,message_text):
-    """ Function sends one message to slack channel, given by ENV variable """
+def time_column_01(np, strings):
+    """ Column of '2019-03-03T12:25:43.434Z' strings as int64 microseconds since epoch (exact, as str_to_time_01);
+    timestamps repeat a lot (run times), only unique ones are parsed """
+    unique_strings = list(dict.fromkeys(strings))
+    unique_times = np.array([string[:-1] for string in unique_strings], dtype='datetime64[us]').astype('int64').tolist()
+    return np.fromiter(map(dict(zip(unique_strings, unique_times)).__getitem__, strings), dtype='int64', count=len(strings))
+
+def compare_columnar_02(es_dict, ddb_dict, var_object):
+    """ Columnar version of compare_parsed_data_es_ddb_02 with identical output: DynamoDB clients are
+    loaded into aligned numpy columns (status codes, keepalive counts, epoch microseconds), hysteresis,
+    alert flags, tiers and dirty mask are computed for the whole fleet with vector operations;
+    only building output dicts is per client """
+    np = get_numpy_00()
+    if np is None:
+        return compare_parsed_data_es_ddb_02(es_dict, ddb_dict, var_object)
+    import zlib
+    current_time = str_to_time_01(var_object['shared_main_time'])
+    epoch = datetime.datetime(1970, 1, 1)
+    now_us = (current_time - epoch) // datetime.timedelta(microseconds=1)
+    epoch_minute = int((current_time - epoch).total_seconds() // 60)
+    interval_us = { kind : interval // datetime.timedelta(microseconds=1) for kind, interval in min_realert_interval.items() }
+    big_us = big_time_delta // datetime.timedelta(microseconds=1)
+    hot_us = hot_tier_age // datetime.timedelta(microseconds=1)
+
+    only_es_ids = set(es_dict) - set(ddb_dict)
+    var_object['new_client_ids'] = only_es_ids
+    status_transitions = []
+    var_object['status_transitions'] = status_transitions
+    if len(only_es_ids) != 0:
+        log_event_00(logging.WARNING, 'compare_columnar_02', 'Found new ids from elasticsearch',
+            new_ids_count=len(only_es_ids), new_ids=only_es_ids)
+
+    ### Columns (status codes: 1 - active, 0 - absent, -1 - other value):
+    from operator import itemgetter
+    ids = list(ddb_dict)
+    elements = list(ddb_dict.values())
+    count = len(ids)
+    if count == 0:
+        return compare_parsed_data_es_ddb_02(es_dict, ddb_dict, var_object)
+    status_codes = { "active" : 1, "absent" : 0 }
+    status_column, pending_status_column, pending_count_column, update_column, \
+        last_status_change_column, last_ka_column, last_restore_column, last_still_dead_column = \
+        zip(*map(itemgetter('status', 'pending_status', 'pending_count', 'update_ddb', 'last_status_change',
+            'last_ka_alert_notify', 'last_restore_alert_notify', 'last_still_dead_notify'), elements))
+    in_es = np.fromiter(map(es_dict.__contains__, ids), dtype=bool, count=count)
+    id_count = np.zeros(count, dtype='int64')
+    seen_positions = np.nonzero(in_es)[0]
+    id_count[seen_positions] = [es_dict[ids[position]]['id_count'] for position in seen_positions.tolist()]
+    status = np.fromiter((status_codes.get(each, -1) for each in status_column), dtype='int8', count=count)
+    pending_status = np.fromiter((status_codes.get(each, -1) for each in pending_status_column), dtype='int8', count=count)
+    pending_count = np.array(pending_count_column, dtype='int64')
+    update_in = np.array(update_column, dtype=bool)
+    last_status_change = time_column_01(np, last_status_change_column)
+    last_ka = time_column_01(np, last_ka_column)
+    last_restore = time_column_01(np, last_restore_column)
+    last_still_dead = time_column_01(np, last_still_dead_column)
+
+    ### Clients seen in elasticsearch and silent ones (client_silent_01, client_status_transition_01, keepalive/restore alerts):
+    silent = ~in_es & ((status == 1) | (pending_count != 0))
+    observing = in_es | silent
+    observed = (id_count > count_threshold_01(var_object)).astype('int8') # silent clients have id_count 0
+    same_status = observed == status
+    new_pending_count = np.where(pending_status == observed, pending_count + 1, 1)
+    flipped = observing & ~same_status & (new_pending_count >= alert_hysteresis_runs)
+    out_pending_count = np.where(same_status | flipped, 0, new_pending_count)
+    send_ka = flipped & (observed == 0) & (last_ka < now_us - interval_us['keepalive'])
+    send_restore = flipped & (observed == 1) & (last_restore < now_us - interval_us['restore'])
+    update_es = update_in | flipped | (observed != pending_status) | (out_pending_count != pending_count)
+
+    ### Clients not seen (client_tier_01, client_due_01, still dead alerts):
+    tier_code = np.where((status == 1) | (pending_count != 0) | (last_status_change > now_us - hot_us), 0,
+        np.where(last_status_change > now_us - big_us, 1, 2)) # 0 - hot, 1 - warm, 2 - cold
+    tier_names = ("hot", "warm", "cold")
+    due = np.ones(count, dtype=bool)
+    not_seen = ~in_es
+    for code, tier_name in enumerate(tier_names):
+        interval = tier_interval_minutes[tier_name]
+        tier_mask = not_seen & (tier_code == code)
+        if interval > 1 and tier_mask.any():
+            tier_positions = np.nonzero(tier_mask)[0]
+            crc = np.fromiter((zlib.crc32(ids[position].encode()) for position in tier_positions), dtype='int64', count=len(tier_positions))
+            due[tier_positions] = (epoch_minute + crc) % interval == 0
+    send_still_dead = not_seen & due & (status == 0) & \
+        (last_still_dead < now_us - interval_us['stilldead']) & (last_status_change > now_us - big_us)
+    update_not_seen = due & (update_in | send_still_dead)
+
+    tier_counts = { "es" : int(in_es.sum()) }
+    for code, tier_name in enumerate(tier_names):
+        tier_counts[tier_name] = int((not_seen & (tier_code == code)).sum())
+    tier_counts['skipped'] = int((not_seen & ~due).sum())
+
+    ### Output dicts (same as compare_parsed_data_es_ddb_02):
+    current_time_str = time_to_str_01(current_time)
+    status_names = { 1 : "active", 0 : "absent" }
+    columns = zip(ids, elements, in_es.tolist(), observing.tolist(), observed.tolist(), flipped.tolist(), out_pending_count.tolist(),
+        send_ka.tolist(), send_restore.tolist(), update_es.tolist(), tier_code.tolist(), send_still_dead.tolist(), update_not_seen.tolist())
+    result_dict_compare = {}
+    for client_id, element, seen, observe, observed_code, flip, pending, ka, restore, update_seen, tier, still_dead, update_tier in columns:
+        if not observe:
+            result_dict_compare[client_id] = unchanged_client_result_01(element, still_dead, update_tier, tier_names[tier])
+            continue
+        if flip:
+            status_transitions.append({ "id": client_id, "status": status_names[observed_code],
+                "since": element['last_status_change'] })
+        result_dict_compare[client_id] = {
+            "client_id"                 : client_id,
+            "client_name"               : element['client_name'],
+            "client_callcentername"     : element['client_callcentername'],
+            "status"                    : status_names[observed_code] if flip else element['status'],
+            "status_changes"            : flip,
+            "last_status_change"        : current_time_str if flip else element['last_status_change'],
+            "last_ka_alert_notify"      : element['last_ka_alert_notify'],
+            "send_ka_alert_now"         : ka,
+            "last_restore_alert_notify" : element['last_restore_alert_notify'],
+            "send_restore_alert_now"    : restore,
+            "last_still_dead_notify"    : element['last_still_dead_notify'],
+            "send_still_dead_alert_now" : False,
+            "last_update"               : element['last_update'],
+            "pending_status"            : status_names[observed_code],
+            "pending_count"             : pending,
+            "flap_count"                : element['flap_count'] + 1 if flip else element['flap_count'],
+            "version"                   : element['version'],
+            "tier"                      : "es" if seen else "hot",
+            "update_ddb"                : update_seen
+        }
+
+    var_object['tier_counts'] = tier_counts
+    log_event_00(logging.INFO, 'compare_columnar_02', 
+        'Information from ELASTICSEARCH and DynamoDb compared and prepared for next actions',
+        clients_count=len(result_dict_compare), tier_counts=tier_counts, clients=result_dict_compare)
+    return result_dict_compare
+
+def slack_notification_01(message_title,message_text,var_object=None):
+    """ Function sends one message to slack channel, given by ENV variable or check target """
+    var_object = var_object or {}
 
     slack_data = {
     	"text" : "Project(name):",
         "attachments": [
         {
-			"author_name"   : f"ClientChecks-{region}-{environment}",
+			"author_name"   : f"ClientChecks-{region}-{var_object.get('target_name', environment)}",
 			"title"         : str(message_title),
 			"text"          : str(message_text),
 			"ts"            : f'{time.time()}'
@@ -530,103 +1447,164 @@ def slack_notification_01(message_title,message_text):
       ]
     }
     try:
-        response = requests.post(
-            slack_channel_notify, data = json.dumps(slack_data),
+        response = http_request_00('slack', 'POST',
+            var_object.get('slack_url', slack_channel_notify), data = json.dumps(slack_data),
             headers = {'Content-Type': 'application/json'}
         )
-        logger.info(' '.join((f'slack_notification_01: Sent notification',
-            f'as [{message_title}]-[{message_text}] to slack'
-            )))
+        if not 200 <= response.status_code < 300:
+            log_event_00(logging.ERROR, 'slack_notification_01', 'FAILED to send notification',
+                title=message_title, text_chars=len(str(message_text)), status=response.status_code)
+            return False
+        # text lists client names of whole alert, only its length is logged
+        log_event_00(logging.INFO, 'slack_notification_01', 'Sent notification',
+            title=message_title, text_chars=len(str(message_text)))
         return True
-    except:
-        logger.info(' '.join((f'slack_notification_01: FAILED to send notification',
-            f'as [{message_title}]-[{message_text}] to slack'
-            )))
+    except Exception as e:
+        log_event_00(logging.ERROR, 'slack_notification_01', 'FAILED to send notification',
+            title=message_title, text_chars=len(str(message_text)), exception=e)
         return False
 
-def all_notification_02(ids_dict, var_object):
-    """ Function sends all notification based on previous collected data. 
-    Each notification is included as separate function. 
-    Gets input object from compare_parsed_data_es_ddb_02.
+def collect_alerts_02(ids_dict, var_object):
+    """ Function returns alerts of this run grouped by kind and call center name:
+    {
+        "keepalive" : { "USA_callcenter" : [ "Mike", "Kate" ], ... },
+        "restore"   : { ... },
+        "stilldead" : { ... }
+    }
+    and client ids of every kind; notify times are set by mark_alerts_sent_01 when message is sent
     """
-
-        ####################################### CHECK IT IF FAIL !
-        # IF EMPTY MESSAGES ? 
-    
-    keepalive_alerts_title = "KEEPALIVE alert for next clients:"
-    keepalive_alerts = []
-    restore_alerts_title = "RESTORE alert for next clients:"
-    restore_alerts = []
-    stilldead_alerts_title = "STILLDEAD, next clients are still not active:"
-    stilldead_alerts = []
+    grouped_alerts = { "keepalive" : {}, "restore" : {}, "stilldead" : {} }
+    alert_clients = { "keepalive" : [], "restore" : [], "stilldead" : [] }
+    alert_fields = (
+        ("keepalive", 'send_ka_alert_now'),
+        ("restore", 'send_restore_alert_now'),
+        ("stilldead", 'send_still_dead_alert_now')
+    )
+    double_alerted = []
 
     dict_processed = ids_dict
 
     for each in dict_processed:
+        client_alerts = 0
+        for alert_kind, send_field in alert_fields:
+            if dict_processed[each][send_field] == True:
+                client_alerts += 1
+                grouped_alerts[alert_kind].setdefault(dict_processed[each]['client_callcentername'], []).append(
+                    dict_processed[each]['client_name'])
+                alert_clients[alert_kind].append(each)
+        if client_alerts > 1:
+            double_alerted.append(each)
+
+    if len(double_alerted) != 0:
+        log_event_00(logging.WARNING, 'collect_alerts_02', 'Double notification for clients, check ids list',
+            client_ids=double_alerted)
+    return dict_processed, grouped_alerts, alert_clients
+
+def mark_alerts_sent_01(ids_dict, client_ids, alert_kind, var_object):
+    """ Set last notify time of alert_kind to shared_main_time for clients of sent message """
+    notify_field = alert_notify_fields[alert_kind]
+    for client_id in client_ids:
+        ids_dict[client_id][notify_field] = var_object['shared_main_time']
+
+def format_grouped_alert_01(callcenter_alerts):
+    """ One line per call center: "USA_callcenter (12): Mike, Kate, ... +2 more" """
+    lines = []
+    for callcenter_name in sorted(callcenter_alerts):
+        names = sorted(callcenter_alerts[callcenter_name])
+        line = f'{callcenter_name} ({len(names)}): ' + ', '.join(names[:alert_group_max_names])
+        if len(names) > alert_group_max_names:
+            line += f' ... +{len(names) - alert_group_max_names} more'
+        lines.append(line)
+    return '\n'.join(lines)
 
-        appended_text = ''.join((
-            f'[{dict_processed[each]["client_name"]}|',
-            f'{dict_processed[each]["client_callcentername"]}]'
-        ))
-
-        if dict_processed[each]['send_ka_alert_now'] == True:
-            keepalive_alerts.append(appended_text)
-            dict_processed[each]['last_ka_alert_notify'] = var_object['shared_main_time']
-
-        if dict_processed[each]['send_restore_alert_now'] == True:
-            restore_alerts.append(appended_text)
-            dict_processed[each]['last_restore_alert_notify'] = var_object['shared_main_time']
-
-        if dict_processed[each]['send_still_dead_alert_now'] == True:
-            stilldead_alerts.append(appended_text)
-            # print(f"still_dead time for id:[{each}] BEFORE set new is : [{dict_processed[each]['last_still_dead_notify']}]")
-            dict_processed[each]['last_still_dead_notify'] = var_object['shared_main_time']
-            # print(f"still_dead time for id:[{each}] AFTER set new is : [{dict_processed[each]['last_still_dead_notify']}]")
-
+def all_notification_02(ids_dict, var_object):
+    """ Function sends all notification based on previous collected data. 
+    One slack message per alert kind, clients grouped by call center.
+    Gets input object from compare_parsed_data_es_ddb_02.
+    """
+    alert_titles = {
+        "keepalive" : "KEEPALIVE alert for next clients:",
+        "restore"   : "RESTORE alert for next clients:",
+        "stilldead" : "STILLDEAD, next clients are still not active:"
+    }
 
-    if  len(keepalive_alerts+restore_alerts+stilldead_alerts) != \
-        len(set(keepalive_alerts+restore_alerts+stilldead_alerts)):
-        logger.warning(' '.join((f'all_notification_02: double notification for clients, check ids list:'
-            f'keepalive_alert : [{keepalive_alerts}];',
-            f'restore_alerts : [{restore_alerts}];',
-            f'stilldead_alerts : [{stilldead_alerts}];'
-        )))
+    dict_processed, grouped_alerts, alert_clients = collect_alerts_02(ids_dict, var_object)
 
     try:
-        if len(keepalive_alerts) != 0:
-            # PUT/ADD here function to notify about KEEPALIVE alerts:
-            slack_notification_01(keepalive_alerts_title,keepalive_alerts)
-            logger.info(f'all_notification_02: SENT keepalive for [{len(keepalive_alerts)}] clients')
-
-        if len(restore_alerts) != 0:
-            # PUT/ADD here function to notify about RESTORE client:
-            slack_notification_01(restore_alerts_title,restore_alerts)
-            logger.info(f'all_notification_02: SENT restore for [{len(restore_alerts)}] clients')
-
-        if len(stilldead_alerts) != 0:
-            # PUT/ADD here function to notify about STILLDEAD alert:
-            slack_notification_01(stilldead_alerts_title,stilldead_alerts)
-            logger.info(f'all_notification_02: SENT stilldead for [{len(stilldead_alerts)}] clients')
+        for alert_kind in ("keepalive", "restore", "stilldead"):
+            if len(grouped_alerts[alert_kind]) != 0:
+                if not slack_notification_01(alert_titles[alert_kind], format_grouped_alert_01(grouped_alerts[alert_kind]), var_object):
+                    # notify times are kept, realert interval does not hide alerts which were never delivered
+                    log_event_00(logging.ERROR, 'all_notification_02', f'NOT SENT {alert_kind}',
+                        client_ids=alert_clients[alert_kind])
+                    continue
+                mark_alerts_sent_01(dict_processed, alert_clients[alert_kind], alert_kind, var_object)
+                log_event_00(logging.INFO, 'all_notification_02', f'SENT {alert_kind}',
+                    callcenters=len(grouped_alerts[alert_kind]),
+                    clients=sum(len(names) for names in grouped_alerts[alert_kind].values()))
 
     except Exception as e:
         logger.warning(f'all_notification: FAILED to send notification. Get [{e}].')
         pass
     return dict_processed
 
-def post_to_elastic_01(query, var_object):
-    """ Function sends one query to elasticsearch cluster """
+def post_to_elastic_01(query, var_object, doc_id=None):
+    """ Function sends one query to elasticsearch cluster. Document id is the run time (default),
+    so retried request overwrites the same document instead of adding a duplicate """
 
-    host_url_int = f'{var_object["elastic_url"]}/{var_object["full_es_index_name"]}/doc'
+    host_url_int = f'{var_object["elastic_url"]}/{var_object["full_es_index_name"]}/doc/{doc_id or var_object["shared_main_time"]}'
     # ES 6.x requires an explicit Content-Type header
     headers = { "Content-Type": "application/json" }
     # Make the signed HTTP request
-    response = requests.post(host_url_int, auth=awsauth, headers=headers, data=json.dumps(query))
-    logger.info(f'post_to_elastic_01: post to elastic - [{response.status_code}], query - [{query}], elastic - [{host_url_int}]')
-    if int(response.status_code) == 200:
+    try:
+        response = http_request_00('es_write', 'PUT', host_url_int, auth=get_awsauth_00(), headers=headers, data=json.dumps(query))
+    except Exception as e:
+        log_event_00(logging.ERROR, 'post_to_elastic_01', 'FAILED post to elastic', elastic=host_url_int, exception=e)
+        return False
+    log_event_00(logging.INFO, 'post_to_elastic_01', 'Post to elastic',
+        status_code=response.status_code, elastic=host_url_int, query=query)
+    if int(response.status_code) in (200, 201):
         return True
     else: 
+        log_event_00(logging.ERROR, 'post_to_elastic_01', 'FAILED post to elastic',
+            status_code=response.status_code, elastic=host_url_int)
         return False
 
+def transition_docs_01(ids_dict, var_object):
+    """ Status changes recorded by compare (var_object['status_transitions']) with client fields, as:
+    { "id" : "id01", "name" : "id01name", "nm-cc" : "id01name|id01callcenter", "ccname" : "id01callcenter",
+      "status" : "absent",                          # new status
+      "since"  : "2019-03-03T12:25:43.434Z" }       # previous status change: previous status lasted from "since" to run time
+    """
+    transitions = []
+    for each in var_object.get('status_transitions', []):
+        element = ids_dict[each['id']]
+        transitions.append({
+            "id"     : element['client_id'],
+            "name"   : element['client_name'],
+            "nm-cc"  : f'{element["client_name"]}|{element["client_callcentername"]}',
+            "ccname" : element['client_callcentername'],
+            "status" : each['status'],
+            "since"  : each['since']
+        })
+    return transitions
+
+def absent_clients_complete_01(ids_dict, active_clients, absent_clients, var_object):
+    """ Full state read: remember absent clients of table. Indexed read: add remembered clients which were
+    not read (absent longer than big_time_delta) to absent_clients, so dashboard counts do not jump between
+    full and indexed runs. Return False if the list can not be complete (no full read in this container yet) """
+    if var_object.get('full_state_read', True):
+        absent_clients_cache[var_object['table_name']] = { client['id'] : client for client in absent_clients }
+        return True
+    cached = absent_clients_cache.get(var_object['table_name'])
+    if cached is None:
+        return False
+    absent_clients.extend(client for client_id, client in cached.items() if client_id not in ids_dict)
+    for client in active_clients:
+        cached.pop(client['id'], None)
+    cached.update((client['id'], client) for client in absent_clients)
+    return True
+
 def write_all_to_elastic_02(ids_dict, var_object):
     """ Function checks main store file and generate info (queries) for elasticsearch. 
     Output format (to elastic):
@@ -647,9 +1625,13 @@ def write_all_to_elastic_02(ids_dict, var_object):
             "keealive"  : [ { ... }, { ... }, ... ],
             "stilldead" : [ { ... }, { ... }, ... ],
             "restore"   : [ { ... }, { ... }, ... ]
-        }
+        },
+        "transitions" : [ { same_fields, "status" : "absent", "since" : "2019-03-03T12:25:43.434Z" }, ... ],
+        "absent_complete" : True | False
     }
-
+    "transitions" - status changes of this run (see transition_docs_01);
+    "absent_complete" - False if indexed read left out clients absent longer than big_time_delta and
+    they are not known from earlier full read of this container (see absent_clients_complete_01)
     """
     int_ids_dict = ids_dict
 
@@ -685,7 +1667,9 @@ def write_all_to_elastic_02(ids_dict, var_object):
         
         if int_ids_dict[each]['send_still_dead_alert_now']:
             stilldead_alert_clients.append(client_temp_obj)
-        
+
+    absent_complete = absent_clients_complete_01(int_ids_dict, active_clients, absent_clients, var_object)
+
     output_query = {
         "time" : var_object['shared_main_time'],
         "clients" : {
@@ -694,7 +1678,9 @@ def write_all_to_elastic_02(ids_dict, var_object):
             "keepalive" : keepalive_alert_clients,
             "restore"   : restore_alert_clients,
             "stilldead" : stilldead_alert_clients
-        }
+        },
+        "transitions" : transition_docs_01(int_ids_dict, var_object),
+        "absent_complete" : absent_complete
     }
     
     logger.info(f'write_all_to_elastic_02: fill query to update Elasticsearch records')
@@ -703,20 +1689,22 @@ def write_all_to_elastic_02(ids_dict, var_object):
     return int_ids_dict
 
 def update_element_to_ddb_01(input_element, table_name, var_object):
-    """ Update one element in DynamoDB table, get input per element from compare_parsed_data_es_ddb_02 """
+    """ Update one element in DynamoDB table, get input per element from compare_parsed_data_es_ddb_02.
+    Write is conditional on "version" read by this run (item written by other run/enrollment in between
+    is not overwritten) and increments it. Return True, False (failed) or "conflict" (version changed) """
     
-    dynamodb = boto3.resource('dynamodb', region_name=region)
-    table = dynamodb.Table(table_name)
+    table = get_ddb_table_00(table_name)
 
     try:
-        response = table.update_item(
+        response = resilient_call_00('dynamodb', table_name, table.update_item, final_error=ddb_condition_failed_00,
             TableName = table_name, 
             ReturnValues = 'NONE', # TRY TO CHANGE TO AVOID TIME LOSS > "NONE" 
             Key = {
                 'client_id' : input_element["client_id"] 
             },
             UpdateExpression = 'SET #cn = :cn, #cccn = :cccn, #sts = :sts,  #tlsc = :tlsc, \
-                #tlkn = :tlkn, #tlrn = :tlrn, #tlsn = :tlsn, #tlu = :tlu',
+                #tlkn = :tlkn, #tlrn = :tlrn, #tlsn = :tlsn, #tlu = :tlu, #pst = :pst, #pcn = :pcn, #flc = :flc, #ver = :nver',
+            ConditionExpression = 'attribute_not_exists(#ver) OR #ver = :ver',
             ExpressionAttributeNames = {
                 '#cn'   : 'client_name',
                 '#cccn' : 'client_callcentername',
@@ -725,7 +1713,11 @@ def update_element_to_ddb_01(input_element, table_name, var_object):
                 '#tlkn' : 'last_ka_alert_notify',
                 '#tlrn' : 'last_restore_alert_notify',
                 '#tlsn' : 'last_still_dead_notify',
-                '#tlu'  : 'last_update'
+                '#tlu'  : 'last_update',
+                '#pst'  : 'pending_status',
+                '#pcn'  : 'pending_count',
+                '#flc'  : 'flap_count',
+                '#ver'  : 'version'
             },
             ExpressionAttributeValues = {
                 ':cn'   : input_element['client_name'],
@@ -735,24 +1727,245 @@ def update_element_to_ddb_01(input_element, table_name, var_object):
                 ':tlkn' : input_element['last_ka_alert_notify'],
                 ':tlrn' : input_element['last_restore_alert_notify'],
                 ':tlsn' : input_element['last_still_dead_notify'],
-                ':tlu'  : var_object['shared_main_time']
+                ':tlu'  : var_object['shared_main_time'],
+                ':pst'  : input_element['pending_status'],
+                ':pcn'  : input_element['pending_count'],
+                ':flc'  : input_element['flap_count'],
+                ':ver'  : input_element['version'],
+                ':nver' : input_element['version'] + 1
             }
         )
-        logger.info(' '.join((f'update_element_to_ddb_01: UPDATE one element to',
-          f'DDB - [{input_element}] with time [{var_object["shared_main_time"]}]'
-          )))
+        log_client_00(logging.INFO, 'update_element_to_ddb_01', 'UPDATE one element to DDB',
+            input_element['client_id'], element=input_element, time=var_object['shared_main_time'])
         return True
     except Exception as e:
+        if ddb_condition_failed_00(e):
+            metric_inc_00(f'dynamodb:{table_name}', 'conflicts')
+            log_event_00(logging.WARNING, 'update_element_to_ddb_01', 'Version CONFLICT, element changed by other writer',
+                client_id=input_element['client_id'], version=input_element['version'])
+            return "conflict"
         logger.warning(' '.join((f'update_element_to_ddb_01: FAILED update element',
           f'[{input_element}] to DynamoDB table [{table_name}] as [{e}]'
           )))
         return False
 
+def get_element_from_ddb_01(client_id, table_name):
+    """ Consistent read of one client in DynamoDB scan format ({ "Items" : [item] }, empty if not found) """
+    client = get_aws_client_00('dynamodb')
+    response = resilient_call_00('dynamodb', table_name, client.get_item,
+        TableName       = table_name,
+        Key             = { 'client_id': { 'S': client_id } },
+        ConsistentRead  = True
+    )
+    return { 'Items': [response['Item']] if 'Item' in response else [] }
+
+def own_write_01(fresh_raw, element, var_object):
+    """ True if fresh DynamoDB item is the write of this element by this run: update succeeded, but its
+    answer was lost (read timeout) and the retry failed the version condition against our own write """
+    if len(fresh_raw['Items']) == 0:
+        return False
+    item = fresh_raw['Items'][0]
+    return (item.get('version', {}).get('N') == str(element['version'] + 1)
+        and item.get('last_update', {}).get('S') == var_object['shared_main_time'])
+
+def rebase_element_03(element, fresh_raw, var_object):
+    """ Element of this run recomputed from fresh DynamoDB state after version conflict: compare runs
+    again with keepalive data of this run, alert notify times are max of both (alerts of this run were sent) """
+    if len(fresh_raw['Items']) == 0:
+        return element
+    rebase_var_object = dict(var_object) # compare sets run-wide new_client_ids, tier_counts
+    fresh_ddb = ddb_raw_data_parser_02(fresh_raw, rebase_var_object)
+    es_data = var_object.get('parsed_es_data', {})
+    es_slice = { element['client_id']: es_data[element['client_id']] } if element['client_id'] in es_data else {}
+    rebased = compare_parsed_data_es_ddb_02(es_slice, fresh_ddb, rebase_var_object)[element['client_id']]
+    for notify_field in ('last_ka_alert_notify', 'last_restore_alert_notify', 'last_still_dead_notify'):
+        rebased[notify_field] = max(rebased[notify_field], element[notify_field])
+    return { name: rebased[name] for name in element }
+
+def write_elements_to_ddb_04(elements, table_name, var_object):
+    """ DynamoDB backend: one conditional update_item per element; element changed by other writer
+    is rebased on fresh state and written again, up to state_conflict_retries times """
+    written = 0
+    for element in elements:
+        for attempt in range(state_conflict_retries + 1):
+            result = update_element_to_ddb_01(element, table_name, var_object)
+            if result != "conflict":
+                break
+            if attempt == state_conflict_retries:
+                log_event_00(logging.ERROR, 'write_elements_to_ddb_04', 'Client NOT written, version conflicts left',
+                    client_id=element['client_id'], table=table_name, attempts=attempt + 1)
+                break
+            try:
+                fresh_raw = get_element_from_ddb_01(element['client_id'], table_name)
+            except Exception as e:
+                log_event_00(logging.ERROR, 'write_elements_to_ddb_04', 'FAILED to re-read conflicting client',
+                    client_id=element['client_id'], table=table_name, exception=e)
+                break
+            if own_write_01(fresh_raw, element, var_object):
+                log_event_00(logging.INFO, 'write_elements_to_ddb_04', 'Conflict with own write of retried update, written',
+                    client_id=element['client_id'], version=element['version'] + 1)
+                result = True
+                break
+            element = rebase_element_03(element, fresh_raw, var_object)
+        written += 1 if result is True else 0
+    return written
+
+def enroll_ids_by_support_func_01(id_dict, var_object):
+    """ DynamoDB backend: new clients are written by support function (async 'id_list_update') """
+    return invoke_support_func_01(generate_invoke_payload_01('id_list_update', id_dict), asynccall=True,
+        func_name=var_object.get('support_func_name'))
+
+def write_keepalives_to_ddb_01(updates, table_name):
+    """ DynamoDB backend: write keepalive state (name, call center, last_time_active, ka_buckets) of stream
+    batch clients, new clients are created. Write is conditional on "ka_version" read by the batch and increments it.
+    Status fields and version are not touched, so these writes do not conflict with update_element_to_ddb_01.
+    Return ids of clients with ka_version changed by other writer (not written) """
+    table = get_ddb_table_00(table_name)
+    conflict_ids = []
+    for update in updates:
+        values = {
+            ':cn'   : update['client_name'],
+            ':cccn' : update['client_callcentername'],
+            ':lta'  : update['last_time_active'],
+            ':kab'  : update['ka_buckets'],
+            ':nkav' : (update['ka_version'] or 0) + 1
+        }
+        if update['ka_version'] is not None:
+            values[':kav'] = update['ka_version']
+        try:
+            resilient_call_00('dynamodb', table_name, table.update_item, final_error=ddb_condition_failed_00,
+                Key                         = { 'client_id': update['client_id'] },
+                ReturnValues                = 'NONE',
+                UpdateExpression            = 'SET #cn = :cn, #cccn = :cccn, #lta = :lta, #kab = :kab, #kav = :nkav',
+                ConditionExpression         = 'attribute_not_exists(#kav)' if update['ka_version'] is None else '#kav = :kav',
+                ExpressionAttributeNames    = {
+                    '#cn'   : 'client_name',
+                    '#cccn' : 'client_callcentername',
+                    '#lta'  : 'last_time_active',
+                    '#kab'  : 'ka_buckets',
+                    '#kav'  : 'ka_version'
+                },
+                ExpressionAttributeValues   = values
+            )
+        except Exception as e:
+            if not ddb_condition_failed_00(e):
+                raise
+            metric_inc_00(f'dynamodb:{table_name}', 'conflicts')
+            conflict_ids.append(update['client_id'])
+    return conflict_ids
+
+def select_from_sqlite_01(table_name, where='', params=()):
+    """ SQLite backend: clients of table_name matching where clause in DynamoDB scan item format
+    ([{ "client_id" : { "S" : ... }, "pending_count" : { "N" : ... }, ...}]), NULL columns are left out like missing attributes """
+    connection = get_sqlite_00(table_name)
+    names = list(state_columns)
+    with lazy_context['sqlite_lock']:
+        rows = connection.execute(f'SELECT {", ".join(names)} FROM "{table_name}" {where}', params).fetchall()
+    items = []
+    for row in rows:
+        item = {}
+        for name, value in zip(names, row):
+            if value is None:
+                continue
+            item[name] = { 'N': str(value) } if isinstance(value, int) else { 'S': value }
+        items.append(item)
+    return items
+
+def read_all_from_sqlite_01(table_name):
+    """ SQLite backend: all clients of table_name in DynamoDB scan format ({ "Items" : [...] }) """
+    items = select_from_sqlite_01(table_name)
+    logger.info(f'read_all_from_sqlite_01: Return [{len(items)}] clients from sqlite table [{table_name}]')
+    return { 'Items': items }
+
+def read_relevant_from_sqlite_01(table_name, es_ids, var_object):
+    """ SQLite backend of get_relevant_data_from_ddb_01: status index query + ids from elasticsearch """
+    since = time_to_str_01(str_to_time_01(var_object['shared_main_time']) - big_time_delta)
+    items = select_from_sqlite_01(table_name, 
+        "WHERE status = 'active' OR (status = 'absent' AND last_status_change >= ?)", (since,))
+    found_ids = set(item['client_id']['S'] for item in items)
+    missing_ids = [client_id for client_id in es_ids if client_id not in found_ids]
+    items.extend(read_ids_from_sqlite_01(table_name, missing_ids)['Items'])
+    return { 'Items': items }
+
+def read_ids_from_sqlite_01(table_name, client_ids, consistent=False):
+    """ SQLite backend of get_ids_from_ddb_01 (reads are always consistent) """
+    items = []
+    for start in range(0, len(client_ids), 500): # sqlite limit of query parameters
+        chunk = client_ids[start:start + 500]
+        items.extend(select_from_sqlite_01(table_name, f'WHERE client_id IN ({", ".join("?" * len(chunk))})', chunk))
+    return { 'Items': items }
+
+def write_elements_to_sqlite_01(elements, table_name, var_object):
+    """ SQLite backend: bulk upsert of elements (update_element_to_ddb_01 fields) in one transaction """
+    connection = get_sqlite_00(table_name)
+    names = [name for name in state_columns if name not in ('client_id', 'last_update', 'version') + stream_columns]
+    rows = [[element[name] for name in names] + [var_object['shared_main_time'], element['version'] + 1, element['client_id']] for element in elements]
+    with lazy_context['sqlite_lock'], connection:
+        connection.executemany(f'INSERT OR IGNORE INTO "{table_name}" (client_id) VALUES (?)',
+            [(element['client_id'],) for element in elements])
+        connection.executemany(' '.join((f'UPDATE "{table_name}" SET',
+            ', '.join(f'{name} = ?' for name in names + ['last_update', 'version']),
+            'WHERE client_id = ?'
+            )), rows)
+    logger.info(f'write_elements_to_sqlite_01: [{len(rows)}] elements written to sqlite table [{table_name}]')
+    return len(rows)
+
+def enroll_ids_to_sqlite_01(id_dict, var_object):
+    """ SQLite backend: insert identity of new clients (id, name, call center), existing rows are kept """
+    connection = get_sqlite_00(var_object['table_name'])
+    with lazy_context['sqlite_lock'], connection:
+        connection.executemany(' '.join((f'INSERT OR IGNORE INTO "{var_object["table_name"]}"',
+            '(client_id, client_name, client_callcentername) VALUES (?, ?, ?)'
+            )), [(each['client_id'], each['client_name'], each['client_callcentername']) for each in id_dict.values()])
+    return len(id_dict)
+
+def write_keepalives_to_sqlite_01(updates, table_name):
+    """ SQLite backend of write_keepalives_to_ddb_01, one transaction; return ids of clients with ka_version conflict """
+    connection = get_sqlite_00(table_name)
+    conflict_ids = []
+    with lazy_context['sqlite_lock'], connection:
+        connection.executemany(f'INSERT OR IGNORE INTO "{table_name}" (client_id) VALUES (?)',
+            [(update['client_id'],) for update in updates])
+        for update in updates:
+            cursor = connection.execute(' '.join((f'UPDATE "{table_name}" SET',
+                'client_name = ?, client_callcentername = ?, last_time_active = ?, ka_buckets = ?, ka_version = ?',
+                'WHERE client_id = ? AND ka_version IS ?'
+                )), (update['client_name'], update['client_callcentername'], update['last_time_active'], update['ka_buckets'],
+                    (update['ka_version'] or 0) + 1, update['client_id'], update['ka_version']))
+            if cursor.rowcount == 0:
+                conflict_ids.append(update['client_id'])
+    return conflict_ids
+
+### STATE STORE backends:
+# read_all(table_name) -> DynamoDB scan format; read_relevant(table_name, es_ids, var_object) - same format,
+# clients which can change status or alert (see get_relevant_data_from_ddb_01); read_ids(table_name, client_ids, consistent);
+# write_elements(elements, table_name, var_object); enroll(id_dict, var_object) - add new clients, keep existing ones;
+# write_keepalives(updates, table_name) - keepalive state of stream_handler, return ids of clients with ka_version conflict
+state_stores = {
+    "dynamodb" : {
+        "read_all"          : get_raw_data_from_ddb_01,
+        "read_relevant"     : get_relevant_data_from_ddb_01,
+        "read_ids"          : get_ids_from_ddb_01,
+        "write_elements"    : write_elements_to_ddb_04,
+        "enroll"            : enroll_ids_by_support_func_01,
+        "write_keepalives"  : write_keepalives_to_ddb_01
+    },
+    "sqlite" : {
+        "read_all"          : read_all_from_sqlite_01,
+        "read_relevant"     : read_relevant_from_sqlite_01,
+        "read_ids"          : read_ids_from_sqlite_01,
+        "write_elements"    : write_elements_to_sqlite_01,
+        "enroll"            : enroll_ids_to_sqlite_01,
+        "write_keepalives"  : write_keepalives_to_sqlite_01
+    }
+}
+
 def update_ddb_elements_02(ids_dict, var_object):
     """ Function iterate over given dict (main store of processed values) and update 
         items in DynamoDB (uses update_element_to_ddb_01 function) """
 
     int_ids_dict = ids_dict
+    elements_to_write = []
     for each_id in int_ids_dict:
         if int_ids_dict[each_id]['update_ddb'] == True:
             data_to_ddb = {
@@ -763,24 +1976,31 @@ def update_ddb_elements_02(ids_dict, var_object):
                 "last_status_change"            : int_ids_dict[each_id]["last_status_change"],
                 "last_ka_alert_notify"          : int_ids_dict[each_id]["last_ka_alert_notify"],
                 "last_restore_alert_notify"     : int_ids_dict[each_id]["last_restore_alert_notify"],
-                "last_still_dead_notify"        : int_ids_dict[each_id]["last_still_dead_notify"]
+                "last_still_dead_notify"        : int_ids_dict[each_id]["last_still_dead_notify"],
+                "pending_status"                : int_ids_dict[each_id]["pending_status"],
+                "pending_count"                 : int_ids_dict[each_id]["pending_count"],
+                "flap_count"                    : int_ids_dict[each_id]["flap_count"],
+                "version"                       : int_ids_dict[each_id]["version"]
             }
-            logger.debug(' '.join((f'update_ddb_elements_02: UPDATE DynamoDB for',
-                f'[{int_ids_dict[each_id]["client_id"]}]=',
-                f'[{int_ids_dict[each_id]["client_name"]}]-',
-                f'[{int_ids_dict[each_id]["client_callcentername"]}]'
-            )))
+            log_client_00(logging.DEBUG, 'update_ddb_elements_02', 'UPDATE DynamoDB for client', each_id)
         else:
-            logger.debug(' '.join((f'update_ddb_elements_02: SKIP UPDATE DynamoDB for', 
-                f'[{int_ids_dict[each_id]["client_id"]}]=',
-                f'[{int_ids_dict[each_id]["client_name"]}]-',
-                f'[{int_ids_dict[each_id]["client_callcentername"]}]'
-            )))
+            log_client_00(logging.DEBUG, 'update_ddb_elements_02', 'SKIP UPDATE DynamoDB for client', each_id)
             continue
-        update_element_to_ddb_01(data_to_ddb,table_name, var_object)
-    logger.info(f'update_ddb_elements_02: ALL new info was written to DynamoDB')
+        elements_to_write.append(data_to_ddb)
+    state_stores[state_store_backend]['write_elements'](elements_to_write, var_object['table_name'], var_object)
+    logger.info(f'update_ddb_elements_02: ALL new info was written to [{state_store_backend}] state store')
     return int_ids_dict
 
+def check_cancelled_01(var_object, stage):
+    """ Raise before next stage with side effects (slack, elasticsearch, state store, enrollment) if the
+    target check was given up by check_all_targets_03 ("cancelled" event in var_object is set) """
+    cancelled = var_object.get('cancelled')
+    if cancelled is None or not cancelled.is_set():
+        return
+    log_event_00(logging.WARNING, 'check_cancelled_01', 'Target check cancelled after timeout, stage skipped',
+        target=var_object.get('target_name'), stage=stage)
+    raise Exception(f'check_cancelled_01: target [{var_object.get("target_name")}] cancelled before [{stage}]')
+
 def iterate_over_results_03(compared_dict, var_object):
     """Function execute notifications and update info at DynamoDB, Elastic. 
     Process main dict through notification and update functions.
@@ -788,13 +2008,132 @@ def iterate_over_results_03(compared_dict, var_object):
     """
 
     int_compared_dict_01 = compared_dict
+    check_cancelled_01(var_object, 'all_notification_02')
     int_compared_dict_02 = all_notification_02(int_compared_dict_01,var_object)
+    check_cancelled_01(var_object, 'write_all_to_elastic_02')
     int_compared_dict_03 = write_all_to_elastic_02(int_compared_dict_02, var_object)
+    check_cancelled_01(var_object, 'update_ddb_elements_02')
     int_compared_dict_04 = update_ddb_elements_02(int_compared_dict_03,var_object)
 
-    logger.info(f'iterare_over_results_03: Finished all checkings, elements updated. Final result : [{int_compared_dict_03}]')
+    log_event_00(logging.INFO, 'iterate_over_results_03', 'Finished all checkings, elements updated',
+        clients_count=len(int_compared_dict_04), clients=int_compared_dict_04)
     return int_compared_dict_04
 
+def enroll_new_clients_03(es_dict, new_ids, var_object):
+    """ Enroll new client ids (found in elasticsearch, not in state store) with names already parsed from
+    keepalive messages, in batches of enroll_batch_size: DynamoDB - by support function (async 'id_list_update'),
+    sqlite - inserted directly.
+    Ids sent during last enroll_resend_interval are skipped. Return number of enrolled ids """
+    current_time = str_to_time_01(var_object['shared_main_time'])
+    table_requested = enroll_requested.setdefault(var_object['table_name'], {})
+    to_enroll = {}
+    for client_id in new_ids:
+        requested_at = table_requested.get(client_id)
+        if requested_at is not None and requested_at > (current_time - enroll_resend_interval):
+            continue
+        to_enroll[client_id] = {
+            "client_id"             : client_id,
+            "client_name"           : es_dict[client_id]['client_name'],
+            "client_callcentername" : es_dict[client_id]['client_callcentername']
+        }
+    batch_ids = list(to_enroll)
+    for start in range(0, len(batch_ids), enroll_batch_size):
+        batch = { client_id : to_enroll[client_id] for client_id in batch_ids[start:start + enroll_batch_size] }
+        try:
+            state_stores[state_store_backend]['enroll'](batch, var_object)
+        except Exception as e:
+            log_event_00(logging.ERROR, 'enroll_new_clients_03', 'FAILED to enroll new clients',
+                clients_count=len(batch), exception=e)
+            continue
+        for client_id in batch:
+            table_requested[client_id] = current_time
+    if len(to_enroll) != 0:
+        log_event_00(logging.WARNING, 'enroll_new_clients_03', 'New clients sent to enrollment',
+            clients_count=len(to_enroll), clients=batch_ids)
+    return len(to_enroll)
+
+def keepalive_batch_counts_01(messages, window_start):
+    """ Stream source: keepalive messages of one batch aggregated per client (one state write per client and batch):
+    { client_id : { "minutes" : { "YYYY-MM-DDTHH:MM" : count }, "last_time_active" : ..., "client_name" : ...,
+    "client_callcentername" : ... } }, messages older than window_start are not counted """
+    batch = {}
+    for machine_data in messages:
+        client = batch.setdefault(machine_data['id'], { "minutes" : {}, "last_time_active" : '' })
+        client['client_name'] = machine_data.get('name', '')
+        client['client_callcentername'] = machine_data.get('callCenterName', '')
+        minute = machine_data['machineTimeUTC'][:16]
+        if minute < window_start:
+            continue
+        client['minutes'][minute] = client['minutes'].get(minute, 0) + 1
+        # same time format, string compare is enough
+        if machine_data['machineTimeUTC'] > client['last_time_active']:
+            client['last_time_active'] = machine_data['machineTimeUTC']
+    return batch
+
+def keepalive_update_01(client_id, client_batch, item, window_start):
+    """ Stream source: keepalive state write of one client - state of item (scan format) with batch counts added,
+    buckets older than window_start dropped; "ka_version" is the version read, write is conditional on it """
+    buckets, last_time_active, ka_version = keepalive_state_01(item)
+    buckets = { minute : count for minute, count in buckets.items() if minute >= window_start }
+    for minute, count in client_batch['minutes'].items():
+        buckets[minute] = buckets.get(minute, 0) + count
+    return {
+        "client_id"             : client_id,
+        "client_name"           : client_batch['client_name'],
+        "client_callcentername" : client_batch['client_callcentername'],
+        "last_time_active"      : max(last_time_active, client_batch['last_time_active']),
+        "ka_buckets"            : json.dumps(buckets, sort_keys=True),
+        "ka_version"            : ka_version
+    }
+
+def own_keepalive_write_01(item, update):
+    """ True if item is the keepalive write of update: its answer was lost (read timeout) and
+    the retry failed the ka_version condition against our own write """
+    _, _, ka_version = keepalive_state_01(item)
+    return (ka_version == (update['ka_version'] or 0) + 1
+        and item.get('ka_buckets', { 'S': '' })['S'] == update['ka_buckets'])
+
+def apply_keepalives_02(messages, var_object):
+    """ Stream source: add batch of keepalive messages to per-client minute buckets in state store
+    (buckets older than keepalive window are dropped, late messages too), creating new clients.
+    Writes are conditional on ka_version: client written by other batch in between (concurrent consumers,
+    stream not partitioned by client id) is re-read and the batch counts are added again, up to state_conflict_retries times.
+    Return (es_dict of batch clients as es_raw_data_parser_keepalive_02, state items the written state is based on by client_id) """
+    window_start = keepalive_window_start_01(str_to_time_01(var_object['shared_main_time']))
+    state_store = state_stores[state_store_backend]
+    batch = keepalive_batch_counts_01(messages, window_start)
+    raw_items = { item['client_id']['S'] : item for item in
+        state_store['read_ids'](var_object['table_name'], list(batch), consistent=True)['Items'] }
+    new_clients = len(batch) - len(raw_items)
+
+    updates = {}
+    pending_ids = list(batch)
+    for attempt in range(state_conflict_retries + 1):
+        for client_id in pending_ids:
+            updates[client_id] = keepalive_update_01(client_id, batch[client_id], raw_items.get(client_id, {}), window_start)
+        conflict_ids = state_store['write_keepalives']([updates[client_id] for client_id in pending_ids], var_object['table_name'])
+        if len(conflict_ids) == 0:
+            break
+        fresh_items = { item['client_id']['S'] : item for item in
+            state_store['read_ids'](var_object['table_name'], conflict_ids, consistent=True)['Items'] }
+        pending_ids = [client_id for client_id in conflict_ids
+            if not own_keepalive_write_01(fresh_items.get(client_id, {}), updates[client_id])]
+        if len(pending_ids) == 0:
+            break
+        if attempt == state_conflict_retries:
+            log_event_00(logging.ERROR, 'apply_keepalives_02', 'Keepalives NOT written, ka_version conflicts left',
+                clients_count=len(pending_ids), clients=pending_ids, attempts=attempt + 1)
+            break
+        raw_items.update({ client_id : fresh_items[client_id] for client_id in pending_ids if client_id in fresh_items })
+
+    es_dict = {}
+    for client_id, update in updates.items():
+        es_dict[client_id] = keepalive_entry_01(client_id, update['client_name'], update['client_callcentername'],
+            json.loads(update['ka_buckets']), update['last_time_active'], window_start)
+    log_event_00(logging.INFO, 'apply_keepalives_02', 'Keepalive state updated',
+        messages=len(messages), clients_count=len(updates), new_clients=new_clients)
+    return es_dict, raw_items
+
 def get_current_time_str_02():
     logger.debug('get_current_time_str_02: return current time as string')
     return time_to_str_01(get_current_time_01())
@@ -803,15 +2142,214 @@ def get_today_day_prefix_str_02():
     logger.debug('get_today_day_prefix_str_02: return current year-month-day prefix as string')
     return (get_current_time_01()).strftime('%Y-%m-%d')
 
+def profiling_enabled_03(event):
+    """ Profile invocation if event has "profile": true, otherwise sample with func_profile_rate """
+    if isinstance(event, dict) and 'profile' in event:
+        return str(event['profile']).lower() == 'true'
+    if profile_rate <= 0:
+        return False
+    import random
+    return random.random() < profile_rate
+
+def run_with_profiling_03(target_func, event, context):
+    """ Run target_func under cProfile and tracemalloc, log top-N hot functions and 
+    allocation sites; with func_profile_dump save raw cProfile stats to /tmp. Target threads
+    (check_all_targets_03) are profiled by profiled_call_00 and merged, hedge threads are not """
+    import cProfile
+    import io
+    import pstats
+    import tracemalloc
+
+    profiler = cProfile.Profile()
+    profile_session['thread_profilers'] = []
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        return target_func(event, context)
+    finally:
+        profiler.disable()
+        thread_profilers = profile_session['thread_profilers']
+        profile_session['thread_profilers'] = None
+        snapshot = tracemalloc.take_snapshot()
+        current_mem, peak_mem = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats_stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stats_stream)
+        if thread_profilers:
+            stats.add(*thread_profilers)
+        stats.sort_stats('cumulative').print_stats(profile_top_n)
+        logger.warning(f'run_with_profiling_03: cProfile top [{profile_top_n}] by cumulative time:\n{stats_stream.getvalue()}')
+
+        alloc_lines = [str(each) for each in snapshot.statistics('lineno')[:profile_top_n]]
+        logger.warning(' '.join((f'run_with_profiling_03: tracemalloc current [{current_mem}] peak [{peak_mem}] bytes,',
+            f'top [{profile_top_n}] allocation sites:\n' + '\n'.join(alloc_lines)
+            )))
+
+        if profile_dump:
+            request_id = getattr(context, 'aws_request_id', None) or str(int(time.time()))
+            dump_path = f'/tmp/profile-{request_id}.prof'
+            stats.dump_stats(dump_path)
+            logger.warning(f'run_with_profiling_03: raw cProfile stats saved to [{dump_path}]')
+
 ### MAIN EXECUTION STARTS HERE:
 def lambda_handler(event, context):
+    if profiling_enabled_03(event):
+        return run_with_profiling_03(run_checks_04, event, context)
+    return run_checks_04(event, context)
+
+def stream_handler(event, context):
+    """ Stream consumer (keepalive_source "stream", first check target): batch of keepalive records updates
+    keepalive state of its clients; absent clients with enough keepalive messages in window (keepalive_window_threshold_01)
+    get their hysteresis run for this minute in the same invocation, so a transition reached within the batch is
+    alerted and written by the batch. Clients gone silent are found by scheduled lambda_handler (sweep) """
+    reset_log_budget_00()
+    set_invocation_deadline_00(context)
+    target = load_check_targets_01()[0]
+    var_obj = target_var_object_01(target, get_current_time_str_02(), get_today_day_prefix_str_02())
+
+    messages = stream_records_parser_01(event)
+    es_dict, raw_items = apply_keepalives_02(messages, var_obj)
+    parsed_ddb_data = ddb_raw_data_parser_02({ 'Items': list(raw_items.values()) }, var_obj)
+    # one observation per client and minute, as in scheduled runs (see stream_sweep_items_01);
+    # client never written by compare has no last_update (parser default is current time)
+    current_minute = var_obj['shared_main_time'][:16]
+    var_obj['count_threshold'] = keepalive_window_threshold_01(str_to_time_01(var_obj['shared_main_time']))
+    due_ddb_data = { client_id : element for client_id, element in parsed_ddb_data.items()
+        if element['status'] == 'absent' and es_dict[client_id]['id_count'] > count_threshold_01(var_obj) and
+        ('last_update' not in raw_items[client_id] or element['last_update'][:16] < current_minute) }
+
+    response = {
+        "log_level"             : log_level,
+        "current_time"          : var_obj['shared_main_time'],
+        "records"               : len(event.get('Records', [])),
+        "clients"               : len(es_dict),
+        "checked_clients"       : len(due_ddb_data)
+    }
+    if len(due_ddb_data) != 0:
+        var_obj['parsed_es_data'] = es_dict # for rebase of clients changed by other writer
+        compared = compare_parsed_data_es_ddb_02({ client_id : es_dict[client_id] for client_id in due_ddb_data },
+            due_ddb_data, var_obj)
+        compared = all_notification_02(compared, var_obj)
+        if len(var_obj['status_transitions']) != 0:
+            # own document (no active/absent lists, dashboards count them from sweep documents only)
+            post_to_elastic_01({
+                "time"          : var_obj['shared_main_time'],
+                "source"        : "stream",
+                "transitions"   : transition_docs_01(compared, var_obj)
+            }, var_obj, doc_id=f'{var_obj["shared_main_time"]}-stream')
+        compared = update_ddb_elements_02(compared, var_obj)
+        response['restored_clients'] = [client_id for client_id, element in compared.items() if element['send_restore_alert_now']]
+    response['dependency_metrics'] = emit_resilience_metrics_00()
+    reset_log_budget_00()
+    return response
 
+def load_check_targets_01():
+    """ Return list of check targets from func_check_targets; every target has all keys,
+    missing ones are taken from MAIN VARS. Default is one target - this deployment """
+    defaults = {
+        "name"                  : environment,
+        "elastic_url"           : elastic_url,
+        "table_name"            : table_name,
+        "support_func_name"     : support_func_name,
+        "slack_url"             : slack_channel_notify,
+        "es_index_prefix"       : es_index_prefix,
+        "keepalive_source"      : keepalive_source,
+        "rollup_index_prefix"   : rollup_index_prefix
+    }
+    targets = []
+    for each in (json.loads(check_targets_json) if check_targets_json.strip() else [{}]):
+        target = dict(defaults)
+        target.update(each)
+        targets.append(target)
+    names = [target['name'] for target in targets]
+    if len(set(names)) != len(names):
+        raise Exception(f'load_check_targets_01: target names must be unique, got [{names}]')
+    return targets
+
+def warm_shared_context_02(targets):
+    """ Create shared clients, http session and credentials before targets run in threads,
+    so threads only reuse them (lazy getters are not thread safe) """
+    get_http_session_00()
+    get_awsauth_00()
+    get_hedge_executor_00()
+    for target in targets:
+        if state_store_backend == 'sqlite':
+            get_sqlite_00(target['table_name'])
+            continue
+        get_aws_client_00('dynamodb')
+        get_aws_client_00('lambda')
+        get_ddb_table_00(target['table_name'])
+
+def request_next_index_02(var_object, index_prefix):
+    """ Check that next day index exists; if not, ask support function (async 'index_create') to install
+    template and create it, so first write of the day does not create index by dynamic mapping """
+    next_day = (str_to_time_01(var_object['shared_main_time']) + datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+    index_name = f'{index_prefix}-{next_day}'
+    try:
+        if check_es_index_exists_01(var_object['elastic_url'], index_name):
+            return False
+        invoke_support_func_01(generate_invoke_payload_01('index_create'), asynccall=True,
+            func_name=var_object['support_func_name'])
+    except Exception as e:
+        log_event_00(logging.ERROR, 'request_next_index_02', 'FAILED to check/request next day index',
+            index=index_name, exception=e)
+        return False
+    log_event_00(logging.WARNING, 'request_next_index_02', 'Next day index is missing, creation requested', index=index_name)
+    return True
+
+def read_client_state_02(es_ids, var_object):
+    """ Read clients from state store: whole table (ddb_read_mode scan; every ddb_full_read_minutes
+    in indexed mode) or only clients which can change status or alert (indexed). Clients absent
+    longer than big_time_delta can not alert and are skipped until they show up in elasticsearch.
+    Indexed read falls back to whole table on error (e.g. index is still being created) or empty result """
+    state_store = state_stores[state_store_backend]
+    current_time = str_to_time_01(var_object['shared_main_time'])
+    epoch_minute = int((current_time - datetime.datetime(1970, 1, 1)).total_seconds() // 60)
+    var_object['full_state_read'] = True
+    if ddb_read_mode != 'indexed' or epoch_minute % ddb_full_read_minutes == 0:
+        return state_store['read_all'](var_object['table_name'])
+    try:
+        raw_data = state_store['read_relevant'](var_object['table_name'], es_ids, var_object)
+    except Exception as e:
+        log_event_00(logging.WARNING, 'read_client_state_02', 'Indexed read FAILED, read whole table',
+            table=var_object['table_name'], exception=e)
+        return state_store['read_all'](var_object['table_name'])
+    if len(raw_data['Items']) == 0:
+        return state_store['read_all'](var_object['table_name'])
+    var_object['full_state_read'] = False
+    return raw_data
+
+def stream_sweep_items_01(ddb_raw_data, shared_main_time):
+    """ Stream source: leave out clients already checked in this minute by stream_handler,
+    so every client gets one hysteresis observation per minute """
+    current_minute = shared_main_time[:16]
+    return { 'Items': [item for item in ddb_raw_data['Items']
+        if item.get('last_update', { 'S': '' })['S'][:16] != current_minute] }
+
+def target_var_object_01(target, shared_main_time, es_today_suffix_part):
+    """ Session vars (var_obj) of one check target run """
     var_obj = {}
-    var_obj['table_name']           = table_name
-    var_obj['elastic_url']          = elastic_url
-    var_obj['shared_main_time']     = get_current_time_str_02()
-    var_obj['es_today_suffix_part'] = get_today_day_prefix_str_02()
-    var_obj['full_es_index_name']   = es_index_prefix + '-' + var_obj['es_today_suffix_part']
+    var_obj['target_name']          = target['name']
+    var_obj['table_name']           = target['table_name']
+    var_obj['elastic_url']          = target['elastic_url']
+    var_obj['support_func_name']    = target['support_func_name']
+    var_obj['slack_url']            = target['slack_url']
+    var_obj['shared_main_time']     = shared_main_time
+    var_obj['es_today_suffix_part'] = es_today_suffix_part
+    var_obj['full_es_index_name']   = target['es_index_prefix'] + '-' + var_obj['es_today_suffix_part']
+    return var_obj
+
+def check_target_03(target, shared_main_time, es_today_suffix_part, cancelled=None):
+    """ One full check cycle of one target: DynamoDB + Elasticsearch -> compare -> notify/update.
+    cancelled: threading.Event set by check_all_targets_03 on timeout, stages with side effects are skipped.
+    Returns results of the cycle with per-stage timings (seconds) """
+    timings = {}
+    started = time.perf_counter()
+    cycle_started = started
+
+    var_obj = target_var_object_01(target, shared_main_time, es_today_suffix_part)
+    var_obj['cancelled'] = cancelled
 
     # logger.info('### ENVIRONMENT VARIABLES ###')
     # logger.info(os.environ)
@@ -819,27 +2357,53 @@ def lambda_handler(event, context):
     # logger.info(event)
     # logger.info(f'### var_obj content: [{var_obj}]')
 
-    raw_ddb_data = get_raw_data_from_ddb_01(table_name)
-    if raw_ddb_data_empty_01(raw_ddb_data):
-        init_call = generate_invoke_payload_01('init')
-        invoke_support_func_01(init_call)
-        raw_ddb_data = get_raw_data_from_ddb_01(table_name)
+    if target['keepalive_source'] == 'stream':
+        # sweep: keepalive counts are kept in state store by stream_handler, no elasticsearch read;
+        # counts cover the window of stream_handler, same threshold
+        var_obj['count_threshold'] = keepalive_window_threshold_01(str_to_time_01(shared_main_time))
+        raw_ddb_data = stream_sweep_items_01(state_stores[state_store_backend]['read_all'](var_obj['table_name']),
+            shared_main_time)
+        parsed_es_data = es_data_from_state_02(raw_ddb_data, var_obj)
+    else:
+        if target['keepalive_source'] == 'rollup':
+            raw_es_data = get_es_rollup_data_01(var_obj['elastic_url'], target['rollup_index_prefix'])
+            parsed_es_data = es_raw_data_parser_rollup_02(raw_es_data)
+        else:
+            raw_es_data = get_es_raw_data_01(var_obj['elastic_url'])
+            parsed_es_data = es_raw_data_parser_keepalive_02(raw_es_data)
+        started = timing_mark_00(timings, 'es_read', started)
+
+        raw_ddb_data = read_client_state_02(list(parsed_es_data), var_obj)
+        if raw_ddb_data_empty_01(raw_ddb_data) and state_store_backend == 'dynamodb':
+            check_cancelled_01(var_obj, 'init')
+            init_call = generate_invoke_payload_01('init')
+            invoke_support_func_01(init_call, func_name=var_obj['support_func_name'])
+            raw_ddb_data = state_stores[state_store_backend]['read_all'](var_obj['table_name'])
+    var_obj['parsed_es_data'] = parsed_es_data # for rebase of clients changed by other writer
     parsed_ddb_data = ddb_raw_data_parser_02(raw_ddb_data, var_obj)
-
-    raw_es_data = get_es_raw_data_01(elastic_url)
-    parsed_es_data = es_raw_data_parser_keepalive_02(raw_es_data)
+    started = timing_mark_00(timings, 'ddb_read', started)
 
     # try: 
-    compared_data_before_actions = compare_parsed_data_es_ddb_02(
+    compare_func = compare_columnar_02 if compare_engine == 'columnar' else compare_parsed_data_es_ddb_02
+    compared_data_before_actions = compare_func(
         parsed_es_data, 
         parsed_ddb_data, 
         var_obj
         )
+    started = timing_mark_00(timings, 'compare', started)
 
     compared_data_after_actions = iterate_over_results_03(
         compared_data_before_actions,
         var_obj
         )
+    started = timing_mark_00(timings, 'notify_and_update', started)
+
+    check_cancelled_01(var_obj, 'enroll_new_clients_03')
+    enrolled_clients = enroll_new_clients_03(parsed_es_data, var_obj['new_client_ids'], var_obj)
+    if var_obj['shared_main_time'][11:16] == index_precheck_time:
+        request_next_index_02(var_obj, target['es_index_prefix'])
+    timing_mark_00(timings, 'enroll', started)
+    timing_mark_00(timings, 'total', cycle_started)
     # except Exception as e: 
     #     logger.error(f'lambda_handler: main cycle failed. Exception: [{e}]')
     #     return {
@@ -851,10 +2415,12 @@ def lambda_handler(event, context):
     # else:
     #     # never happens
     #     all_updated = False
-    
+
+    log_event_00(logging.INFO, 'check_target_03', 'Target checked', target=target['name'], timings=timings)
     return {
-        "log_level"             : log_level,
-        "current_time"          : var_obj['shared_main_time'],
+        "enrolled_clients"      : enrolled_clients,
+        "tier_counts"           : var_obj['tier_counts'],
+        "timings"               : timings,
         # "raw_ddb_data"          : str(raw_ddb_data),
         "parsed_ddb_data"       : parsed_ddb_data,
         # "raw_es_data"           : str(raw_es_data),
@@ -863,6 +2429,71 @@ def lambda_handler(event, context):
         "data_after_act"        : compared_data_after_actions
     }
 
+def target_timeout_01(context):
+    """ Seconds to wait for targets: target_timeout_seconds, but not longer than remaining
+    invocation time minus target_timeout_margin_seconds (results and metrics are still returned) """
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return target_timeout_seconds
+    remaining_seconds = context.get_remaining_time_in_millis() / 1000
+    return max(0, round(min(target_timeout_seconds, remaining_seconds - target_timeout_margin_seconds), 1))
+
+def check_all_targets_03(targets, shared_main_time, es_today_suffix_part, timeout_seconds):
+    """ Run check_target_03 for all targets in thread pool. Failed target or target not finished
+    in timeout_seconds gets { "error" : ... } result and does not delay other targets; its cancel event
+    is set, so the thread skips its remaining alerts and writes """
+    from concurrent.futures import ThreadPoolExecutor, wait
+    warm_shared_context_02(targets)
+    if 'target_executor' not in lazy_context:
+        lazy_context['target_executor'] = ThreadPoolExecutor(max_workers=target_max_workers)
+    cancel_events = { target['name'] : threading.Event() for target in targets }
+    futures = { target['name'] : lazy_context['target_executor'].submit(profiled_call_00, check_target_03, 
+        target, shared_main_time, es_today_suffix_part, cancel_events[target['name']]) for target in targets }
+    wait(futures.values(), timeout=timeout_seconds)
+
+    results = {}
+    for target_name, future in futures.items():
+        if not future.done():
+            # thread can not be stopped: running call ends by its timeout, next stage is skipped
+            cancel_events[target_name].set()
+            log_event_00(logging.ERROR, 'check_all_targets_03', 'Target check TIMED OUT',
+                target=target_name, timeout_seconds=timeout_seconds)
+            results[target_name] = { "error" : f'timeout after [{timeout_seconds}] seconds' }
+        elif future.exception() is not None:
+            log_event_00(logging.ERROR, 'check_all_targets_03', 'Target check FAILED',
+                target=target_name, exception=future.exception())
+            results[target_name] = { "error" : str(future.exception()) }
+        else:
+            results[target_name] = future.result()
+    return results
+
+def run_checks_04(event, context):
+    """ One check cycle for every check target. One target (default) runs in handler thread 
+    and returns its results at top level; several targets run concurrently, results by target name """
+    reset_log_budget_00()
+    set_invocation_deadline_00(context)
+
+    targets = load_check_targets_01()
+    shared_main_time = get_current_time_str_02()
+    es_today_suffix_part = get_today_day_prefix_str_02()
+
+    response = {
+        "log_level"             : log_level,
+        "current_time"          : shared_main_time
+    }
+    if len(targets) == 1:
+        response.update(check_target_03(targets[0], shared_main_time, es_today_suffix_part))
+    else:
+        response['targets'] = check_all_targets_03(targets, shared_main_time, es_today_suffix_part,
+            target_timeout_01(context))
+        log_event_00(logging.INFO, 'run_checks_04', 'Targets checked',
+            timings={ name : result.get('timings', result.get('error')) for name, result in response['targets'].items() })
+
+    response['dependency_metrics'] = emit_resilience_metrics_00()
+    dropped_log_lines = reset_log_budget_00()
+    if dropped_log_lines:
+        logger.warning(f'run_checks_04: [{dropped_log_lines}] log lines dropped by func_log_max_bytes cap')
+    return response
+
 ### Write to elasticsearch:
 #     POST tstx-2019-01-01/doc
 # {
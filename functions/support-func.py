@@ -1,9 +1,6 @@
-import boto3
 import json
 import time
-import requests
 import os
-from requests_aws4auth import AWS4Auth
 
 
 # CONST:
@@ -14,16 +11,188 @@ service = 'es' # for AWS4Auth
 region = os.environ['AWS_REGION']
 table_name = os.environ['DDB_table_name']
 elastic_domain_url = os.environ['ES_domain_url']
+rollup_index_prefix = os.environ.get('es_rollup_index_prefix', 'rollup-keepalive')
+keepalive_source = os.environ.get('es_keepalive_source', 'raw') # raw | rollup - where to look for uniq client ids
+check_index_prefix = os.environ.get('es_check_index_prefix', 'clientchecks') # daily indices written by main function
+check_retention_days = int(os.environ.get('es_check_retention_days', '30')) # older daily indices are deleted, 0 - keep all
+rollup_retention_days = int(os.environ.get('es_rollup_retention_days', '7'))
+summary_index = os.environ.get('es_summary_index', 'availability-summary') # hourly/daily availability per client and call center
+summary_lag_minutes = 2 # fold check documents older than this (refresh_interval of check indices, late writes)
+summary_hourly_days = 35 # hourly buckets are kept for intervals up to this many days back, daily ones always
+summary_page_size = 5000 # check documents with transitions per search; rest is folded by next run
+rollup_first_window = '15m' # first rollup run (no checkpoint) aggregates this window
+rollup_overlap_minutes = 2 # re-aggregate last minutes on every run to pick up late keepalive documents
+es_timeout = (2, 10) # (connect, read) seconds for elasticsearch requests
+es_retries = 2 # retries after first attempt, exponential backoff with full jitter
+backoff_base_seconds = 0.2
+backoff_max_seconds = 2.0
+state_store_backend = os.environ.get('func_state_store', 'dynamodb') # dynamodb | sqlite - local runs, same file as main function
+state_store_path = os.environ.get('func_state_store_path', '/tmp/client-state.sqlite3')
+ddb_status_index = 'status-last_status_change-index' # sparse GSI for main function (ddb_read_mode indexed)
+ddb_status_index_body = {
+    'IndexName': ddb_status_index,
+    'KeySchema': [
+        { 'AttributeName': "status", 'KeyType': "HASH" },
+        { 'AttributeName': "last_status_change", 'KeyType': "RANGE" }
+    ],
+    'Projection': { 'ProjectionType': "ALL" },
+    'ProvisionedThroughput': { 'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1 }
+}
+rollup_index_body = {
+    "settings": { "number_of_shards": 1, "number_of_replicas": 1 },
+    "mappings": {
+        "doc": {
+            "properties": {
+                "client_id"             : { "type": "keyword" },
+                "client_name"           : { "type": "keyword" },
+                "client_callcentername" : { "type": "keyword" },
+                "minute"                : { "type": "date" },
+                "count"                 : { "type": "integer" },
+                "last_seen"             : { "type": "date" }
+            }
+        }
+    }
+}
+
+# client fields as dynamic mapping maps strings (check indices created before the template): text with
+# .keyword sub-field, so old and new indices have one type per field in Kibana index pattern
+text_keyword_mapping = { "type": "text", "fields": { "keyword": { "type": "keyword", "ignore_above": 256 } } }
+client_fields_mapping = {
+    "properties": {
+        "id"     : text_keyword_mapping,
+        "name"   : text_keyword_mapping,
+        "nm-cc"  : text_keyword_mapping,
+        "ccname" : text_keyword_mapping
+    }
+}
+check_index_template = { # one document per main function run, see write_all_to_elastic_02
+    "index_patterns": [ f'{check_index_prefix}-*' ],
+    "order": 1,
+    "settings": { "number_of_shards": 1, "number_of_replicas": 1, "refresh_interval": "30s" },
+    "mappings": {
+        "doc": {
+            "dynamic": False,
+            "properties": {
+                "time"    : { "type": "date" },
+                "clients" : { "properties": { kind: client_fields_mapping for kind in ("active", "absent", "keepalive", "restore", "stilldead") } },
+                "transitions" : { "properties": dict(client_fields_mapping['properties'],
+                    status = text_keyword_mapping, since = { "type": "date" }) },
+                "absent_complete" : { "type": "boolean" } # false: indexed run, clients absent > 12h are not listed
+            }
+        }
+    }
+}
+rollup_index_template = dict(rollup_index_body, index_patterns=[ f'{rollup_index_prefix}-*' ], order=1)
+summary_index_body = { # see fold_transitions; _id "<kind>|<key>|<period>|<start>", "tracker|<client_id>", "checkpoint"
+    "settings": { "number_of_shards": 1, "number_of_replicas": 1 },
+    "mappings": {
+        "doc": {
+            "properties": {
+                "kind"                  : { "type": "keyword" }, # client | callcenter | tracker | checkpoint
+                "key"                   : { "type": "keyword" }, # client_id or call center name
+                "period"                : { "type": "keyword" }, # hour | day
+                "start"                 : { "type": "date" },
+                "client_id"             : { "type": "keyword" },
+                "client_name"           : { "type": "keyword" },
+                "client_callcentername" : { "type": "keyword" },
+                "active_seconds"        : { "type": "double" },
+                "absent_seconds"        : { "type": "double" },
+                "outage_count"          : { "type": "integer" },
+                "restore_count"         : { "type": "integer" },
+                "restore_seconds"       : { "type": "double" },
+                "status"                : { "type": "keyword" },
+                "since"                 : { "type": "date" },
+                "folded_to"             : { "type": "date" }
+            }
+        }
+    }
+}
 
 
 # GLOBAL context:
-credentials = boto3.Session().get_credentials()
-awsauth = AWS4Auth(credentials.access_key, credentials.secret_key, region, service, session_token=credentials.token)
+# boto3, requests and requests_aws4auth are imported on first use and cached for warm invocations
+lazy_context = {}
+rollup_indices_ready = set() # rollup indices created/checked by this container
+
+
+# LAZY context:
+def get_boto3():
+    if 'boto3' not in lazy_context:
+        import boto3
+        lazy_context['boto3'] = boto3
+    return lazy_context['boto3']
+
+
+def get_boto_config():
+    from botocore.config import Config
+    return Config(connect_timeout=2, read_timeout=5, retries={ 'max_attempts': 3 })
+
+
+def get_aws_client(service_name):
+    key = f'client:{service_name}'
+    if key not in lazy_context:
+        lazy_context[key] = get_boto3().client(service_name, region_name=region, config=get_boto_config())
+    return lazy_context[key]
+
+
+def get_ddb_table(table_name):
+    key = f'table:{table_name}'
+    if key not in lazy_context:
+        lazy_context[key] = get_boto3().resource('dynamodb', region_name=region, config=get_boto_config()).Table(table_name)
+    return lazy_context[key]
+
+
+def get_http_session():
+    if 'http_session' not in lazy_context:
+        import requests
+        lazy_context['http_session'] = requests.Session()
+    return lazy_context['http_session']
+
+
+def get_sqlite(table_name):
+    """ sqlite connection with identity columns of state table; main function adds state columns and indexes """
+    import sqlite3
+    if 'sqlite' not in lazy_context:
+        lazy_context['sqlite'] = sqlite3.connect(state_store_path)
+        lazy_context['sqlite'].execute('PRAGMA journal_mode=WAL')
+    with lazy_context['sqlite'] as connection:
+        connection.execute(f'CREATE TABLE IF NOT EXISTS "{table_name}" (client_id TEXT PRIMARY KEY, client_name TEXT, client_callcentername TEXT)')
+    return lazy_context['sqlite']
+
+
+def get_awsauth():
+    if 'awsauth' not in lazy_context:
+        from requests_aws4auth import AWS4Auth
+        credentials = get_boto3().Session().get_credentials()
+        lazy_context['awsauth'] = AWS4Auth(credentials.access_key, credentials.secret_key, region, service, session_token=credentials.token)
+    return lazy_context['awsauth']
+
+
+def es_request(method, url, **kwargs):
+    """ Signed elasticsearch request with timeout; connection errors, 5xx and 429 are retried 
+    with exponential backoff and full jitter, last response/exception is returned/raised """
+    import random
+    kwargs.setdefault('timeout', es_timeout)
+    kwargs.setdefault('auth', get_awsauth())
+    for attempt in range(es_retries + 1):
+        if attempt > 0:
+            time.sleep(random.uniform(0, min(backoff_max_seconds, backoff_base_seconds * (2 ** attempt))))
+        try:
+            response = get_http_session().request(method, url, **kwargs)
+        except Exception as e:
+            if attempt == es_retries:
+                raise
+            print(f'es_request: {method} {url} failed with {e}, retry {attempt + 1}')
+            continue
+        if (response.status_code >= 500 or response.status_code == 429) and attempt < es_retries:
+            print(f'es_request: {method} {url} returned {response.status_code}, retry {attempt + 1}')
+            continue
+        return response
 
 
 # FUNCTIONS:
 def check_ddb_table_exist(table_name):
-    client_ddb = boto3.client('dynamodb')
+    client_ddb = get_aws_client('dynamodb')
     try:
         response = client_ddb.describe_table(TableName=table_name)
         print(f'check_ddb_table_exist: dynamo table {table_name} exists')
@@ -34,7 +203,7 @@ def check_ddb_table_exist(table_name):
 
 
 def create_ddb_table(table_name):
-    client_ddb = boto3.client('dynamodb')
+    client_ddb = get_aws_client('dynamodb')
     waiter = client_ddb.get_waiter('table_exists')
     params = {
         'TableName' : table_name,
@@ -42,8 +211,11 @@ def create_ddb_table(table_name):
             { 'AttributeName': "client_id", 'KeyType': "HASH"}    # Partition key
         ],
         'AttributeDefinitions': [
-            { 'AttributeName': "client_id", 'AttributeType': "S" }
+            { 'AttributeName': "client_id", 'AttributeType': "S" },
+            { 'AttributeName': "status", 'AttributeType': "S" },
+            { 'AttributeName': "last_status_change", 'AttributeType': "S" }
         ],
+        'GlobalSecondaryIndexes': [ ddb_status_index_body ],
         'ProvisionedThroughput': {
             'ReadCapacityUnits': 1,
             'WriteCapacityUnits': 1
@@ -65,7 +237,31 @@ def create_ddb_table(table_name):
         return False
 
 
+def ensure_status_index(table_name):
+    """ Add status index to table created before it existed (index is built by DynamoDB in background) """
+    client_ddb = get_aws_client('dynamodb')
+    try:
+        indexes = client_ddb.describe_table(TableName=table_name)['Table'].get('GlobalSecondaryIndexes', [])
+        if any(each['IndexName'] == ddb_status_index for each in indexes):
+            return True
+        client_ddb.update_table(
+            TableName=table_name,
+            AttributeDefinitions=[
+                { 'AttributeName': "status", 'AttributeType': "S" },
+                { 'AttributeName': "last_status_change", 'AttributeType': "S" }
+            ],
+            GlobalSecondaryIndexUpdates=[{ 'Create': ddb_status_index_body }]
+        )
+        print(f'ensure_status_index: index {ddb_status_index} is being created on table {table_name}')
+        return True
+    except Exception as e:
+        print(f'ensure_status_index: FAILED to check/create index {ddb_status_index} on {table_name} with exception {e}')
+        return False
+
+
 def get_uniq_ids_keepalive(host_url):
+    if keepalive_source == 'rollup':
+        return get_uniq_ids_rollup(host_url)
     # set vars:
     host_url_int = host_url+"/keepalive*/_search"
     # get_query:
@@ -90,7 +286,7 @@ def get_uniq_ids_keepalive(host_url):
     # ES 6.x requires an explicit Content-Type header
     headers = { "Content-Type": "application/json" }
     # Make the signed HTTP request
-    response = requests.get(host_url_int, auth=awsauth, headers=headers, data=json.dumps(query))
+    response = es_request('GET', host_url_int, headers=headers, data=json.dumps(query))
     new_dict = response.json()
     id_list = []
     for each in (response.json())['aggregations']['one']['buckets']:
@@ -99,6 +295,430 @@ def get_uniq_ids_keepalive(host_url):
     return id_list
 
 
+def get_uniq_ids_rollup(host_url):
+    """ Same as get_uniq_ids_keepalive, but aggregates compact per-minute rollup documents """
+    host_url_int = f'{host_url}/{rollup_index_prefix}-*/_search'
+    query = {
+      "size": 0,
+      "query": { "range": { "minute": { "gte": "now-12h" } } },
+      "aggs": { "one": { "terms": { "field": "client_id", "size": 999999 } } }
+    }
+    headers = { "Content-Type": "application/json" }
+    response = es_request('GET', host_url_int, headers=headers, data=json.dumps(query))
+    id_list = [each['key'] for each in response.json()['aggregations']['one']['buckets']]
+    print(f'get_uniq_ids_rollup: list of uniq id-s is retrived from rollup index {rollup_index_prefix}-*')
+    return id_list
+
+
+def get_rollup_checkpoint(host_url):
+    """ Return last rolled up minute ("2019-05-06T19:41:00.000Z") or None before first run """
+    host_url_int = f'{host_url}/{rollup_index_prefix}-meta/doc/checkpoint'
+    response = es_request('GET', host_url_int)
+    if response.status_code == 404:
+        print(f'get_rollup_checkpoint: no checkpoint in {rollup_index_prefix}-meta, first rollup run')
+        return None
+    return response.json()['_source']['last_minute']
+
+
+def put_rollup_checkpoint(host_url, last_minute):
+    host_url_int = f'{host_url}/{rollup_index_prefix}-meta/doc/checkpoint'
+    headers = { "Content-Type": "application/json" }
+    response = es_request('PUT', host_url_int, headers=headers,
+        data=json.dumps({ "last_minute": last_minute }))
+    print(f'put_rollup_checkpoint: checkpoint {last_minute} saved with status {response.status_code}')
+    return response.status_code in (200, 201)
+
+
+def get_keepalive_minute_counts(host_url, since_minute):
+    """ Aggregate raw keepalive documents from since_minute up to last complete minute,
+    per client and per minute: count, last seen time, name and call center name """
+    host_url_int = host_url+"/keepalive*/_search"
+    since = f'{since_minute}||-{rollup_overlap_minutes}m' if since_minute else f'now-{rollup_first_window}/m'
+    query = {
+      "size": 0,
+      "query": {
+        "range": { "machineData.machineTimeUTC": { "gte": since, "lt": "now/m" } }
+      },
+      "aggs": {
+        "clients": {
+          "terms": { "field": "machineData.id.keyword", "size": 999999 },
+          "aggs": {
+            "client_info": {
+              "top_hits": { "size": 1, "_source": [ "machineData.name", "machineData.callCenterName" ] }
+            },
+            "minutes": {
+              "date_histogram": { "field": "machineData.machineTimeUTC", "interval": "1m", "min_doc_count": 1 },
+              "aggs": { "last_seen": { "max": { "field": "machineData.machineTimeUTC" } } }
+            }
+          }
+        }
+      }
+    }
+    headers = { "Content-Type": "application/json" }
+    response = es_request('GET', host_url_int, headers=headers, data=json.dumps(query))
+    print(f'get_keepalive_minute_counts: per-minute keepalive counts aggregated since {since}')
+    return response.json()
+
+
+def rollup_docs_from_aggs(raw_aggs):
+    """ Return list of rollup documents from get_keepalive_minute_counts response:
+    {
+        "client_id"             : "295a5ff3-a1d8-4705-9cfe-ffebd0a2e344",
+        "client_name"           : "mx-edomex-t-c-lite-06",
+        "client_callcentername" : "MX-edomex-T-c-Lite",
+        "minute"                : "2019-05-06T19:41:00.000Z",
+        "count"                 : 6,
+        "last_seen"             : "2019-05-06T19:41:52.653Z"
+    }
+    """
+    docs = []
+    for client in raw_aggs['aggregations']['clients']['buckets']:
+        machine_data = client['client_info']['hits']['hits'][0]['_source']['machineData']
+        for minute in client['minutes']['buckets']:
+            docs.append({
+                "client_id"             : client['key'],
+                "client_name"           : machine_data.get('name', ''),
+                "client_callcentername" : machine_data.get('callCenterName', ''),
+                "minute"                : minute['key_as_string'],
+                "count"                 : minute['doc_count'],
+                "last_seen"             : minute['last_seen']['value_as_string']
+            })
+    print(f'rollup_docs_from_aggs: {len(docs)} rollup documents prepared')
+    return docs
+
+
+def ensure_rollup_index(host_url, index_name):
+    """ Create daily rollup index with explicit keyword mapping if it does not exist """
+    if index_name in rollup_indices_ready:
+        return True
+    headers = { "Content-Type": "application/json" }
+    response = es_request('HEAD', f'{host_url}/{index_name}')
+    if response.status_code == 404:
+        response = es_request('PUT', f'{host_url}/{index_name}', headers=headers,
+            data=json.dumps(rollup_index_body))
+        print(f'ensure_rollup_index: index {index_name} created with status {response.status_code}')
+    rollup_indices_ready.add(index_name)
+    return True
+
+
+def bulk_index_rollup(host_url, docs, chunk_size=5000):
+    """ Write rollup documents with _bulk. Document _id is client_id + minute, so
+    re-aggregated (overlapped) minutes overwrite previous counts instead of adding new documents """
+    headers = { "Content-Type": "application/x-ndjson" }
+    errors = 0
+    for index_day in set(doc['minute'][:10] for doc in docs):
+        ensure_rollup_index(host_url, f'{rollup_index_prefix}-{index_day}')
+    for start in range(0, len(docs), chunk_size):
+        lines = []
+        for doc in docs[start:start + chunk_size]:
+            action = { "index": {
+                "_index": f'{rollup_index_prefix}-{doc["minute"][:10]}',
+                "_type" : "doc",
+                "_id"   : f'{doc["client_id"]}-{doc["minute"]}'
+            } }
+            lines.append(json.dumps(action))
+            lines.append(json.dumps(doc))
+        response = es_request('POST', f'{host_url}/_bulk', headers=headers,
+            data='\n'.join(lines) + '\n')
+        if response.status_code != 200 or response.json().get('errors'):
+            errors += 1
+            print(f'bulk_index_rollup: FAILED bulk chunk from {start}, status {response.status_code}')
+    print(f'bulk_index_rollup: {len(docs)} rollup documents written with {errors} failed chunks')
+    return errors == 0
+
+
+def update_keepalive_rollup(host_url):
+    """ Incremental rollup: aggregate keepalive documents since last checkpoint
+    into per-client, per-minute documents and move checkpoint forward.
+    Nothing to do with raw keepalive source: nobody reads rollup documents """
+    if keepalive_source != 'rollup':
+        return {"rollup_docs": 0, "skipped": f"keepalive_source {keepalive_source}"}
+    checkpoint = get_rollup_checkpoint(host_url)
+    docs = rollup_docs_from_aggs(get_keepalive_minute_counts(host_url, checkpoint))
+    if len(docs) == 0:
+        return {"rollup_docs": 0, "checkpoint": checkpoint}
+    if not bulk_index_rollup(host_url, docs):
+        return {"rollup_docs": len(docs), "checkpoint": checkpoint, "result": False}
+    last_minute = max(doc['minute'] for doc in docs)
+    put_rollup_checkpoint(host_url, last_minute)
+    return {"rollup_docs": len(docs), "checkpoint": last_minute}
+
+
+def put_index_templates(host_url):
+    """ Install index templates, so daily indices get explicit mapping and settings whoever creates them """
+    headers = { "Content-Type": "application/json" }
+    results = {}
+    for template_name, template_body in ((check_index_prefix, check_index_template), (rollup_index_prefix, rollup_index_template)):
+        response = es_request('PUT', f'{host_url}/_template/{template_name}', headers=headers, data=json.dumps(template_body))
+        results[template_name] = response.status_code
+        print(f'put_index_templates: template {template_name} installed with status {response.status_code}')
+    return results
+
+
+def create_daily_index(host_url, index_name):
+    """ Create empty index (settings and mapping from template) if it does not exist """
+    response = es_request('HEAD', f'{host_url}/{index_name}')
+    if response.status_code != 404:
+        return False
+    response = es_request('PUT', f'{host_url}/{index_name}')
+    print(f'create_daily_index: index {index_name} created with status {response.status_code}')
+    return response.status_code == 200
+
+
+def delete_expired_indices(host_url, index_prefix, retention_days):
+    """ Delete daily indices "<index_prefix>-YYYY-MM-DD" older than retention_days """
+    import datetime
+    if retention_days <= 0:
+        return []
+    oldest_day = (datetime.datetime.utcnow() - datetime.timedelta(days=retention_days)).strftime('%Y-%m-%d')
+    response = es_request('GET', f'{host_url}/_cat/indices/{index_prefix}-*', params={ "format": "json", "h": "index" })
+    if response.status_code != 200:
+        print(f'delete_expired_indices: FAILED to list {index_prefix}-* indices, status {response.status_code}')
+        return []
+    deleted = []
+    for each in response.json():
+        index_day = each['index'][len(index_prefix) + 1:]
+        if len(index_day) != 10 or not index_day[:4].isdigit() or index_day >= oldest_day: # not daily (e.g. meta) or young
+            continue
+        if es_request('DELETE', f'{host_url}/{each["index"]}').status_code == 200:
+            deleted.append(each['index'])
+    print(f'delete_expired_indices: deleted {len(deleted)} indices {index_prefix}-* older than {oldest_day}')
+    return deleted
+
+
+def update_index_lifecycle(host_url, days_ahead=1):
+    """ Daily: install templates, create indices of today and next days_ahead days (rollup indices only
+    with keepalive_source rollup), delete expired indices """
+    import datetime
+    templates = put_index_templates(host_url)
+    index_prefixes = (check_index_prefix, rollup_index_prefix) if keepalive_source == 'rollup' else (check_index_prefix,)
+    created = []
+    for day_offset in range(days_ahead + 1):
+        index_day = (datetime.datetime.utcnow() + datetime.timedelta(days=day_offset)).strftime('%Y-%m-%d')
+        for index_prefix in index_prefixes:
+            if create_daily_index(host_url, f'{index_prefix}-{index_day}'):
+                created.append(f'{index_prefix}-{index_day}')
+    deleted = delete_expired_indices(host_url, check_index_prefix, check_retention_days) + \
+        delete_expired_indices(host_url, rollup_index_prefix, rollup_retention_days)
+    return {"templates": templates, "created_indices": created, "deleted_indices": deleted}
+
+
+# AVAILABILITY SUMMARY:
+summary_periods = (("hour", 3600), ("day", 86400))
+
+
+def iso_to_epoch(iso_time):
+    """ '2019-05-06T19:41:32.653Z' -> epoch seconds """
+    import calendar
+    return calendar.timegm(time.strptime(iso_time[:19], '%Y-%m-%dT%H:%M:%S')) + float(iso_time[19:-1] or 0)
+
+
+def epoch_to_iso(epoch):
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(epoch))
+
+
+def summary_buckets(start, end):
+    """ Split interval [start, end) (epoch seconds) into [(period, bucket start, seconds)] of hours and days;
+    hours only for last summary_hourly_days days before end """
+    pieces = []
+    for period, period_seconds in summary_periods:
+        piece_start = max(start, end - summary_hourly_days * 86400) if period == "hour" else start
+        bucket = piece_start - piece_start % period_seconds
+        while bucket < end:
+            seconds = min(bucket + period_seconds, end) - max(bucket, piece_start)
+            if seconds > 0:
+                pieces.append((period, epoch_to_iso(bucket), seconds))
+            bucket += period_seconds
+    return pieces
+
+
+def summary_contributions(check_docs):
+    """ Return [(document time, summary doc _id, summary doc fields, counter, value)] of all transitions in
+    check documents (sorted by time). Previous status lasted from "since" to document time: its seconds are
+    split into hourly and daily buckets. Change to absent adds outage_count, change to active adds restore_count
+    and outage duration (restore_seconds) to buckets of document time. Client and its call center get the same """
+    contributions = []
+    for check_doc in check_docs:
+        end = iso_to_epoch(check_doc['time'])
+        for each in check_doc['transitions']:
+            since = iso_to_epoch(each['since'])
+            previous_status = "active" if each['status'] == "absent" else "absent"
+            counters = [(period, start, f'{previous_status}_seconds', seconds) for period, start, seconds in summary_buckets(since, end)]
+            for period, period_seconds in summary_periods:
+                start = epoch_to_iso(end - end % period_seconds)
+                if each['status'] == "absent":
+                    counters.append((period, start, "outage_count", 1))
+                else:
+                    counters.extend(((period, start, "restore_count", 1), (period, start, "restore_seconds", end - since)))
+            for kind, key in (("client", each['id']), ("callcenter", each['ccname'])):
+                for period, start, counter, value in counters:
+                    fields = { "kind": kind, "key": key, "period": period, "start": start, "client_callcentername": each['ccname'] }
+                    if kind == "client":
+                        fields.update(client_id=each['id'], client_name=each['name'])
+                    contributions.append((check_doc['time'], f'{kind}|{key}|{period}|{start}', fields, counter, value))
+    return contributions
+
+
+def fold_transitions(check_docs, docs, folded_to):
+    """ Fold transitions of check documents (sorted by time, up to folded_to) into summary docs by _id (bucket docs
+    and trackers "tracker|<client_id>" - last status and its start, read before), in place. Bucket doc gets contribution
+    only if it is newer than its folded_to: docs written by failed run are not counted twice. Return ids of changed docs """
+    previously_folded = { doc_id: doc.get('folded_to', '') for doc_id, doc in docs.items() }
+    changed = set()
+    for doc_time, doc_id, fields, counter, value in summary_contributions(check_docs):
+        if doc_time <= previously_folded.get(doc_id, ''):
+            continue
+        if doc_id not in docs:
+            docs[doc_id] = dict(fields, active_seconds=0, absent_seconds=0, outage_count=0, restore_count=0, restore_seconds=0)
+        docs[doc_id][counter] += value
+        docs[doc_id]['folded_to'] = folded_to
+        changed.add(doc_id)
+    for check_doc in check_docs:
+        for each in check_doc['transitions']:
+            tracker_id = f'tracker|{each["id"]}'
+            if tracker_id in docs and docs[tracker_id]['since'] >= check_doc['time']:
+                continue
+            docs[tracker_id] = { "kind": "tracker", "key": each['id'], "client_id": each['id'], "client_name": each['name'],
+                "client_callcentername": each['ccname'], "status": each['status'], "since": check_doc['time'] }
+            changed.add(tracker_id)
+    return changed
+
+
+def ensure_summary_index(host_url):
+    headers = { "Content-Type": "application/json" }
+    if es_request('HEAD', f'{host_url}/{summary_index}').status_code == 404:
+        response = es_request('PUT', f'{host_url}/{summary_index}', headers=headers, data=json.dumps(summary_index_body))
+        print(f'ensure_summary_index: index {summary_index} created with status {response.status_code}')
+    return True
+
+
+def get_summary_docs(host_url, doc_ids, chunk_size=1000):
+    """ Return existing summary docs by _id (_mget) """
+    headers = { "Content-Type": "application/json" }
+    doc_ids = list(doc_ids)
+    docs = {}
+    for start in range(0, len(doc_ids), chunk_size):
+        response = es_request('POST', f'{host_url}/{summary_index}/doc/_mget', headers=headers,
+            data=json.dumps({ "ids": doc_ids[start:start + chunk_size] }))
+        if response.status_code != 200:
+            raise Exception(f'get_summary_docs: _mget failed with status {response.status_code}')
+        docs.update({ each['_id']: each['_source'] for each in response.json()['docs'] if each.get('found') })
+    return docs
+
+
+def search_summary_docs(host_url, filters):
+    headers = { "Content-Type": "application/json" }
+    query = { "size": 10000, "query": { "bool": { "filter": filters } } }
+    response = es_request('GET', f'{host_url}/{summary_index}/_search', headers=headers, data=json.dumps(query))
+    return [each['_source'] for each in response.json()['hits']['hits']]
+
+
+def bulk_index_summary(host_url, docs, chunk_size=5000):
+    """ Write summary docs ({ _id: doc }) with _bulk, return True if all were written """
+    headers = { "Content-Type": "application/x-ndjson" }
+    doc_ids = list(docs)
+    errors = 0
+    for start in range(0, len(doc_ids), chunk_size):
+        lines = []
+        for doc_id in doc_ids[start:start + chunk_size]:
+            lines.append(json.dumps({ "index": { "_index": summary_index, "_type": "doc", "_id": doc_id } }))
+            lines.append(json.dumps(docs[doc_id]))
+        response = es_request('POST', f'{host_url}/_bulk', headers=headers, data='\n'.join(lines) + '\n')
+        if response.status_code != 200 or response.json().get('errors'):
+            errors += 1
+            print(f'bulk_index_summary: FAILED bulk chunk from {start}, status {response.status_code}')
+    print(f'bulk_index_summary: {len(doc_ids)} summary docs written with {errors} failed chunks')
+    return errors == 0
+
+
+def get_check_transitions(host_url, after, until):
+    """ Check documents with transitions, time in (after, until], sorted by time. If there are more than
+    summary_page_size, documents of last time are left for next run. Return (documents, time folded to) """
+    headers = { "Content-Type": "application/json" }
+    query = {
+      "size": summary_page_size,
+      "sort": [ { "time": "asc" } ],
+      "_source": [ "time", "transitions" ],
+      "query": { "bool": { "filter": [
+        { "exists": { "field": "transitions.id" } },
+        { "range": { "time": { "gt": after, "lte": until } } }
+      ] } }
+    }
+    response = es_request('GET', f'{host_url}/{check_index_prefix}-*/_search', headers=headers, data=json.dumps(query))
+    check_docs = [each['_source'] for each in response.json()['hits']['hits']]
+    if len(check_docs) == summary_page_size and check_docs[0]['time'] != check_docs[-1]['time']:
+        until = max(each['time'] for each in check_docs if each['time'] != check_docs[-1]['time'])
+        check_docs = [each for each in check_docs if each['time'] <= until]
+    print(f'get_check_transitions: {len(check_docs)} check documents with transitions in ({after}, {until}]')
+    return check_docs, until
+
+
+def update_availability_summary(host_url):
+    """ Incremental: fold status transitions of check documents since last checkpoint into hourly and daily
+    summaries per client and call center. First run only starts trackers from state store (current status
+    and last_status_change) """
+    ensure_summary_index(host_url)
+    until = epoch_to_iso(time.time() - summary_lag_minutes * 60)
+    checkpoint = get_summary_docs(host_url, ["checkpoint"]).get("checkpoint")
+    if checkpoint is None:
+        docs = { f'tracker|{each["client_id"]}': dict(each, kind="tracker", key=each['client_id']) for each in get_state_statuses(table_name) }
+        changed = set(docs)
+    else:
+        check_docs, until = get_check_transitions(host_url, checkpoint['folded_to'], until)
+        doc_ids = set(doc_id for _, doc_id, _, _, _ in summary_contributions(check_docs))
+        doc_ids.update(f'tracker|{each["id"]}' for check_doc in check_docs for each in check_doc['transitions'])
+        docs = get_summary_docs(host_url, doc_ids)
+        changed = fold_transitions(check_docs, docs, until)
+    if not bulk_index_summary(host_url, { doc_id: docs[doc_id] for doc_id in changed }):
+        return {"summary_docs": len(changed), "checkpoint": checkpoint and checkpoint['folded_to'], "result": False}
+    bulk_index_summary(host_url, { "checkpoint": { "kind": "checkpoint", "folded_to": until } })
+    return {"summary_docs": len(changed), "checkpoint": until}
+
+
+def get_availability(host_url, event):
+    """ Query: availability of one client ("client_id") or call center ("callcenter") by "period" (hour | day,
+    default day) from "from" to "to" (default last 7 days / 24 hours up to now). Folded buckets plus current status
+    of clients (trackers) up to now; availability = active / (active + absent) seconds of tracked time,
+    mttr_seconds = mean outage duration of outages ended in bucket """
+    kind, key = ("client", event['client_id']) if 'client_id' in event else ("callcenter", event['callcenter'])
+    period = event.get('period', 'day')
+    period_seconds = dict(summary_periods)[period]
+    now = time.time()
+    until = min(iso_to_epoch(event['to']), now) if 'to' in event else now
+    since = iso_to_epoch(event['from']) if 'from' in event else until - period_seconds * (7 if period == 'day' else 24)
+    since -= since % period_seconds
+
+    buckets = {}
+    def bucket(start):
+        return buckets.setdefault(start, { "start": start, "active_seconds": 0, "absent_seconds": 0,
+            "outage_count": 0, "restore_count": 0, "restore_seconds": 0 })
+    for doc in search_summary_docs(host_url, [ { "term": { "kind": kind } }, { "term": { "key": key } },
+            { "term": { "period": period } }, { "range": { "start": { "gte": epoch_to_iso(since), "lt": epoch_to_iso(until) } } } ]):
+        for counter in ("active_seconds", "absent_seconds", "outage_count", "restore_count", "restore_seconds"):
+            bucket(doc['start'])[counter] += doc[counter]
+    if kind == "client":
+        trackers = list(get_summary_docs(host_url, [f'tracker|{key}']).values())
+    else:
+        trackers = search_summary_docs(host_url, [ { "term": { "kind": "tracker" } }, { "term": { "client_callcentername": key } } ])
+    for tracker in trackers: # current status lasts from tracker "since" till now
+        for bucket_period, start, seconds in summary_buckets(max(iso_to_epoch(tracker['since']), since), until):
+            if bucket_period == period:
+                bucket(start)[f'{tracker["status"]}_seconds'] += seconds
+
+    total = bucket("total")
+    del buckets["total"]
+    for each in buckets.values():
+        for counter in ("active_seconds", "absent_seconds", "outage_count", "restore_count", "restore_seconds"):
+            total[counter] += each[counter]
+    for each in list(buckets.values()) + [total]:
+        tracked = each['active_seconds'] + each['absent_seconds']
+        each['availability'] = each['active_seconds'] / tracked if tracked else None
+        each['mttr_seconds'] = each['restore_seconds'] / each['restore_count'] if each['restore_count'] else None
+    print(f'get_availability: {kind} {key}, {len(buckets)} {period} buckets, {len(trackers)} trackers')
+    return {"kind": kind, "key": key, "period": period, "from": epoch_to_iso(since), "to": epoch_to_iso(until),
+        "buckets": [buckets[start] for start in sorted(buckets)], "total": total}
+
+
 def get_names_for_ids(ids_list, host_url):
     int_ids_list = ids_list
     query_string = ""
@@ -107,10 +727,10 @@ def get_names_for_ids(ids_list, host_url):
     host_url_int = host_url+"/keepalive*/_msearch"
 
     for each_id in int_ids_list:
-        query_string += query_string + '{}\n{"size": 1, "query": { "match" : { "machineData.id.keyword" : "'+ str(each_id) +'"} } }\n'
+        query_string += '{}\n{"size": 1, "query": { "match" : { "machineData.id.keyword" : "'+ str(each_id) +'"} } }\n'
 
     headers = { "Content-Type": "application/x-ndjson" }
-    response = requests.get(host_url_int, auth=awsauth, headers=headers, data=query_string)
+    response = es_request('GET', host_url_int, headers=headers, data=query_string)
     ##### Check - response may be empty, add TRY-CATCH (if not items to add to ddb) ##################################################
     list_multiquery_responses = (response.json())['responses']
     # return list_multiquery_responses
@@ -134,10 +754,12 @@ def get_names_for_ids(ids_list, host_url):
 
 
 def put_uniq_ids_to_table(id_dict, table_name):
-    dynamodb = boto3.resource('dynamodb', region_name=region)
-    table = dynamodb.Table(table_name)
+    """ Put identity fields of new clients; client already in table (enrolled meanwhile by other call
+    or updated by main function) is not overwritten """
+    table = get_ddb_table(table_name)
     id_dict_int = id_dict
     id_processing_errors = []
+    already_exist = 0
     # current_time = str(time.time())
     for each in id_dict_int:
         try:
@@ -146,12 +768,16 @@ def put_uniq_ids_to_table(id_dict, table_name):
                     'client_id'             : id_dict_int[each]['client_id'],
                     'client_name'           : id_dict_int[each]['client_name'],
                     'client_callcentername' : id_dict_int[each]['client_callcentername']
-                }
+                },
+                ConditionExpression = 'attribute_not_exists(client_id)'
             )
         except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                already_exist += 1
+                continue
             id_processing_errors.append({'item': each, 'exception': e})
     if len(id_processing_errors) == 0:
-        print(f'put_uniq_ids_to_table: new uniq id-s list writed to DynamoDB table {table_name}')
+        print(f'put_uniq_ids_to_table: new uniq id-s list writed to DynamoDB table {table_name}, {already_exist} already existed')
         return True
     else:
         print(f'put_uniq_ids_to_table: FAILED write uniq id-s to DynamoDB table {table_name} with exception: {id_processing_errors}')
@@ -159,14 +785,21 @@ def put_uniq_ids_to_table(id_dict, table_name):
 
 
 def get_user_list_from_ddb(table_name):
-    client = boto3.client('dynamodb')
-
-    response = client.scan(
-        TableName=table_name,
-        ReturnConsumedCapacity='TOTAL'
-    )
-    print(f'get_user_list_from_ddb: return raw list of all records from DynamoDB table {table_name}')
-    return response
+    """ Scan of all pages (1 MB each) of DynamoDB table, as one response: { "Items" : [...], "Count" : ... } """
+    client = get_aws_client('dynamodb')
+    kwargs = {
+        'TableName'                 : table_name,
+        'ReturnConsumedCapacity'    : 'TOTAL'
+    }
+    items = []
+    while True:
+        response = client.scan(**kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    print(f'get_user_list_from_ddb: return raw list of all {len(items)} records from DynamoDB table {table_name}')
+    return { 'Items': items, 'Count': len(items) }
 
 # CHECK IT !!!!!!!!!!!!!!!!!!!!!!!!!!!!!
 def ddb_client_list_parser(ddb_raw_list):
@@ -180,6 +813,66 @@ def list_add_to_ddb(list_ddb, list_es):
     print(f'list_add_to_ddb: return new items from ES which are still not in DynamoDB table')
     return [item for item in list_es if item not in list_ddb]
 
+# STATE STORE (dynamodb | sqlite):
+def ensure_state_table(table_name, check_index=False):
+    """ Create state table if missing; check_index (init only) adds status index to older DynamoDB table """
+    if state_store_backend == 'sqlite':
+        get_sqlite(table_name)
+        return True
+    if not check_ddb_table_exist(table_name):
+        create_ddb_table(table_name)
+        time.sleep(7)
+        return True
+    return ensure_status_index(table_name) if check_index else True
+
+
+def get_state_client_ids(table_name):
+    if state_store_backend == 'sqlite':
+        return [row[0] for row in get_sqlite(table_name).execute(f'SELECT client_id FROM "{table_name}"')]
+    return ddb_client_list_parser(get_user_list_from_ddb(table_name))
+
+
+def get_state_statuses(table_name):
+    """ Clients with status in state store: [{ client_id, client_name, client_callcentername, status, since }],
+    since - last_status_change """
+    fields = ('client_id', 'client_name', 'client_callcentername', 'status', 'since')
+    if state_store_backend == 'sqlite':
+        import sqlite3
+        try:
+            rows = get_sqlite(table_name).execute(' '.join((f'SELECT client_id, client_name, client_callcentername,',
+                f'status, last_status_change FROM "{table_name}" WHERE status IS NOT NULL AND last_status_change IS NOT NULL')))
+        except sqlite3.OperationalError: # status columns are added by main function
+            return []
+        return [dict(zip(fields, row)) for row in rows]
+    client = get_aws_client('dynamodb')
+    kwargs = {
+        'TableName'                 : table_name,
+        'ProjectionExpression'      : 'client_id, client_name, client_callcentername, #sts, last_status_change',
+        'ExpressionAttributeNames'  : { '#sts': 'status' }
+    }
+    statuses = []
+    while True:
+        response = client.scan(**kwargs)
+        for item in response['Items']:
+            if 'status' in item and 'last_status_change' in item:
+                statuses.append(dict(zip(fields, (item.get(name, { 'S': '' })['S'] for name in
+                    ('client_id', 'client_name', 'client_callcentername', 'status', 'last_status_change')))))
+        if 'LastEvaluatedKey' not in response:
+            return statuses
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def put_state_client_ids(id_dict, table_name):
+    """ Add new clients (id, name, call center) to state store, existing clients are kept """
+    if state_store_backend != 'sqlite':
+        return put_uniq_ids_to_table(id_dict, table_name)
+    with get_sqlite(table_name) as connection:
+        connection.executemany(f'INSERT OR IGNORE INTO "{table_name}" (client_id, client_name, client_callcentername) VALUES (?, ?, ?)',
+            [(each['client_id'], each['client_name'], each['client_callcentername']) for each in id_dict.values()])
+    print(f'put_state_client_ids: {len(id_dict)} new uniq id-s writed to sqlite table {table_name}')
+    return True
+
+
 # Lambda execution starts here
 def lambda_handler(event, context):
 
@@ -188,34 +881,42 @@ def lambda_handler(event, context):
     except Exception as e:
         invoked_method = None
 
-    if not check_ddb_table_exist(table_name):
-        create_ddb_table(table_name)
-        time.sleep(7)
+    if invoked_method == "rollup_keepalive": # every minute, does not touch DynamoDB
+        return {"invoked method": invoked_method, "result": True, **update_keepalive_rollup(elastic_domain_url)}
+
+    if invoked_method in ("index_lifecycle", "index_create"): # daily schedule; "index_create" - main function found next index missing
+        return {"invoked method": invoked_method, "result": True, **update_index_lifecycle(elastic_domain_url)}
+
+    if invoked_method == "availability_summary": # schedule, folds status transitions written by main function
+        return {"invoked method": invoked_method, "result": True, **update_availability_summary(elastic_domain_url)}
+
+    if invoked_method == "get_availability": # query: "client_id" or "callcenter", optional "period", "from", "to"
+        return {"invoked method": invoked_method, "result": True, **get_availability(elastic_domain_url, event)}
+
+    ensure_state_table(table_name)
 
     # print(f'Event call: {event["invoke_type"]} and invoked_method: {invoked_method} and they are equal { ( event["invoke_type"] == invoked_method ) }')
     # print("SOME TEST LOGS")
 
-    if invoked_method == "update_ids_list":
-        print(f'List on new id-s to add to dynamodb table: { event["id_list"] }')
-        put_uniq_ids_to_table( event["id_list"], table_name)
+    if invoked_method == "update_ids_list": # new clients found by main function, names are already in payload
+        print(f'List on new id-s to add to dynamodb table: { list(event["id_list"]) }')
+        put_result = put_state_client_ids( event["id_list"], table_name)
+        return {"invoked method": invoked_method, "result": put_result is True, "enrolled_ids": len(event["id_list"])}
 
     elif invoked_method == "init":
-        if not check_ddb_table_exist(table_name):
-            create_ddb_table(table_name)
-            time.sleep(7)
+        ensure_state_table(table_name, check_index=True)
 
-        full01 = ddb_client_list_parser(get_user_list_from_ddb(table_name))
+        full01 = get_state_client_ids(table_name)
         full02 = get_uniq_ids_keepalive(elastic_domain_url)
         full03 = list_add_to_ddb(full01, full02)
+        full04 = get_names_for_ids(full03, elastic_domain_url) if len(full03) != 0 else {}
 
-        put_uniq_ids_to_table(full03, table_name)
+        put_state_client_ids(full04, table_name)
 
     else:
-        if not check_ddb_table_exist(table_name):
-            create_ddb_table(table_name)
-            time.sleep(7)
+        ensure_state_table(table_name)
 
-        full01 = ddb_client_list_parser(get_user_list_from_ddb(table_name))
+        full01 = get_state_client_ids(table_name)
         full02 = get_uniq_ids_keepalive(elastic_domain_url)
         full03 = list_add_to_ddb(full01, full02)
         if len(full03) == 0:
@@ -223,6 +924,6 @@ def lambda_handler(event, context):
         # check if response is empty! ################################################
         full04 = get_names_for_ids(full03, elastic_domain_url)
 
-        put_uniq_ids_to_table(full04, table_name)
+        put_state_client_ids(full04, table_name)
 
     return {"invoked method": invoked_method, "result": True, "event": event, "collected_ids_full03": full03, "collected_names_full04": full04}
\ No newline at end of file
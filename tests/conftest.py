@@ -0,0 +1,84 @@
+""" Fixtures of function tests. functions/*.py are loaded as fresh modules with the stub environment of
+benchmarks/importtime_report.py and sqlite state store in tmp_path, so every test has own globals,
+lazy context and state; outbound http is blocked, slack messages are collected in module.sent_alerts """
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+from importtime_report import FUNCTIONS, STUB_ENV
+
+RUN_TIME = '2019-05-06T19:41:32.000Z'
+
+
+def state_item(client_id, **fields):
+    """ State store item in DynamoDB scan format; fields: name -> str (S) or int (N) """
+    item = {
+        'client_id'             : { 'S': client_id },
+        'client_name'           : { 'S': f'name-{client_id}' },
+        'client_callcentername' : { 'S': 'callcenter' }
+    }
+    for name, value in fields.items():
+        item[name] = { 'N': str(value) } if isinstance(value, int) else { 'S': value }
+    return item
+
+
+def es_entry(client_id, id_count, last_time_active=RUN_TIME):
+    """ Element of es_raw_data_parser_keepalive_02 output """
+    return {
+        'client_id'             : client_id,
+        'client_name'           : f'name-{client_id}',
+        'client_callcentername' : 'callcenter',
+        'last_time_active'      : last_time_active,
+        'id_count'              : id_count
+    }
+
+
+def blocked_http(*args, **kwargs):
+    raise AssertionError('outbound http call in test')
+
+
+@pytest.fixture
+def load_function(monkeypatch, tmp_path):
+    """ load_function(name, **env) - fresh module of functions/<name>.py with env on top of stub environment """
+    def load(name, **env):
+        environment = dict(STUB_ENV, func_state_store='sqlite', func_state_store_path=str(tmp_path / 'state.sqlite3'))
+        environment.update(env)
+        for key, value in environment.items():
+            monkeypatch.setenv(key, value)
+        spec = importlib.util.spec_from_file_location(name.replace('-', '_'), FUNCTIONS[name])
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return load
+
+
+@pytest.fixture
+def main_func(load_function):
+    module = load_function('main-func')
+    module.sent_alerts = []
+    module.get_http_session_00 = blocked_http
+    module.slack_notification_01 = lambda message_title, message_text, var_object=None: \
+        module.sent_alerts.append((message_title, message_text)) or True
+    module.emit_resilience_metrics_00 = lambda: {}
+    return module
+
+
+@pytest.fixture
+def support_func(load_function):
+    module = load_function('support-func')
+    module.get_http_session = blocked_http
+    return module
+
+
+@pytest.fixture(params=['python', 'columnar'])
+def compare_func(request, main_func):
+    """ Both compare engines; columnar only if numpy is installed """
+    if request.param == 'columnar':
+        if main_func.get_numpy_00() is None:
+            pytest.skip('numpy is not installed')
+        return main_func.compare_columnar_02
+    return main_func.compare_parsed_data_es_ddb_02
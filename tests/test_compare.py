@@ -0,0 +1,98 @@
+""" Hysteresis, silent clients and alerts of compare engines (compare_parsed_data_es_ddb_02, compare_columnar_02) """
+import datetime
+import os
+import sys
+
+import pytest
+
+from conftest import ROOT_DIR, es_entry, state_item
+
+sys.path.insert(0, os.path.join(ROOT_DIR, 'tools'))
+import check_compare
+
+START_TIME = datetime.datetime(2019, 5, 6, 19, 0, 0)
+
+
+def run_minutes(module, compare_func, ddb_dict, es_dicts):
+    """ One compare + sent alerts per minute, state carried over; return (states, alerts) per run """
+    states, alerts = [], []
+    for run, es_dict in enumerate(es_dicts, start=1):
+        var_obj = { 'shared_main_time': module.time_to_str_01(START_TIME + datetime.timedelta(minutes=run)) }
+        compared = compare_func(es_dict, ddb_dict, var_obj)
+        compared, grouped_alerts, alert_clients = module.collect_alerts_02(compared, var_obj)
+        for alert_kind, client_ids in alert_clients.items():
+            module.mark_alerts_sent_01(compared, client_ids, alert_kind, var_obj)
+        states.append({ client_id: element['status'] for client_id, element in compared.items() })
+        alerts.append({ kind: sorted(client_ids) for kind, client_ids in alert_clients.items() if client_ids })
+        ddb_dict = compared
+    return states, alerts
+
+
+def parsed_state(module, *items):
+    return module.ddb_raw_data_parser_02({ 'Items': list(items) },
+        { 'shared_main_time': module.time_to_str_01(START_TIME) })
+
+
+@pytest.mark.parametrize('hysteresis_runs', [1, 2, 3, 4])
+def test_silent_active_client_alerts_after_hysteresis_runs(main_func, compare_func, hysteresis_runs):
+    main_func.alert_hysteresis_runs = hysteresis_runs
+    ddb_dict = parsed_state(main_func, state_item('c1', status='active', last_status_change='2019-05-06T10:00:00.000Z'))
+    states, alerts = run_minutes(main_func, compare_func, ddb_dict, [{}] * (hysteresis_runs + 3))
+    flipped_at = [state['c1'] for state in states].index('absent') + 1
+    assert flipped_at == hysteresis_runs
+    assert [run_alerts.get('keepalive') for run_alerts in alerts].count(['c1']) == 1
+
+
+@pytest.mark.parametrize('hysteresis_runs', [1, 2, 3])
+def test_low_count_flips_absent_and_back_with_restore(main_func, compare_func, hysteresis_runs):
+    main_func.alert_hysteresis_runs = hysteresis_runs
+    low, high = main_func.count_compare_number, main_func.count_compare_number + 1
+    ddb_dict = parsed_state(main_func, state_item('c1', status='active', last_status_change='2019-05-06T10:00:00.000Z'))
+    es_dicts = [{ 'c1': es_entry('c1', low) }] * hysteresis_runs + [{ 'c1': es_entry('c1', high) }] * hysteresis_runs
+    states, alerts = run_minutes(main_func, compare_func, ddb_dict, es_dicts)
+    assert states[hysteresis_runs - 1]['c1'] == 'absent'
+    assert states[-1]['c1'] == 'active'
+    assert alerts[hysteresis_runs - 1] == { 'keepalive': ['c1'] }
+    assert alerts[-1] == { 'restore': ['c1'] }
+
+
+def test_single_bad_run_does_not_flip_with_hysteresis(main_func, compare_func):
+    main_func.alert_hysteresis_runs = 2
+    high = main_func.count_compare_number + 1
+    ddb_dict = parsed_state(main_func, state_item('c1', status='active', last_status_change='2019-05-06T10:00:00.000Z'))
+    es_dicts = [{ 'c1': es_entry('c1', 0) }, { 'c1': es_entry('c1', high) }, { 'c1': es_entry('c1', 0) }]
+    states, alerts = run_minutes(main_func, compare_func, ddb_dict, es_dicts)
+    assert [state['c1'] for state in states] == ['active', 'active', 'active']
+    assert alerts == [{}, {}, {}]
+
+
+def test_keepalive_realert_interval_holds_second_alert(main_func, compare_func):
+    main_func.alert_hysteresis_runs = 1
+    high = main_func.count_compare_number + 1
+    ddb_dict = parsed_state(main_func, state_item('c1', status='active', last_status_change='2019-05-06T10:00:00.000Z'))
+    es_dicts = [{}, { 'c1': es_entry('c1', high) }, {}]
+    states, alerts = run_minutes(main_func, compare_func, ddb_dict, es_dicts)
+    assert [state['c1'] for state in states] == ['absent', 'active', 'absent']
+    assert [run_alerts.get('keepalive') for run_alerts in alerts] == [['c1'], None, None]
+
+
+def test_absent_client_without_keepalives_stays_absent(main_func, compare_func):
+    main_func.alert_hysteresis_runs = 1
+    ddb_dict = parsed_state(main_func, state_item('c1', status='absent', last_status_change='2019-05-06T18:00:00.000Z',
+        last_still_dead_notify='2019-05-06T18:00:00.000Z'))
+    states, alerts = run_minutes(main_func, compare_func, ddb_dict, [{}, {}])
+    assert [state['c1'] for state in states] == ['absent', 'absent']
+    assert 'keepalive' not in alerts[0] and 'restore' not in alerts[0]
+
+
+def test_new_client_is_left_for_enrollment(main_func, compare_func):
+    var_obj = { 'shared_main_time': main_func.time_to_str_01(START_TIME) }
+    compared = compare_func({ 'new': es_entry('new', 20) }, {}, var_obj)
+    assert compared == {}
+    assert list(var_obj['new_client_ids']) == ['new']
+
+
+def test_engines_give_same_results_on_random_fleets(main_func):
+    if main_func.get_numpy_00() is None:
+        pytest.skip('numpy is not installed')
+    assert check_compare.engine_mismatches(main_func, fleets=40, seed=3) == []
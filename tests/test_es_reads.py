@@ -0,0 +1,109 @@
+""" Keepalive counts from elasticsearch: composite aggregation paging, truncated and failed answers """
+import json
+
+import pytest
+
+
+class FakeResponse:
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+
+    def json(self):
+        return self.body
+
+
+def raw_bucket(client_id, doc_count):
+    return {
+        'key'           : { 'client_id': client_id },
+        'doc_count'     : doc_count,
+        'last_seen'     : { 'value_as_string': '2019-05-06T19:41:30.123Z' },
+        'client_info'   : { 'hits': { 'hits': [{ '_source': { 'machineData': {
+            'name': f'name-{client_id}', 'callCenterName': 'callcenter' } } }] } }
+    }
+
+
+def rollup_bucket(client_id, minutes, count):
+    return {
+        'key'           : { 'client_id': client_id },
+        'doc_count'     : minutes,
+        'count'         : { 'value': float(count) },
+        'last_seen'     : { 'value_as_string': '2019-05-06T19:40:52.653Z' },
+        'client_info'   : { 'hits': { 'hits': [{ '_source': {
+            'client_name': f'name-{client_id}', 'client_callcentername': 'callcenter' } }] } }
+    }
+
+
+def search_answer(buckets, total, **extra):
+    body = {
+        'timed_out'     : False,
+        '_shards'       : { 'total': 5, 'successful': 5, 'failed': 0 },
+        'hits'          : { 'total': total, 'hits': [] },
+        'aggregations'  : { 'clients': { 'buckets': buckets } }
+    }
+    if buckets:
+        body['aggregations']['clients']['after_key'] = buckets[-1]['key']
+    body.update(extra)
+    return body
+
+
+@pytest.fixture
+def es_pages(main_func):
+    """ es_pages(answers) - elasticsearch answers one by one, sent queries are returned """
+    def install(answers):
+        queries = []
+        answers = list(answers)
+        def fake_request(policy_name, method, url, **kwargs):
+            queries.append(json.loads(kwargs['data']))
+            return answers.pop(0)
+        main_func.http_request_00 = fake_request
+        main_func.get_awsauth_00 = lambda: None
+        main_func.es_page_size = 2
+        return queries
+    return install
+
+
+def test_raw_counts_are_read_page_by_page(main_func, es_pages):
+    queries = es_pages([
+        FakeResponse(search_answer([raw_bucket('a', 18), raw_bucket('b', 3)], 24)),
+        FakeResponse(search_answer([raw_bucket('c', 3)], 24))
+    ])
+    parsed = main_func.es_raw_data_parser_keepalive_02(main_func.get_es_raw_data_01('https://es'))
+    assert sorted(parsed) == ['a', 'b', 'c']
+    assert parsed['a']['id_count'] == 18
+    assert parsed['a']['client_name'] == 'name-a'
+    assert parsed['a']['last_time_active'] == '2019-05-06T19:41:30.123Z'
+    assert 'after' not in queries[0]['aggs']['clients']['composite']
+    assert queries[1]['aggs']['clients']['composite']['after'] == { 'client_id': 'b' }
+    # same fixed window on every page
+    assert queries[0]['query'] == queries[1]['query']
+
+
+def test_rollup_counts_are_summed_by_elasticsearch(main_func, es_pages):
+    es_pages([FakeResponse(search_answer([rollup_bucket('a', 3, 17)], 3))])
+    parsed = main_func.es_raw_data_parser_rollup_02(main_func.get_es_rollup_data_01('https://es'))
+    assert parsed['a']['id_count'] == 17
+    assert parsed['a']['client_callcentername'] == 'callcenter'
+
+
+def test_truncated_result_fails_loudly(main_func, es_pages):
+    # documents of returned buckets do not add up to hits.total: clients are missing
+    es_pages([FakeResponse(search_answer([raw_bucket('a', 18)], 10000))])
+    with pytest.raises(Exception, match='truncated'):
+        main_func.get_es_raw_data_01('https://es')
+
+
+def test_total_of_elasticsearch_7_is_supported(main_func, es_pages):
+    es_pages([FakeResponse(search_answer([raw_bucket('a', 18)], { 'value': 18, 'relation': 'eq' }))])
+    assert len(main_func.get_es_raw_data_01('https://es')) == 1
+
+
+@pytest.mark.parametrize('answer', [
+    FakeResponse(search_answer([raw_bucket('a', 18)], 18, _shards={ 'total': 5, 'successful': 4, 'failed': 1 })),
+    FakeResponse(search_answer([raw_bucket('a', 18)], 18, timed_out=True)),
+    FakeResponse({ 'error': { 'type': 'search_phase_execution_exception' } }, status_code=503)
+])
+def test_partial_answer_fails_loudly(main_func, es_pages, answer):
+    es_pages([answer])
+    with pytest.raises(Exception, match='incomplete answer'):
+        main_func.get_es_raw_data_01('https://es')
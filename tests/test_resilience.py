@@ -0,0 +1,74 @@
+""" resilient_call_00: no retry of non-idempotent calls (slack message, lambda invoke) that may have been received """
+import pytest
+
+
+def exception_class(name, *bases):
+    return type(name, bases or (Exception,), {})
+
+# same class names and nesting as requests / urllib3 / botocore exceptions
+NewConnectionError = exception_class('NewConnectionError')
+ReadTimeoutError = exception_class('ReadTimeoutError')
+ConnectionError = exception_class('ConnectionError')
+ReadTimeout = exception_class('ReadTimeout')
+EndpointConnectionError = exception_class('EndpointConnectionError')
+ClientError = exception_class('ClientError')
+
+
+class MaxRetryError(Exception):
+    def __init__(self, reason):
+        super().__init__(f'Max retries exceeded (Caused by {reason!r})')
+        self.reason = reason
+
+
+def client_error(status_code):
+    exception = ClientError(f'An error occurred, status {status_code}')
+    exception.response = { 'Error': { 'Code': 'TooManyRequestsException' }, 'ResponseMetadata': { 'HTTPStatusCode': status_code } }
+    return exception
+
+
+def failing_call(calls, exception):
+    def call():
+        calls.append(1)
+        if len(calls) == 1:
+            raise exception
+        return 'ok'
+    return call
+
+
+@pytest.fixture
+def resilient(main_func):
+    main_func.backoff_base_seconds = 0
+    return main_func
+
+
+@pytest.mark.parametrize('exception', [
+    ConnectionError(MaxRetryError(NewConnectionError('Failed to establish a new connection'))),
+    EndpointConnectionError('Could not connect to the endpoint URL'),
+    client_error(429),
+    client_error(503)
+])
+@pytest.mark.parametrize('policy_name', ['slack', 'lambda'])
+def test_not_received_request_is_retried(resilient, policy_name, exception):
+    calls = []
+    assert resilient.resilient_call_00(policy_name, 'target', failing_call(calls, exception)) == 'ok'
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize('exception', [
+    ReadTimeout(MaxRetryError(ReadTimeoutError('Read timed out. (read timeout=3)'))),
+    ConnectionError(MaxRetryError(exception_class('ProtocolError')('Connection aborted'))),
+    client_error(400)
+])
+@pytest.mark.parametrize('policy_name', ['slack', 'lambda'])
+def test_maybe_received_request_is_not_sent_again(resilient, policy_name, exception):
+    calls = []
+    with pytest.raises(type(exception)):
+        resilient.resilient_call_00(policy_name, 'target', failing_call(calls, exception))
+    assert len(calls) == 1
+
+
+def test_idempotent_call_is_retried_after_read_timeout(resilient):
+    calls = []
+    exception = ReadTimeout(MaxRetryError(ReadTimeoutError('Read timed out. (read timeout=4)')))
+    assert resilient.resilient_call_00('es_search', 'target', failing_call(calls, exception)) == 'ok'
+    assert len(calls) == 2
@@ -0,0 +1,81 @@
+""" SQLite state store backend: scan format, migration of old tables, relevant reads, writes and enrollment """
+import sqlite3
+
+from conftest import RUN_TIME, state_item
+
+
+def element(client_id, **fields):
+    """ update_element_to_ddb_01 input of one client """
+    values = {
+        'client_id'                 : client_id,
+        'client_name'               : f'name-{client_id}',
+        'client_callcentername'     : 'callcenter',
+        'status'                    : 'active',
+        'last_status_change'        : '2019-05-06T10:00:00.000Z',
+        'last_ka_alert_notify'      : '2019-05-06T10:00:00.000Z',
+        'last_restore_alert_notify' : '2019-05-06T10:00:00.000Z',
+        'last_still_dead_notify'    : '2019-05-06T10:00:00.000Z',
+        'pending_status'            : 'active',
+        'pending_count'             : 0,
+        'flap_count'                : 0,
+        'version'                   : 0
+    }
+    values.update(fields)
+    return values
+
+
+def test_written_elements_are_read_in_scan_format(main_func):
+    var_obj = { 'shared_main_time': RUN_TIME, 'table_name': 'clients' }
+    assert main_func.write_elements_to_sqlite_01([element('c1', pending_count=1, version=4)], 'clients', var_obj) == 1
+    items = main_func.read_all_from_sqlite_01('clients')['Items']
+    assert items == [state_item('c1', status='active', last_status_change='2019-05-06T10:00:00.000Z',
+        last_ka_alert_notify='2019-05-06T10:00:00.000Z', last_restore_alert_notify='2019-05-06T10:00:00.000Z',
+        last_still_dead_notify='2019-05-06T10:00:00.000Z', last_update=RUN_TIME, pending_status='active',
+        pending_count=1, flap_count=0, version=5)]
+    # parser sees the same element again
+    parsed = main_func.ddb_raw_data_parser_02({ 'Items': items }, var_obj)
+    assert parsed['c1']['pending_count'] == 1 and parsed['c1']['version'] == 5
+
+
+def test_enrollment_keeps_existing_state(main_func):
+    var_obj = { 'shared_main_time': RUN_TIME, 'table_name': 'clients' }
+    main_func.write_elements_to_sqlite_01([element('c1', status='absent')], 'clients', var_obj)
+    enrolled = main_func.enroll_ids_to_sqlite_01({
+        'c1': { 'client_id': 'c1', 'client_name': 'renamed', 'client_callcentername': 'callcenter' },
+        'c2': { 'client_id': 'c2', 'client_name': 'name-c2', 'client_callcentername': 'callcenter' } }, var_obj)
+    assert enrolled == 2
+    items = { item['client_id']['S']: item for item in main_func.read_all_from_sqlite_01('clients')['Items'] }
+    assert items['c1']['status'] == { 'S': 'absent' } and items['c1']['client_name'] == { 'S': 'name-c1' }
+    assert 'status' not in items['c2'] # missing attribute, like DynamoDB item put by enrollment
+
+
+def test_relevant_read_leaves_out_long_absent_clients_not_in_elasticsearch(main_func):
+    var_obj = { 'shared_main_time': RUN_TIME, 'table_name': 'clients' }
+    main_func.write_elements_to_sqlite_01([
+        element('active'),
+        element('absent-recent', status='absent', last_status_change='2019-05-06T19:00:00.000Z'),
+        element('absent-old', status='absent', last_status_change='2019-05-05T19:00:00.000Z'),
+        element('absent-old-seen', status='absent', last_status_change='2019-05-05T19:00:00.000Z')
+    ], 'clients', var_obj)
+    items = main_func.read_relevant_from_sqlite_01('clients', ['absent-old-seen', 'unknown'], var_obj)['Items']
+    assert sorted(item['client_id']['S'] for item in items) == ['absent-old-seen', 'absent-recent', 'active']
+
+
+def test_old_table_gets_missing_columns(load_function, tmp_path):
+    path = tmp_path / 'old.sqlite3'
+    with sqlite3.connect(str(path)) as connection:
+        connection.execute('CREATE TABLE "clients" (client_id TEXT PRIMARY KEY, client_name TEXT, status TEXT)')
+        connection.execute('INSERT INTO "clients" VALUES (\'c1\', \'name-c1\', \'active\')')
+    main_func = load_function('main-func', func_state_store_path=str(path))
+    items = main_func.read_all_from_sqlite_01('clients')['Items']
+    assert items == [{ 'client_id': { 'S': 'c1' }, 'client_name': { 'S': 'name-c1' }, 'status': { 'S': 'active' } }]
+    columns = set(row[1] for row in main_func.get_sqlite_00('clients').execute('PRAGMA table_info("clients")'))
+    assert columns == set(main_func.state_columns)
+
+
+def test_many_ids_are_read_in_chunks(main_func):
+    var_obj = { 'shared_main_time': RUN_TIME, 'table_name': 'clients' }
+    client_ids = [f'c{num:04d}' for num in range(1200)]
+    main_func.write_elements_to_sqlite_01([element(client_id) for client_id in client_ids], 'clients', var_obj)
+    items = main_func.read_ids_from_sqlite_01('clients', client_ids + ['unknown'])['Items']
+    assert len(items) == 1200
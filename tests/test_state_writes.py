@@ -0,0 +1,89 @@
+""" DynamoDB state writes: version conflicts, rebase on fresh state and own writes of retried updates """
+import pytest
+
+from conftest import RUN_TIME, state_item
+
+
+class FakeTable:
+    """ Client items in scan format with the version condition of update_element_to_ddb_01.
+    lost_answers: number of first updates that are applied, but answered like a retry against own write """
+
+    def __init__(self, main_func, *items, lost_answers=0):
+        self.main_func = main_func
+        self.items = { item['client_id']['S']: item for item in items }
+        self.lost_answers = lost_answers
+        self.updates = []
+        main_func.update_element_to_ddb_01 = self.update
+        main_func.get_element_from_ddb_01 = self.get
+
+    def update(self, element, table_name, var_object):
+        self.updates.append(dict(element))
+        current = self.items.get(element['client_id'])
+        if current is not None and current.get('version', { 'N': '0' })['N'] != str(element['version']):
+            return "conflict"
+        fields = { name: value for name, value in element.items() if name != 'client_id' }
+        fields.update(version=element['version'] + 1, last_update=var_object['shared_main_time'])
+        self.items[element['client_id']] = state_item(element['client_id'], **fields)
+        if self.lost_answers:
+            self.lost_answers -= 1
+            return "conflict"
+        return True
+
+    def get(self, client_id, table_name):
+        return { 'Items': [self.items[client_id]] if client_id in self.items else [] }
+
+    def field(self, client_id, name):
+        value = self.items[client_id][name]
+        return int(value['N']) if 'N' in value else value['S']
+
+
+def run_once(main_func, table, es_dict):
+    """ compare of one run on table state, elements written like update_ddb_elements_02 """
+    var_obj = { 'shared_main_time': RUN_TIME, 'parsed_es_data': es_dict }
+    ddb_dict = main_func.ddb_raw_data_parser_02({ 'Items': list(table.items.values()) }, var_obj)
+    compared = main_func.compare_parsed_data_es_ddb_02(es_dict, ddb_dict, var_obj)
+    elements = [{ name: element[name] for name in ('client_id', 'client_name', 'client_callcentername', 'status',
+        'last_status_change', 'last_ka_alert_notify', 'last_restore_alert_notify', 'last_still_dead_notify',
+        'pending_status', 'pending_count', 'flap_count', 'version') } for element in compared.values()]
+    return main_func.write_elements_to_ddb_04(elements, 'clients', var_obj)
+
+
+def silent_active_client(version):
+    return state_item('c1', status='active', last_status_change='2019-05-06T10:00:00.000Z',
+        last_update='2019-05-06T19:40:32.000Z', version=version)
+
+
+def test_own_write_of_retried_update_is_not_applied_twice(main_func):
+    main_func.alert_hysteresis_runs = 3
+    table = FakeTable(main_func, silent_active_client(4), lost_answers=1)
+    assert run_once(main_func, table, {}) == 1
+    assert len(table.updates) == 1
+    assert table.field('c1', 'version') == 5
+    assert table.field('c1', 'pending_count') == 1 # one silent run, not two
+    assert table.field('c1', 'status') == 'active'
+
+
+def test_conflict_with_other_writer_is_rebased_on_fresh_state(main_func):
+    main_func.alert_hysteresis_runs = 2
+    table = FakeTable(main_func, silent_active_client(4))
+    original_update = table.update
+    def other_run_writes_first(element, table_name, var_object):
+        if not table.updates: # other run of the previous minute saw the same silent run
+            original_update(dict(element), table_name, { 'shared_main_time': '2019-05-06T19:41:31.000Z' })
+            table.updates.clear()
+        return original_update(element, table_name, var_object)
+    main_func.update_element_to_ddb_01 = other_run_writes_first
+    assert run_once(main_func, table, {}) == 1
+    assert [update['version'] for update in table.updates] == [4, 5]
+    assert table.field('c1', 'version') == 6
+    assert table.field('c1', 'status') == 'absent' # second silent run on top of the other writer's first
+
+
+def test_client_is_given_up_after_conflict_retries(main_func):
+    table = FakeTable(main_func, silent_active_client(4))
+    def always_conflict(element, table_name, var_object):
+        table.updates.append(dict(element))
+        return "conflict"
+    main_func.update_element_to_ddb_01 = always_conflict
+    assert run_once(main_func, table, {}) == 0
+    assert len(table.updates) == main_func.state_conflict_retries + 1
@@ -0,0 +1,110 @@
+""" Push mode: keepalive state of stream batches, ka_version conflicts and the count threshold of stream and sweep """
+import base64
+import datetime
+import json
+
+import pytest
+
+from conftest import blocked_http
+
+START_TIME = datetime.datetime(2019, 5, 6, 19, 0, 50)
+
+
+def kinesis_event(client_id, count, first_time):
+    records = []
+    for second in range(count):
+        doc = { 'logType': 'Keepalive', 'machineData': { 'id': client_id, 'name': f'name-{client_id}',
+            'callCenterName': 'callcenter',
+            'machineTimeUTC': (first_time + datetime.timedelta(seconds=second)).strftime('%Y-%m-%dT%H:%M:%S.000Z') } }
+        records.append({ 'kinesis': { 'data': base64.b64encode(json.dumps(doc).encode()).decode() } })
+    return { 'Records': records }
+
+
+@pytest.fixture
+def stream_func(load_function):
+    module = load_function('main-func', es_keepalive_source='stream')
+    module.sent_alerts = []
+    module.get_http_session_00 = blocked_http
+    module.slack_notification_01 = lambda message_title, message_text, var_object=None: \
+        module.sent_alerts.append((message_title, message_text)) or True
+    module.post_to_elastic_01 = lambda *args, **kwargs: True
+    module.request_next_index_02 = lambda var_object, index_prefix: False
+    module.emit_resilience_metrics_00 = lambda: {}
+    module.clock = [START_TIME]
+    module.get_current_time_01 = lambda: module.clock[0]
+    return module
+
+
+def stored(module, client_id):
+    items = module.read_ids_from_sqlite_01(module.table_name, [client_id])['Items']
+    return module.keepalive_state_01(items[0]) if items else None
+
+
+def test_batch_is_one_write_per_client(stream_func):
+    writes = []
+    write_keepalives = stream_func.state_stores['sqlite']['write_keepalives']
+    stream_func.state_stores['sqlite']['write_keepalives'] = lambda updates, table_name: \
+        writes.append([update['client_id'] for update in updates]) or write_keepalives(updates, table_name)
+    stream_func.stream_handler(kinesis_event('a', 12, START_TIME), None)
+    assert writes == [['a']]
+    buckets, last_time_active, ka_version = stored(stream_func, 'a')
+    assert buckets == { '2019-05-06T19:00': 10, '2019-05-06T19:01': 2 }
+    assert last_time_active == '2019-05-06T19:01:01.000Z'
+    assert ka_version == 1
+
+
+def test_other_batch_written_in_between_is_not_lost(stream_func):
+    # batches of one client on two shards / concurrent consumers: the second read-modify-write conflicts
+    write_keepalives = stream_func.state_stores['sqlite']['write_keepalives']
+    def other_batch_first(updates, table_name):
+        stream_func.state_stores['sqlite']['write_keepalives'] = write_keepalives
+        other = stream_func.keepalive_update_01('a', { 'minutes': { '2019-05-06T19:00': 5 },
+            'last_time_active': '2019-05-06T19:00:20.000Z', 'client_name': 'name-a', 'client_callcentername': 'callcenter' },
+            {}, '2019-05-06T18:57')
+        assert write_keepalives([other], table_name) == []
+        return write_keepalives(updates, table_name)
+    stream_func.state_stores['sqlite']['write_keepalives'] = other_batch_first
+    response = stream_func.stream_handler(kinesis_event('a', 3, START_TIME), None)
+    assert response['clients'] == 1
+    buckets, last_time_active, ka_version = stored(stream_func, 'a')
+    assert buckets == { '2019-05-06T19:00': 8 }
+    assert last_time_active == '2019-05-06T19:00:52.000Z'
+    assert ka_version == 2
+
+
+def test_own_write_of_retried_update_is_not_counted_twice(stream_func):
+    # write applied, answer lost: the retry reports a ka_version conflict against our own write
+    write_keepalives = stream_func.state_stores['sqlite']['write_keepalives']
+    def lost_answer(updates, table_name):
+        stream_func.state_stores['sqlite']['write_keepalives'] = write_keepalives
+        write_keepalives(updates, table_name)
+        return [update['client_id'] for update in updates]
+    stream_func.state_stores['sqlite']['write_keepalives'] = lost_answer
+    stream_func.stream_handler(kinesis_event('a', 4, START_TIME), None)
+    buckets, _, ka_version = stored(stream_func, 'a')
+    assert buckets == { '2019-05-06T19:00': 4 }
+    assert ka_version == 1
+
+
+@pytest.mark.parametrize('above_threshold', [False, True])
+def test_sweep_uses_scaled_threshold_of_stream(stream_func, above_threshold):
+    stream_func.alert_hysteresis_runs = 1
+    threshold = stream_func.keepalive_window_threshold_01(START_TIME)
+    count = int(threshold) + (1 if above_threshold else 0) # both above unscaled count_compare_number
+    assert count > stream_func.count_compare_number
+    stream_func.stream_handler(kinesis_event('a', count, START_TIME - datetime.timedelta(seconds=count)), None)
+    response = stream_func.lambda_handler({}, None)
+    assert response['data_after_act']['a']['status'] == ('active' if above_threshold else 'absent')
+
+
+def test_stream_checks_absent_client_with_same_threshold(stream_func):
+    stream_func.alert_hysteresis_runs = 1
+    stream_func.lambda_handler({}, None) # nothing stored yet
+    stream_func.stream_handler(kinesis_event('a', 5, START_TIME - datetime.timedelta(seconds=40)), None)
+    stream_func.lambda_handler({}, None) # first sweep writes new client absent
+    stream_func.clock[0] += datetime.timedelta(minutes=1)
+    threshold = stream_func.keepalive_window_threshold_01(stream_func.clock[0])
+    response = stream_func.stream_handler(kinesis_event('a', int(threshold) - 5 + 1,
+        stream_func.clock[0] - datetime.timedelta(seconds=45)), None)
+    assert response['checked_clients'] == 1
+    assert response['restored_clients'] == ['a']
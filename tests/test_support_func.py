@@ -0,0 +1,44 @@
+""" SupportFunc: keepalive rollup schedule """
+
+
+def test_rollup_run_is_noop_with_raw_keepalive_source(support_func):
+    # default source is raw; any Elasticsearch request would fail on blocked http session
+    result = support_func.update_keepalive_rollup('https://localhost:9200')
+    assert result['rollup_docs'] == 0
+    assert 'skipped' in result
+
+
+def test_rollup_run_reads_checkpoint_with_rollup_source(load_function):
+    support_func = load_function('support-func', es_keepalive_source='rollup')
+    calls = []
+    support_func.get_rollup_checkpoint = lambda host_url: calls.append(host_url) or None
+    support_func.get_keepalive_minute_counts = lambda host_url, checkpoint: {}
+    support_func.rollup_docs_from_aggs = lambda aggs: []
+    assert support_func.update_keepalive_rollup('https://localhost:9200') == { 'rollup_docs': 0, 'checkpoint': None }
+    assert calls == ['https://localhost:9200']
+
+
+def test_check_template_maps_client_fields_like_dynamic_mapping(support_func):
+    # indices created before the template have text + .keyword for strings; Kibana needs one type per field
+    properties = support_func.check_index_template['mappings']['doc']['properties']
+    client_fields = [properties['clients']['properties'][kind]['properties'] for kind in properties['clients']['properties']]
+    client_fields.append(properties['transitions']['properties'])
+    for fields in client_fields:
+        for name, mapping in fields.items():
+            if name != 'since':
+                assert mapping['type'] == 'text' and mapping['fields']['keyword']['type'] == 'keyword', name
+
+
+def test_user_list_scan_reads_all_pages(support_func):
+    pages = [
+        { 'Items': [{ 'client_id': { 'S': 'c1' } }, { 'client_id': { 'S': 'c2' } }], 'LastEvaluatedKey': { 'client_id': { 'S': 'c2' } } },
+        { 'Items': [{ 'client_id': { 'S': 'c3' } }] }
+    ]
+    scans = []
+    class FakeClient:
+        def scan(self, **kwargs):
+            scans.append(kwargs.get('ExclusiveStartKey'))
+            return pages[len(scans) - 1]
+    support_func.get_aws_client = lambda service_name: FakeClient()
+    assert support_func.ddb_client_list_parser(support_func.get_user_list_from_ddb('clients')) == ['c1', 'c2', 'c3']
+    assert scans == [None, { 'client_id': { 'S': 'c2' } }]
@@ -0,0 +1,42 @@
+""" Concurrent check targets: timed out target skips its alerts and writes """
+import threading
+
+from conftest import RUN_TIME
+
+
+def test_timed_out_target_skips_side_effects(main_func):
+    main_func.warm_shared_context_02 = lambda targets: None
+    targets = [dict(main_func.load_check_targets_01()[0], name=name, table_name=f'clients_{name}',
+        elastic_url=f'https://{name}') for name in ('fast', 'slow')]
+    release, slow_finished = threading.Event(), threading.Event()
+    side_effects = []
+
+    def get_es_raw_data(host_url):
+        if host_url == 'https://slow':
+            release.wait(5)
+        return []
+    def stage(name):
+        def record(ids_dict, var_object):
+            side_effects.append((var_object['target_name'], name))
+            return ids_dict
+        return record
+    check_target = main_func.check_target_03
+    def check_target_until_finished(target, *args):
+        try:
+            return check_target(target, *args)
+        finally:
+            if target['name'] == 'slow':
+                slow_finished.set()
+
+    main_func.check_target_03 = check_target_until_finished
+    main_func.get_es_raw_data_01 = get_es_raw_data
+    for name in ('all_notification_02', 'write_all_to_elastic_02', 'update_ddb_elements_02'):
+        setattr(main_func, name, stage(name))
+
+    results = main_func.check_all_targets_03(targets, RUN_TIME, '2019-05-06', 0.5)
+    assert 'timings' in results['fast']
+    assert 'timeout' in results['slow']['error']
+    release.set() # slow target gets its keepalive data after the run gave it up
+    assert slow_finished.wait(5)
+    assert side_effects == [('fast', 'all_notification_02'), ('fast', 'write_all_to_elastic_02'),
+        ('fast', 'update_ddb_elements_02')]
@@ -0,0 +1,164 @@
+""" Regression checks of MainFunc compare logic (no network, no AWS).
+
+Silent client: active client without any keepalive message has to flip to absent and get one
+KEEPALIVE alert after exactly alert_hysteresis_runs runs, for every hysteresis setting:
+    python tools/check_compare.py                       # alert_hysteresis_runs 1..5
+    python tools/check_compare.py --max-hysteresis 8
+Engine equivalence (numpy installed only): random fleets of state store items and keepalive counts, with
+missing fields, odd statuses and times at tier/realert bounds, have to give the same results, tier counts,
+new client ids and status transitions in compare_columnar_02 as in compare_parsed_data_es_ddb_02:
+    python tools/check_compare.py --fleets 500 --seed 7
+Exit code 1 if any check fails.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+from bench_main_func import load_main_func
+
+START_TIME = datetime.datetime(2019, 5, 6, 19, 0, 0)
+# seconds before run time: around tier, realert, still dead and big_time_delta bounds
+TIME_OFFSETS = (0, 30, 60, 299, 300, 301, 900, 901, 1800, 1801, 3600, 43199, 43200, 43201, 50000, 90000)
+STATE_TIME_FIELDS = ('last_status_change', 'last_ka_alert_notify', 'last_restore_alert_notify', 'last_still_dead_notify', 'last_update')
+
+
+def silent_client_runs(module, compare_func, hysteresis_runs, max_runs):
+    """ Return (run number of flip to absent, KEEPALIVE alerts) of active client silent from first run """
+    module.alert_hysteresis_runs = hysteresis_runs
+    var_obj = { 'shared_main_time': module.time_to_str_01(START_TIME) }
+    ddb_dict = module.ddb_raw_data_parser_02({ 'Items': [{
+        'client_id'             : { 'S': 'silent-client' },
+        'client_name'           : { 'S': 'silent' },
+        'client_callcentername' : { 'S': 'callcenter' },
+        'status'                : { 'S': 'active' },
+        'last_status_change'    : { 'S': '2019-05-06T10:00:00.000Z' }
+    }] }, var_obj)
+    flipped_at = None
+    alerts = 0
+    for run in range(1, max_runs + 1):
+        var_obj = { 'shared_main_time': module.time_to_str_01(START_TIME + datetime.timedelta(minutes=run)) }
+        compared = compare_func({}, ddb_dict, var_obj)
+        compared, grouped_alerts, alert_clients = module.collect_alerts_02(compared, var_obj)
+        for alert_kind, client_ids in alert_clients.items():
+            module.mark_alerts_sent_01(compared, client_ids, alert_kind, var_obj)
+        alerts += sum(len(names) for names in grouped_alerts['keepalive'].values())
+        if flipped_at is None and compared['silent-client']['status'] == 'absent':
+            flipped_at = run
+        ddb_dict = compared
+    return flipped_at, alerts
+
+
+def random_time(rng, run_time):
+    moment = run_time - datetime.timedelta(seconds=rng.choice(TIME_OFFSETS) + rng.choice((0, 0, 0.5)))
+    millis = '%03d' % rng.randint(0, 999) if rng.random() < 0.5 else '000'
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + millis + 'Z'
+
+
+def random_fleet(module, rng, fleet_num, run_time):
+    """ Return (es_dict, ddb_dict) of random fleet: state store items with missing fields, unknown status
+    and pending changes, keepalive counts around count_compare_number, new clients """
+    clients = rng.randint(0, 400)
+    items = []
+    for num in range(clients):
+        item = {
+            'client_id'             : { 'S': f'c{fleet_num}-{num}' },
+            'client_name'           : { 'S': f'n{num}' },
+            'client_callcentername' : { 'S': f'cc{num % 5}' }
+        }
+        if rng.random() < 0.9:
+            item['status'] = { 'S': rng.choice(('active', 'absent', 'active', 'absent', 'unknown')) }
+        for field in STATE_TIME_FIELDS:
+            if rng.random() < 0.9:
+                item[field] = { 'S': random_time(rng, run_time) }
+        if rng.random() < 0.8:
+            item['pending_status'] = { 'S': rng.choice(('active', 'absent')) }
+            item['pending_count'] = { 'N': str(rng.randint(0, 3)) }
+        if rng.random() < 0.8:
+            item['flap_count'] = { 'N': str(rng.randint(0, 9)) }
+        if rng.random() < 0.5:
+            item['version'] = { 'N': str(rng.randint(0, 9)) }
+        items.append(item)
+    var_obj = { 'shared_main_time': module.time_to_str_01(run_time) }
+    ddb_dict = module.ddb_raw_data_parser_02({ 'Items': items }, var_obj)
+    count = module.count_compare_number
+    es_dict = {}
+    for num in range(clients + 20):
+        if rng.random() < 0.6:
+            client_id = f'c{fleet_num}-{num}'
+            es_dict[client_id] = {
+                'client_id'             : client_id,
+                'client_name'           : 'name',
+                'client_callcentername' : 'callcenter',
+                'last_time_active'      : var_obj['shared_main_time'],
+                'id_count'              : rng.choice((0, 1, count - 1, count, count + 1, count + 3))
+            }
+    return es_dict, ddb_dict
+
+
+def engine_mismatches(module, fleets, seed):
+    """ Return fleet numbers where columnar and python engines differ (settings are random per fleet) """
+    mismatches = []
+    run_time = START_TIME + datetime.timedelta(minutes=41, seconds=32)
+    for fleet_num in range(fleets):
+        rng = random.Random(seed * 100003 + fleet_num)
+        module.alert_hysteresis_runs = rng.choice((1, 2, 3))
+        module.tier_interval_minutes = { 'hot': 1, 'warm': rng.choice((1, 5)), 'cold': rng.choice((1, 7, 60)) }
+        es_dict, ddb_dict = random_fleet(module, rng, fleet_num, run_time)
+        var_python = { 'shared_main_time': module.time_to_str_01(run_time) }
+        var_columnar = dict(var_python)
+        python_result = module.compare_parsed_data_es_ddb_02(es_dict, ddb_dict, var_python)
+        columnar_result = module.compare_columnar_02(es_dict, ddb_dict, var_columnar)
+        if json.dumps(python_result) != json.dumps(columnar_result) or \
+                list(var_python['tier_counts'].items()) != list(var_columnar['tier_counts'].items()) or \
+                var_python['new_client_ids'] != var_columnar['new_client_ids'] or \
+                var_python['status_transitions'] != var_columnar['status_transitions']:
+            mismatches.append(fleet_num)
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-hysteresis', type=int, default=5, help='check alert_hysteresis_runs 1..N')
+    parser.add_argument('--fleets', type=int, default=300, help='random fleets of engine equivalence check')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    module = load_main_func()
+    module.logger.setLevel(logging.ERROR)
+    engines = [('python', module.compare_parsed_data_es_ddb_02)]
+    numpy_installed = module.get_numpy_00() is not None
+    if numpy_installed:
+        engines.append(('columnar', module.compare_columnar_02))
+    hysteresis_default = module.alert_hysteresis_runs
+    tier_default = dict(module.tier_interval_minutes)
+
+    failures = 0
+    for engine_name, compare_func in engines:
+        for hysteresis_runs in range(1, args.max_hysteresis + 1):
+            flipped_at, alerts = silent_client_runs(module, compare_func, hysteresis_runs, hysteresis_runs + 5)
+            ok = flipped_at == hysteresis_runs and alerts == 1
+            failures += 0 if ok else 1
+            print(f'silent client [{engine_name}] hysteresis {hysteresis_runs}: absent at run {flipped_at}, '
+                f'{alerts} KEEPALIVE alerts {"ok" if ok else "FAILED"}')
+    module.alert_hysteresis_runs = hysteresis_default
+
+    if not numpy_installed:
+        print('engine equivalence: skipped, numpy is not installed')
+    else:
+        mismatches = engine_mismatches(module, args.fleets, args.seed)
+        module.alert_hysteresis_runs = hysteresis_default
+        module.tier_interval_minutes = tier_default
+        failures += len(mismatches)
+        print(f'engine equivalence: {args.fleets} random fleets, {len(mismatches)} mismatches '
+            f'{"ok" if not mismatches else "FAILED, fleets " + str(mismatches[:10])}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,284 @@
+""" Replay historical keepalive documents through MainFunc compare/alert logic (backtesting).
+
+Input is NDJSON dump of keepalive documents, one per line, either elasticsearch hits
+({"_source": {"machineData": {...}}}) or plain sources ({"machineData": {...}}), sorted by
+machineData.machineTimeUTC (use --sort for unsorted dumps). The file is streamed once; for every
+minute (tick) the keepalive window is moved forward and compare_parsed_data_es_ddb_02 +
+collect_alerts_02 of functions/main-func.py run with shared_main_time = tick (every alert counts as sent), for every parameter set:
+    python tools/replay_keepalive.py keepalive-dump.ndjson \\
+        --grid '{"count_compare_number": [10, 15], "alert_hysteresis_runs": [1, 2]}'
+Parameters: count_compare_number, window_seconds (keepalive window of get_es_raw_data_01, 180),
+still_dead_alert_interval, ka_realert_seconds, restore_realert_seconds (seconds), alert_hysteresis_runs.
+Output per parameter set: alert counts, detection latency (alert time - last keepalive of client),
+status flips per client per day and KEEPALIVE alerts restored within --flap-window seconds.
+The first window_seconds of the dump are warm-up (no compare, no metrics). Clients seen at the first
+tick after warm-up were known to the live system before the dump and start with the status of that
+observation; clients first seen later are enrolled like SupportFunc does (parser defaults: status absent,
+last RESTORE alert 12h ago), so they get the RESTORE alert the live system sends for new clients.
+"""
+import argparse
+import calendar
+import collections
+import datetime
+import itertools
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+from bench_main_func import load_main_func
+
+DEFAULT_PARAMS = {
+    'count_compare_number'      : 15,
+    'window_seconds'            : 180,
+    'still_dead_alert_interval' : 1800,
+    'ka_realert_seconds'        : 900,
+    'restore_realert_seconds'   : 900,
+    'alert_hysteresis_runs'     : 2
+}
+TICK_SECONDS = 60 # MainFunc schedule: cron(*/1 * * * ? *)
+
+minute_epoch_cache = {}
+
+
+def iso_to_epoch(iso_time):
+    """ Fast '2019-05-06T19:41:32.653Z' -> epoch seconds, strptime is done once per minute """
+    minute = minute_epoch_cache.get(iso_time[:16])
+    if minute is None:
+        minute = calendar.timegm(time.strptime(iso_time[:16], '%Y-%m-%dT%H:%M'))
+        minute_epoch_cache[iso_time[:16]] = minute
+    seconds = iso_time[17:-1] # "32.653"
+    return minute + float(seconds)
+
+
+def epoch_to_iso(epoch):
+    return datetime.datetime.utcfromtimestamp(epoch).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def read_keepalives(path, sort):
+    """ Yield (epoch, machineData) from NDJSON dump in time order """
+    def parse_lines():
+        with open(path) as dump_file:
+            for line in dump_file:
+                if not line.strip():
+                    continue
+                doc = json.loads(line)
+                machine_data = doc.get('_source', doc)['machineData']
+                yield iso_to_epoch(machine_data['machineTimeUTC']), machine_data
+    if sort:
+        yield from sorted(parse_lines(), key=lambda each: each[0])
+        return
+    previous = None
+    for epoch, machine_data in parse_lines():
+        if previous is not None and epoch < previous - TICK_SECONDS:
+            raise Exception(f'read_keepalives: dump is not sorted by time near {machine_data["machineTimeUTC"]}, use --sort')
+        previous = max(previous or epoch, epoch)
+        yield epoch, machine_data
+
+
+def expand_grid(grid):
+    names = sorted(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        params = dict(DEFAULT_PARAMS)
+        params.update(zip(names, values))
+        yield params
+
+
+def apply_params(module, params):
+    """ Point MainFunc globals to parameter set (functions read them at call time) """
+    module.count_compare_number = params['count_compare_number']
+    module.alert_hysteresis_runs = params['alert_hysteresis_runs']
+    module.still_dead_alert_interval = datetime.timedelta(seconds=params['still_dead_alert_interval'])
+    module.min_realert_interval = {
+        'keepalive' : datetime.timedelta(seconds=params['ka_realert_seconds']),
+        'restore'   : datetime.timedelta(seconds=params['restore_realert_seconds']),
+        'stilldead' : module.still_dead_alert_interval
+    }
+
+
+class KeepaliveWindow:
+    """ Sliding window of keepalive messages: per-client count of last window_seconds """
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self.messages = collections.deque()
+        self.counts = collections.Counter()
+
+    def add(self, epoch, client_id):
+        self.messages.append((epoch, client_id))
+        self.counts[client_id] += 1
+
+    def expire(self, tick_epoch):
+        while self.messages and self.messages[0][0] < tick_epoch - self.window_seconds:
+            _, client_id = self.messages.popleft()
+            self.counts[client_id] -= 1
+            if self.counts[client_id] == 0:
+                del self.counts[client_id]
+
+
+class ReplayRun:
+    """ State (DynamoDB table stand-in) and statistics of one parameter set """
+    def __init__(self, params):
+        self.params = params
+        self.ddb_dict = {}
+        self.alerts = { 'keepalive': 0, 'restore': 0, 'stilldead': 0 }
+        self.latencies = []
+        self.flips = 0
+        self.last_ka_alert = {}
+        self.quick_restores = 0
+        self.seeded = False
+
+    def enroll(self, module, es_dict, var_obj):
+        """ New clients get parser defaults, as after SupportFunc enrollment (status "absent": a client with
+        enough keepalives flips to active after hysteresis with a RESTORE alert, as in the live system).
+        On the first tick clients already known to the live system are seeded with status (and pending
+        status) of their first observation instead, so they do not all send RESTORE """
+        new_items = []
+        for client_id in es_dict:
+            if client_id in self.ddb_dict:
+                continue
+            item = {
+                'client_id'             : { 'S': client_id },
+                'client_name'           : { 'S': es_dict[client_id]['client_name'] },
+                'client_callcentername' : { 'S': es_dict[client_id]['client_callcentername'] }
+            }
+            if not self.seeded:
+                status = 'active' if es_dict[client_id]['id_count'] > module.count_compare_number else 'absent'
+                item.update(status={ 'S': status }, pending_status={ 'S': status },
+                    last_status_change={ 'S': var_obj['shared_main_time'] })
+            new_items.append(item)
+        self.seeded = True
+        if new_items:
+            self.ddb_dict.update(module.ddb_raw_data_parser_02({ 'Items': new_items }, var_obj))
+
+    def step(self, module, es_dict, var_obj, tick_epoch, last_seen, flap_window):
+        apply_params(module, self.params)
+        compared = module.compare_parsed_data_es_ddb_02(es_dict, self.ddb_dict, var_obj)
+        compared, _, alert_clients = module.collect_alerts_02(compared, var_obj)
+        for alert_kind, client_ids in alert_clients.items():
+            module.mark_alerts_sent_01(compared, client_ids, alert_kind, var_obj)
+        for client_id, element in compared.items():
+            if element['status_changes']:
+                self.flips += 1
+            if element['send_ka_alert_now']:
+                self.alerts['keepalive'] += 1
+                self.last_ka_alert[client_id] = tick_epoch
+                if client_id in last_seen:
+                    self.latencies.append(tick_epoch - last_seen[client_id])
+            if element['send_restore_alert_now']:
+                self.alerts['restore'] += 1
+                if tick_epoch - self.last_ka_alert.get(client_id, float('-inf')) <= flap_window:
+                    self.quick_restores += 1
+            if element['send_still_dead_alert_now']:
+                self.alerts['stilldead'] += 1
+            element['update_ddb'] = False # written back
+        self.ddb_dict = compared
+        self.enroll(module, es_dict, var_obj)
+
+    def summary(self, days):
+        latencies = sorted(self.latencies)
+        clients = max(len(self.ddb_dict), 1)
+        return {
+            'params'                : self.params,
+            'alerts'                : self.alerts,
+            'detection_latency_seconds' : {
+                'count' : len(latencies),
+                'mean'  : statistics.mean(latencies) if latencies else None,
+                'p50'   : latencies[len(latencies) // 2] if latencies else None,
+                'p95'   : latencies[int(len(latencies) * 0.95)] if latencies else None,
+                'max'   : latencies[-1] if latencies else None
+            },
+            'status_flips'          : self.flips,
+            'flips_per_client_day'  : self.flips / clients / max(days, 1 / 1440),
+            'quick_restores'        : self.quick_restores,
+            'clients'               : len(self.ddb_dict)
+        }
+
+
+def replay(module, keepalives, param_sets, flap_window):
+    """ Single pass over time-sorted keepalives, one tick per minute, all parameter sets at once """
+    runs = [ReplayRun(params) for params in param_sets]
+    windows = { size: KeepaliveWindow(size) for size in set(params['window_seconds'] for params in param_sets) }
+    last_seen = {}
+    client_info = {}
+    tick_epoch = None
+    first_tick = None
+    first_epoch = None
+    ticks = 0
+
+    def run_tick(tick):
+        var_obj = { 'shared_main_time': epoch_to_iso(tick) }
+        es_dicts = {}
+        for size, window in windows.items():
+            window.expire(tick)
+            es_dicts[size] = { client_id: {
+                'client_id'             : client_id,
+                'client_name'           : client_info[client_id][0],
+                'client_callcentername' : client_info[client_id][1],
+                'last_time_active'      : epoch_to_iso(last_seen[client_id]),
+                'id_count'              : count
+            } for client_id, count in window.counts.items() }
+        for run in runs:
+            if tick - first_epoch < run.params['window_seconds']:
+                continue # warm-up: window of dump start is not full, counts would seed clients absent
+            run.step(module, es_dicts[run.params['window_seconds']], var_obj, tick, last_seen, flap_window)
+
+    for epoch, machine_data in keepalives:
+        if tick_epoch is None:
+            first_epoch = epoch
+            tick_epoch = first_tick = (int(epoch) // TICK_SECONDS + 1) * TICK_SECONDS
+        while epoch >= tick_epoch:
+            run_tick(tick_epoch)
+            ticks += 1
+            tick_epoch += TICK_SECONDS
+        client_id = machine_data['id']
+        client_info[client_id] = (machine_data.get('name', ''), machine_data.get('callCenterName', ''))
+        last_seen[client_id] = max(epoch, last_seen.get(client_id, epoch))
+        for window in windows.values():
+            window.add(epoch, client_id)
+    if tick_epoch is not None:
+        run_tick(tick_epoch)
+        ticks += 1
+
+    days = ticks * TICK_SECONDS / 86400
+    return {
+        'first_tick'    : epoch_to_iso(first_tick) if first_tick else None,
+        'ticks'         : ticks,
+        'days'          : days,
+        'results'       : [run.summary(days) for run in runs]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('dump', help='NDJSON file with keepalive documents')
+    parser.add_argument('--grid', default='{}', help='json: parameter -> list of values')
+    parser.add_argument('--sort', action='store_true', help='load and sort dump by time before replay')
+    parser.add_argument('--flap-window', type=int, default=900, help='seconds: RESTORE this soon after KEEPALIVE is a flap')
+    parser.add_argument('--output', help='write results as json to this file')
+    args = parser.parse_args()
+
+    module = load_main_func()
+    module.logger.setLevel(logging.ERROR)
+    param_sets = list(expand_grid(json.loads(args.grid)))
+
+    started = time.perf_counter()
+    report = replay(module, read_keepalives(args.dump, args.sort), param_sets, args.flap_window)
+    report['elapsed_seconds'] = time.perf_counter() - started
+
+    print(f'{report["ticks"]} ticks ({report["days"]:.2f} days) replayed in {report["elapsed_seconds"]:.1f} s')
+    for result in report['results']:
+        latency = result['detection_latency_seconds']
+        print(json.dumps(result['params'], sort_keys=True))
+        print(f'    alerts {result["alerts"]}  latency p50 {latency["p50"]} p95 {latency["p95"]}  '
+            f'flips/client/day {result["flips_per_client_day"]:.3f}  quick restores {result["quick_restores"]}')
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
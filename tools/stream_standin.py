@@ -0,0 +1,120 @@
+""" Local stand-in of the keepalive stream for MainFunc stream_handler (keepalive_source "stream").
+
+Reads NDJSON keepalive documents ({"logType": "Keepalive", "machineData": {...}} or elasticsearch hits
+with "_source") from a file or stdin, sends them in Kinesis-style batches to stream_handler of
+functions/main-func.py and runs the scheduled sweep (lambda_handler) every --sweep-seconds. State is
+kept in sqlite state store, slack alerts are printed, nothing is written to elasticsearch:
+    python tools/stream_standin.py keepalive-dump.ndjson --retime
+    tail -f keepalive.ndjson | python tools/stream_standin.py - --retime      # queue: keep reading stdin
+    python tools/stream_standin.py queue.ndjson --follow --state /tmp/standin.sqlite3
+--retime sets machineTimeUTC of every message to the time it is read (replay of old dumps in real time).
+"""
+import argparse
+import base64
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+from bench_main_func import load_main_func
+
+
+def read_messages(path, follow, poll_seconds):
+    """ Yield keepalive document of every line; None when no new line is there (follow mode), so caller can flush """
+    source = sys.stdin if path == '-' else open(path)
+    while True:
+        line = source.readline()
+        if not line:
+            if not follow:
+                return
+            yield None
+            time.sleep(poll_seconds)
+            continue
+        if not line.strip():
+            continue
+        doc = json.loads(line)
+        yield doc.get('_source', doc)
+
+
+def kinesis_event(docs, first_sequence):
+    """ Batch of keepalive documents in stream_handler (Kinesis) event format """
+    return { 'Records': [{
+        'eventSource'   : 'aws:kinesis',
+        'kinesis'       : {
+            'partitionKey'      : doc['machineData']['id'],
+            'sequenceNumber'    : str(first_sequence + num),
+            'data'              : base64.b64encode(json.dumps(doc).encode()).decode()
+        }
+    } for num, doc in enumerate(docs)] }
+
+
+def print_alert(message_title, message_text, var_object=None):
+    print(f'{datetime.datetime.utcnow().isoformat()} SLACK {message_title}\n{message_text}')
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source', help="NDJSON file with keepalive documents, '-' for stdin")
+    parser.add_argument('--follow', action='store_true', help='wait for new lines at end of file (queue)')
+    parser.add_argument('--retime', action='store_true', help='set machineTimeUTC of messages to current time')
+    parser.add_argument('--batch-size', type=int, default=100, help='max records per stream_handler call')
+    parser.add_argument('--batch-seconds', type=float, default=1.0, help='max age of batch before it is sent')
+    parser.add_argument('--sweep-seconds', type=float, default=60, help='interval of scheduled sweep runs')
+    parser.add_argument('--state', default='/tmp/stream-standin.sqlite3', help='sqlite state store file')
+    parser.add_argument('--table', default='MonitoringService_clients_standin')
+    args = parser.parse_args()
+
+    os.environ['func_state_store'] = 'sqlite'
+    os.environ['func_state_store_path'] = args.state
+    os.environ['es_keepalive_source'] = 'stream'
+    os.environ['DDB_table_name'] = args.table
+    os.environ.setdefault('func_log_level', 'WARNING')
+    module = load_main_func()
+    module.logger.setLevel(logging.WARNING)
+    module.slack_notification_01 = print_alert
+    module.request_next_index_02 = lambda var_object, index_prefix: False
+
+    batch = []
+    sequence = 0
+    batch_started = last_sweep = time.monotonic()
+
+    def send_batch():
+        nonlocal batch, sequence
+        if batch:
+            response = module.stream_handler(kinesis_event(batch, sequence), None)
+            print(f'stream batch: {response["records"]} records, {response["clients"]} clients, '
+                f'{response["checked_clients"]} checked, restored {response.get("restored_clients", [])}')
+            sequence += len(batch)
+            batch = []
+
+    def sweep():
+        response = module.lambda_handler({}, None)
+        statuses = [element['status'] for element in response['data_after_act'].values()]
+        print(f'sweep {response["current_time"]}: {statuses.count("active")} active, {statuses.count("absent")} absent')
+
+    for doc in read_messages(args.source, args.follow, min(args.batch_seconds, 1.0)):
+        now = time.monotonic()
+        if doc is not None:
+            if args.retime:
+                doc['machineData']['machineTimeUTC'] = module.get_current_time_str_02()[:-5] + \
+                    '.%03dZ' % (datetime.datetime.utcnow().microsecond // 1000)
+            if not batch:
+                batch_started = now
+            batch.append(doc)
+        if len(batch) >= args.batch_size or (batch and now - batch_started >= args.batch_seconds):
+            send_batch()
+        if now - last_sweep >= args.sweep_seconds:
+            send_batch()
+            sweep()
+            last_sweep = now
+    send_batch()
+    sweep()
+
+
+if __name__ == '__main__':
+    main()